@@ -1,6 +1,23 @@
+import ast
 import math
+import os
 
-def calcDistanceFromPixels(offset):
-    return ((offset/3)/math.tan(0.197))
+def loadVisionModel():
+    """Loads VisionModel from the robot program, which keeps it so the program stays a single file.
+    Only the class is compiled: the rest of the program needs the vex module and runs the robot."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main-auto-tweaks.py")
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == "VisionModel":
+            namespace = {"math": math}
+            exec(compile(ast.Module([node], []), path, "exec"), namespace)
+            namespace["VisionModel"].build()
+            return namespace["VisionModel"]
+    raise RuntimeError("VisionModel not found in " + path)
 
-print(calcDistanceFromPixels(60))
\ No newline at end of file
+VisionModel = loadVisionModel()
+
+def calcDistanceFromWidth(width, large = True):
+    """Distance in cm to a fruit that is width pixels wide, from the same tables the robot uses"""
+    return VisionModel.distance(width, large)
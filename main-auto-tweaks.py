@@ -130,11 +130,15 @@ Color IDs:
 4: Pink
 """
 wallHeadings = [90,0,270,180]
+fieldSize = (2440, 2440)
+"""field width (west to east, wall 0 to wall 2) and height (south to north, wall 1 to wall 3) in mm"""
 
 # Library imports
 from vex import (Brain, Controller, Inertial, Ports, Sonar, Motor, FORWARD, PERCENT, REVERSE, DEGREES, RotationUnits, Timer, Line, MM, Triport, XAXIS, YAXIS)
 from vex import *
 import math
+import struct
+from array import array
 brain = Brain()
 controller = Controller()
 
@@ -143,33 +147,39 @@ systemTime = prevSystemTime + 1
 dt = lambda : systemTime - prevSystemTime
 
 class States:
-    """List of states."""
-    DEFAULT = "DEFAULT"     # There must be a better way to do this, but this was the best way I could find to make the states indexable with 'States.*' and be reversible back to the state name.
-    WALL_FOLLOWING = "Following Wall Right"
-    WALL_FOLLOWING_REVERSE = "Following Wall Left"
-    TURNING = "Turning"
-    FRUITFOLLOWING = "Fruit Grabbing"
-    DROPFRUIT = "Placing fruit in tray"
-    CLOSING = "Closing Gripper"
-    WALL_RETURN = "Returning To Wall"
-    BASKET_FOLLOWING = "Following Baskets"
-    UNLOAD = "Unloading"
-    COLLECTION_INIT = "Initializing Collection Mode"
-    BACK_AWAY = "Backing Away"
-    UNLOAD_RAISE_ARM = "Raising arm"
-    UNLOAD_LOWER_ARM = "Lowering arm"
+    """List of states. States are integer ids that index the state machine's tables; States.names has the display name of each."""
+    DEFAULT = 0
+    WALL_FOLLOWING = 1
+    WALL_FOLLOWING_REVERSE = 2
+    TURNING = 3
+    FRUITFOLLOWING = 4
+    DROPFRUIT = 5
+    CLOSING = 6
+    WALL_RETURN = 7
+    BASKET_FOLLOWING = 8
+    UNLOAD = 9
+    COLLECTION_INIT = 10
+    BACK_AWAY = 11
+    UNLOAD_RAISE_ARM = 12
+    UNLOAD_LOWER_ARM = 13
+    DRIVE_TO_FRUIT = 14
+    names = ["DEFAULT", "Following Wall Right", "Following Wall Left", "Turning", "Fruit Grabbing", "Placing fruit in tray", "Closing Gripper",
+             "Returning To Wall", "Following Baskets", "Unloading", "Initializing Collection Mode", "Backing Away", "Raising arm", "Lowering arm",
+             "Driving To Fruit"]
 class Modes:
-    """List of Modes."""
-    NAVIGATE = "NAVIGATE"
-    DEFAULT = "DEFAULT"
-    TELEOP = "TELEOP"
-    FRUITFOLLOWING = "Fruit Following"
-    CALIBRATE = "Calibrating Gyro"
-    COLLECTION = "Collecting Fruit"
+    """List of Modes. Integer ids like States, with display names in Modes.names."""
+    NAVIGATE = 0
+    DEFAULT = 1
+    TELEOP = 2
+    FRUITFOLLOWING = 3
+    CALIBRATE = 4
+    COLLECTION = 5
+    names = ["NAVIGATE", "DEFAULT", "TELEOP", "Fruit Following", "Calibrating Gyro", "Collecting Fruit"]
 
 currentState = States.DEFAULT
 """Current system state. Default is IDLE."""
-currentMode = Modes.DEFAULT
+currentMode = Modes.CALIBRATE
+"""Current mode. Starts calibrating the gyro, then switches to DEFAULT."""
 newState = None
 """state to change to on the next cycle"""
 returnState = None
@@ -177,11 +187,82 @@ returnState = None
 returnMode = None
 """mode to return to after the next mode ends (only some modes/states allow variable return)"""
 
+class CachedMotor:
+    """Wraps a Motor or MotorGroup and only sends a command when it differs from the last one sent. \n
+    Velocities within the deadband of the last sent value are dropped, and an unchanged command is resent after the refresh interval.
+    Position targets have no deadband: only the same target is dropped, since a nearby target is a different move.
+    Smart port bandwidth is shared with the vision sensor, so the control loop should not repeat itself every cycle.
+    Anything other than spin/stop/spin_to_position/set_position goes straight to the wrapped motor."""
+    deadband = 0.5
+    """default velocity deadband in the command's units"""
+    refreshInterval = 500000
+    """microseconds after which an unchanged command is sent again"""
+    totalSent = 0
+    totalSuppressed = 0
+
+    def __init__(self, motor : Motor | MotorGroup, deadband : float | None = None) -> None:
+        self.motor = motor
+        self.deadband = CachedMotor.deadband if deadband == None else deadband
+        self.command = None
+        """(kind, direction, units, ...) of the last sent command, None to force the next one"""
+        self.value = 0.0
+        """velocity or position of the last sent command"""
+        self.sentAt = 0
+        self.sent = 0
+        self.suppressed = 0
+
+    def __getattr__(self, name):
+        return getattr(self.motor, name)
+
+    def changed(self, command : tuple, value : float, deadband : float | None = None):
+        """Returns True and records the command if it should be sent. deadband defaults to the motor's velocity deadband."""
+        if deadband == None:
+            deadband = self.deadband
+        now = brain.timer.system_high_res()
+        if command == self.command and abs(value - self.value) <= deadband and now - self.sentAt < CachedMotor.refreshInterval:
+            self.suppressed += 1
+            CachedMotor.totalSuppressed += 1
+            return False
+        self.command = command
+        self.value = value
+        self.sentAt = now
+        self.sent += 1
+        CachedMotor.totalSent += 1
+        return True
+
+    def spin(self, direction, velocity : float, units = PERCENT):
+        if self.changed(("spin", direction, units), velocity):
+            self.motor.spin(direction, velocity, units)
+    def stop(self, mode = None):
+        if self.changed(("stop", mode), 0):
+            if mode == None:
+                self.motor.stop()
+            else:
+                self.motor.stop(mode)
+    def spin_to_position(self, rotation : float, units, velocity : float, velocityUnits, wait = True):
+        if wait: # blocking moves are always sent, they are not repeated every cycle
+            self.command = None
+            self.sent += 1
+            CachedMotor.totalSent += 1
+            return self.motor.spin_to_position(rotation, units, velocity, velocityUnits, wait)
+        if self.changed(("position", units, velocity, velocityUnits), rotation, 0):
+            self.motor.spin_to_position(rotation, units, velocity, velocityUnits, wait)
+    def set_position(self, value : float, units):
+        self.motor.set_position(value, units)
+        self.command = None # a position target now means something else
+
 class Drivetrain:
+    wheelDiameter = 101.6
+    """drive wheel diameter in mm (4 inch omni wheels)"""
+    sonarBOffset = 200
+    """distance from the robot center to the back sonar in mm"""
+    sonarROffset = 200
+    """distance from the robot center to the right sonar in mm"""
+
     def __init__(self, gyro : Inertial):
         # self.gyro = gyro
-        self.gyroHeading = lambda : gyro.heading()*(math.pi/180) # lambda is not needed but is more convenient
-        self.prevGyroHeading = self.gyroHeading()
+        self.gyroHeading = lambda : frame.heading*(math.pi/180) # lambda is not needed but is more convenient
+        self.prevGyroHeading = gyro.heading()*(math.pi/180) # the sensor frame does not exist yet while the robot is being built
         self.prevTime = brain.timer.system()
         """gyro position in radians"""
         self.driving = False
@@ -189,9 +270,17 @@ class Drivetrain:
         """Reset every cycle. Used to automatically stop motors when not recieving input. \n
         Drivetrain.driving should be used to determine if the drivetrain is in active use."""
         self.robotPos : tuple[float, float] = (0,0)
-        """coordinate position of the robot relative to the starting point"""
-        self.gyroVel : tuple[float, float] = (0,0)
-        """velocity estimate from integrating accelerometer"""
+        """coordinate position of the robot in mm relative to the starting point. +x is east (heading 90), +y is north (heading 0)"""
+        self.robotVel : tuple[float, float] = (0,0)
+        """field relative velocity in mm/s"""
+        self.robotRelativeVel : tuple[float, float] = (0,0)
+        """robot relative velocity in mm/s. +x is forward, +y is right"""
+        self.odometryWheels : list[float] = [0,0,0,0]
+        """drive motor positions in degrees (FL, FR, BL, BR) at the previous odometry update"""
+        self.odometryHeading = self.prevGyroHeading
+        """gyro heading in radians at the previous odometry update"""
+        self.positionKnown = False
+        """True once robotPos has been set from the walls and is a field position (origin in the corner of walls 0 and 1)"""
         self.allowMovementAxis = [True, True, True]
 
     def stopAll(self):
@@ -248,12 +337,83 @@ class Drivetrain:
             self.stopAll()
 
     def updateOdometry(self):
-        """Updates the robot position. """
-        self.gyroVel = (self.gyroVel[0] + gyro.acceleration(XAXIS) / 9.8 * dt()/1000000, self.gyroVel[1] + gyro.acceleration(YAXIS) / 9.8 * dt()/1000000)
-        self.robotPos = (self.robotPos[0] + self.gyroVel[0] * dt()/1000000, self.robotPos[1] + self.gyroVel[1] * dt()/1000000)
+        """Updates the robot position and velocity from the drive encoders in the sensor frame. \n
+        The wheel travel gives the robot relative motion (X-drive forward kinematics) and the gyro gives the heading it is rotated by,
+        so wheel slip while turning does not corrupt the heading."""
+        wheels = [frame.driveFL, frame.driveFR, frame.driveBL, frame.driveBR]
+        mmPerDegree = math.pi * Drivetrain.wheelDiameter / 360
+        dFL = (wheels[0] - self.odometryWheels[0]) * mmPerDegree
+        dFR = (wheels[1] - self.odometryWheels[1]) * mmPerDegree
+        dBL = (wheels[2] - self.odometryWheels[2]) * mmPerDegree
+        dBR = (wheels[3] - self.odometryWheels[3]) * mmPerDegree
+        self.odometryWheels = wheels
+
+        # wheels are mounted at 45 degrees, so each one only moves a 1/sqrt(2) of the robot's travel
+        dForward = (dFL + dFR + dBL + dBR) / 4 * math.sqrt(2)
+        dRight = (dFL - dFR - dBL + dBR) / 4 * math.sqrt(2)
+
+        # rotate by the average heading over the update
+        heading = self.gyroHeading()
+        dHeading = (heading - self.odometryHeading + math.pi) % (2*math.pi) - math.pi
+        midHeading = self.odometryHeading + dHeading / 2
+        self.odometryHeading = heading
+        dX = dForward * math.sin(midHeading) + dRight * math.cos(midHeading)
+        dY = dForward * math.cos(midHeading) - dRight * math.sin(midHeading)
+        self.robotPos = (self.robotPos[0] + dX, self.robotPos[1] + dY)
+
+        if dt() > 0:
+            self.robotVel = (dX / dt() * 1000000, dY / dt() * 1000000)
+            self.robotRelativeVel = (dForward / dt() * 1000000, dRight / dt() * 1000000)
+
+    def resetOdometry(self, position : tuple[float, float] = (0,0)):
+        """Sets the robot position without moving the encoder reference, e.g. when it is known from a wall."""
+        self.robotPos = position
+        self.robotVel = (0,0)
+        self.robotRelativeVel = (0,0)
+        self.odometryWheels = [frame.driveFL, frame.driveFR, frame.driveBL, frame.driveBR]
+        self.odometryHeading = self.gyroHeading()
+
+    def setHeading(self, heading : float):
+        """Sets the gyro heading in degrees. The odometry is re-seeded with it, so the jump is not taken as a turn."""
+        gyro.set_heading(heading)
+        self.odometryHeading = heading * math.pi / 180
+
+    def locateFromWall(self, wall : int, wallDist : float, sideDist : float):
+        """Sets the field position while the robot has its back to the wall and the next wall is to its right. \n
+        The readings are corrected for the robot not being square to the walls. \n
+        sideDist is ignored if the sonar can't see the next wall (0 or over 2000 mm). On wall 0 the back sonar sees the baskets instead of the wall, so only sideDist is used."""
+        skew = math.cos(((frame.heading - wallHeadings[wall] + 180) % 360 - 180) * math.pi / 180)
+        seesSide = 0 < sideDist < 2000
+        x = self.robotPos[0]
+        y = self.robotPos[1]
+        back = (wallDist + Drivetrain.sonarBOffset) * skew
+        side = (sideDist + Drivetrain.sonarROffset) * skew
+        if wall == 0:
+            if seesSide:
+                self.robotPos = (x, side)
+            return
+        elif wall == 1:
+            y = back
+            x = fieldSize[0] - side if seesSide else x
+        elif wall == 2:
+            x = fieldSize[0] - back
+            y = fieldSize[1] - side if seesSide else y
+        else:
+            y = fieldSize[1] - back
+            x = side if seesSide else x
+        self.robotPos = (x, y)
+        self.positionKnown = True
+
+    def distanceFrom(self, position : tuple[float, float], heading : float):
+        """Distance in mm the robot has moved from position along heading (degrees)"""
+        h = heading * math.pi / 180
+        return (self.robotPos[0] - position[0]) * math.sin(h) + (self.robotPos[1] - position[1]) * math.cos(h)
 
 class Arm:
-    def __init__(self, liftGroup : MotorGroup, gripper : Motor) -> None:
+    holdingPosition = -20
+    """gripper position in degrees below which a closed gripper is holding a fruit"""
+
+    def __init__(self, liftGroup : CachedMotor, gripper : CachedMotor) -> None:
         liftGroup.set_stopping(HOLD)
         self.liftGroup = liftGroup
         gripper.set_stopping(HOLD)
@@ -294,6 +454,10 @@ class Arm:
             self.zeroed = True
             return True
 
+    def holdingFruit(self):
+        """True if the gripper closed on something. It closes to about 0 degrees on nothing and stops short on a fruit."""
+        return self.gripperStatus == 1 and self.gripper.position(DEGREES) < Arm.holdingPosition
+
     def goDefault(self):
         self.active = True
         self.liftGroup.spin_to_position(0.75, TURNS, 50, PERCENT, False) # 0.6 turns
@@ -483,6 +647,37 @@ class Camera:
         "codes": []
         }
     
+    coastTime = 300000
+    """microseconds the target filter keeps extrapolating a fruit that is not seen"""
+    dropTime = 1000000
+    """microseconds after which a fruit that is not seen is dropped"""
+    frameLatency = 10000
+    """microseconds from the sensor capturing a frame to Camera.update() reading it, on average half of a 50 Hz frame"""
+    commandLatency = 10000
+    """microseconds from a control cycle to the motors acting on its command"""
+    forwardOffset = 200
+    """distance from the robot center forward to the camera in mm"""
+    fieldOfView = 60
+    """horizontal field of view in degrees"""
+    AREA = 0
+    HEIGHT = 1
+    DISTANCE = 2
+    sizeMetric = HEIGHT
+    """how objects are compared to find the largest: Camera.AREA or Camera.HEIGHT in pixels, or Camera.DISTANCE to prefer the nearest by the VisionModel range"""
+    minArea = 50
+    """objects with a smaller pixel area are ignored"""
+    maxLocated = 24
+    """size of the located object buffers: 8 objects (the take_snapshot default) for each of the 3 fruit signatures"""
+
+    @classmethod
+    def size(cls, object : VisionObject):
+        """Size of an object by Camera.sizeMetric. Always positive and larger for closer fruit, so sizes can be compared as ratios."""
+        if cls.sizeMetric == Camera.AREA:
+            return object.width * object.height
+        if cls.sizeMetric == Camera.DISTANCE:
+            return 1 / VisionModel.distance(object.width, object.width > 0.9 * object.height)
+        return object.height
+
     @classmethod
     def createSigList(cls):
         sigList : list[Signature] = []
@@ -508,19 +703,98 @@ class Camera:
         self.largestObjectType = 0
         """the (0 indexed) id of the signature of the largest object found this cycle"""
 
-        self.locatedVisionObjects : list[LocatedVisionObject] = []
-        """visionResults list converted to a single list of LocatedVisionObject"""
+        self.locatedDist = array('f', [0] * Camera.maxLocated)
+        """dist of each fruit object in visionResults, see LocatedVisionObject. Parallel preallocated buffers, the first locatedCount entries are valid."""
+        self.locatedHeight = array('f', [0] * Camera.maxLocated)
+        self.locatedAngle = array('f', [0] * Camera.maxLocated)
+        self.locatedColor = bytearray(Camera.maxLocated)
+        self.locatedType = bytearray(Camera.maxLocated)
+        self.locatedCount = 0
+        self.newest = LocatedVisionObject(0, 0, 0, 0, 0)
+        """preallocated storage for the largest object of the latest update, before filtering"""
         self.averageLargestObject : LocatedVisionObject | None = None
-        """largest vision object averaged over 50 cycles"""
-        self.pastLargestLocatedObjects : list[LocatedVisionObject] = []
+        """largest vision object smoothed by the target filter. Kept for Camera.dropTime after the fruit was last seen."""
+        self.averageObject = LocatedVisionObject(0, 0, 0, 0, 0)
+        """preallocated storage for averageLargestObject, updated in place"""
+        self.target = TargetFilter()
+        """filter behind averageLargestObject, with the velocities and covariances"""
         self.noDetectCounter = 0
-        """cycles since vision object was detected"""
+        """microseconds since vision object was detected"""
+        self.updateTime = brain.timer.system_high_res()
+        """time of the latest Camera.update() in microseconds"""
+        self.updateDt = 1
+        """microseconds between the latest two updates. The camera runs at its own rate, so dt() is not used here."""
 
         self.sigList = Camera.createSigList()
         self.vision = Vision(PortVision, Camera.cameraConfig["brightness"], *self.sigList)
         self.take_snapshot = self.vision.take_snapshot
-        self.largest_object = self.vision.largest_object
+
+        # signature scheduling
+        self.configuredSigs : list[int] = [i for i in range(len(self.sigList)) if Camera.isConfigured(i)]
+        """(0 indexed) ids of the signatures that have been tuned. Empty signatures are never snapshotted."""
+        self.singleSigs : list[list[int]] = [[i] for i in range(len(self.sigList))]
+        """preallocated single signature schedules, see Camera.onlySig()"""
+        self.noSigs : list[int] = []
+        self.scheduledSigs : list[int] = self.configuredSigs
+        """signatures the current mode and state need"""
+        self.roundRobin = False
+        """True to snapshot one scheduled signature per cycle instead of all of them"""
+        self.roundRobinIndex = 0
+        self.sigLargest : list[VisionObject | None] = [None] * len(self.sigList)
+        """largest object found on the last snapshot of each signature"""
+        self.sigLargestSize : list[float] = [0] * len(self.sigList)
+        """Camera.size() of each sigLargest"""
+        self.sigTime : list[int] = [0] * len(self.sigList)
+        """time of the last snapshot of each signature in microseconds"""
+        self.sigHeading : list[float] = [0.0] * len(self.sigList)
+        """gyro heading at the last snapshot of each signature, extrapolated from the latest sensor frame"""
+        self.freshSigs : list[int] = self.noSigs
+        """signatures snapshotted by the latest update. Other visionResults are left over from earlier round robin cycles."""
+
+        # tracking
+        self.tracker = VisionTracker()
+        self.largestTrack : VisionTracker.Track | None = None
+        """track of the largest object (or of the locked track while locked)"""
+        self.locked = False
+        """True while a follower has locked onto one fruit, see Camera.lock()"""
+        self.lockedTrack : VisionTracker.Track | None = None
+        self.averageTrackId = 0
+        """id of the track filtered into averageLargestObject"""
+
+    @classmethod
+    def isConfigured(cls, sig : int):
+        """Returns whether the (0 indexed) signature has been tuned. Untuned signatures are all zeros."""
+        parameters = Camera.cameraConfig["signatures"][sig]["parameters"]
+        return parameters["uMin"] != 0 or parameters["uMax"] != 0 or parameters["vMin"] != 0 or parameters["vMax"] != 0
+
+    def onlySig(self, sig : int):
+        """Returns a schedule containing only the (0 indexed) signature, or no signatures if it is not configured"""
+        if sig in self.configuredSigs:
+            return self.singleSigs[sig]
+        return self.noSigs
+
+    def schedule(self, sigs : list[int], roundRobin : bool = False):
+        """Selects the signatures Camera.update() will snapshot. Should be given Camera.configuredSigs, Camera.onlySig() or Camera.noSigs. \n
+        With roundRobin, one signature is snapshotted per cycle and the others keep their results from their last snapshot."""
+        if sigs is not self.scheduledSigs:
+            for sig in self.scheduledSigs: # forget signatures that are no longer watched so they can't be picked as the largest
+                if not sig in sigs:
+                    self.visionResults[sig] = []
+                    self.sigLargest[sig] = None
+                    self.tracker.clear(sig)
+            self.scheduledSigs = sigs
+            self.roundRobinIndex = 0
+        self.roundRobin = roundRobin
     
+    def lock(self):
+        """Locks onto the track of the current largest object. While locked, largestObject and averageLargestObject only come from that fruit
+        (largestObject is None on updates it isn't seen), so a follower doesn't jump to another fruit. If the fruit is lost, the next largest object is locked."""
+        self.locked = True
+        self.lockedTrack = self.largestTrack
+    def unlock(self):
+        self.locked = False
+        self.lockedTrack = None
+
     def update(self):
         """updates all information related to vision"""
         # self.largestObject
@@ -528,52 +802,180 @@ class Camera:
         # self.visionResults
         # self.noDetectCounter
         # self.averageLargestObject
+        now = brain.timer.system_high_res()
+        self.updateDt = now - self.updateTime
+        self.updateTime = now
+
+        if self.roundRobin:
+            self.freshSigs = self.noSigs
+            if len(self.scheduledSigs) > 0:
+                self.roundRobinIndex = (self.roundRobinIndex + 1) % len(self.scheduledSigs)
+                self.snapshot(self.scheduledSigs[self.roundRobinIndex])
+                self.freshSigs = self.singleSigs[self.scheduledSigs[self.roundRobinIndex]]
+        else:
+            for sig in self.scheduledSigs:
+                self.snapshot(sig)
+            self.freshSigs = self.scheduledSigs
+
+        for sig in self.freshSigs:
+            self.tracker.update(sig, self.visionResults[sig], self.updateTime)
+
+        if self.lockedTrack != None and not self.lockedTrack in self.tracker.tracks: # the locked fruit was lost
+            self.lockedTrack = None
         self.largestObject = None
-        for sig in range (len(self.sigList)):
-            minArea = 50 # minimum allowable VisionObject area; smaller is ignored
-            sigResults = self.take_snapshot(self.sigList[sig])
-            self.visionResults[sig] = []
-
-            if sigResults != None:
-                self.visionResults[sig] = [i for i in sigResults if (i.height*i.width) > minArea] # only allow objects larger than minArea
-                if self.largestObject == None:                                    # there is not largest yet
-                    self.largestObject = self.vision.largest_object()
-                    self.largestObjectType = sig
-                elif self.vision.largest_object().height > self.largestObject.height:  # the new largest is larger than the old largest
-                    self.largestObject = self.vision.largest_object()
+        if self.lockedTrack != None:
+            if self.lockedTrack.seen:
+                self.largestObject = self.lockedTrack.object
+                self.largestObjectType = self.lockedTrack.color
+        else:
+            largestSize = 0
+            for sig in self.scheduledSigs: # includes signatures refreshed on earlier round robin cycles
+                if self.sigLargest[sig] != None and (self.largestObject == None or self.sigLargestSize[sig] > largestSize):
+                    self.largestObject = self.sigLargest[sig]
                     self.largestObjectType = sig
-                if self.largestObject.height*self.largestObject.width < minArea: # largest is still too small
-                    self.largestObject = None
-
-        # located objects
-        self.locatedVisionObjects = []
+                    largestSize = self.sigLargestSize[sig]
+            previous = self.largestTrack
+            self.largestTrack = None if self.largestObject == None else self.tracker.trackOf(self.largestObject)
+            if (previous != None and previous.seen and previous is not self.largestTrack and previous.color in self.scheduledSigs
+                and self.largestObject != None and Camera.size(previous.object) * 1.2 >= largestSize): # only switch fruits if the new one is clearly larger
+                self.largestTrack = previous
+                self.largestObject = previous.object
+                self.largestObjectType = previous.color
+            if self.locked:
+                self.lockedTrack = self.largestTrack
+        if self.lockedTrack != None:
+            self.largestTrack = self.lockedTrack
+
+        # located objects, written into the preallocated buffers
+        newest = self.newest
+        count = 0
         for i in range(3): # don't need to locate anything except the fruits
             for object in self.visionResults[i]:
-                self.locatedVisionObjects.append(LocatedVisionObject.fromRaw(sig, object))
+                if count == Camera.maxLocated:
+                    break
+                LocatedVisionObject.fromRaw(i, object, newest)
+                self.locatedDist[count] = newest.dist
+                self.locatedHeight[count] = newest.height
+                self.locatedAngle[count] = newest.angleTo
+                self.locatedColor[count] = i
+                self.locatedType[count] = newest.fruitType
+                count += 1
+        self.locatedCount = count
         
-        # moving average largest object
+        # filtered largest object
         if self.largestObject != None: # if an object exists
-            self.noDetectCounter = 0
-            if len(self.pastLargestLocatedObjects) != 0: # if has contents, insert the new largest
-                self.pastLargestLocatedObjects.insert(0, LocatedVisionObject.fromRaw(self.largestObjectType, self.largestObject))
-                if len(self.pastLargestLocatedObjects) > 50: # if too many, remove last
-                    self.pastLargestLocatedObjects.pop()
-            else: # if list is empty, simply add new largest
-                self.pastLargestLocatedObjects.append(LocatedVisionObject.fromRaw(self.largestObjectType, self.largestObject))
-            
-            # calculate the average
-            n = len(self.pastLargestLocatedObjects) 
-            self.averageLargestObject = LocatedVisionObject(sum([i.dist for i in self.pastLargestLocatedObjects])/n,
-                                                        sum([i.height for i in self.pastLargestLocatedObjects])/n,
-                                                        sum([i.angleTo for i in self.pastLargestLocatedObjects])/n,
-                                                        self.pastLargestLocatedObjects[0].color,
-                                                        self.pastLargestLocatedObjects[0].fruitType)
-        else: # no object
-            if self.noDetectCounter > 1000000: # 1 second passed with no object : no more averaging
-                self.pastLargestLocatedObjects.clear()
+            trackId = 0 if self.largestTrack == None else self.largestTrack.id
+            LocatedVisionObject.fromRaw(self.largestObjectType, self.largestObject, newest)
+            if trackId != self.averageTrackId or not self.target.active: # a different fruit, don't filter it with the last one
+                self.noDetectCounter = 0
+                self.target.reset(newest)
+                self.averageTrackId = trackId
+            elif self.largestObjectType in self.freshSigs: # measured this update
+                self.noDetectCounter = 0
+                self.target.predict(self.updateDt)
+                self.target.correct(newest)
+            else: # left over from an earlier round robin snapshot, so it is no new measurement : coast on the prediction
+                self.noDetectCounter += self.updateDt
+                if self.noDetectCounter > Camera.coastTime:
+                    self.target.hold()
+                self.target.predict(self.updateDt)
+            self.target.write(self.averageObject)
+            self.averageObject.color = newest.color
+            self.averageObject.fruitType = newest.fruitType
+            self.averageLargestObject = self.averageObject
+        elif self.target.active: # no object
+            self.noDetectCounter += self.updateDt
+            if self.noDetectCounter > Camera.dropTime: # lost for too long : drop the fruit
+                self.target.active = False
                 self.averageLargestObject = None
-            else:                         # 1 second not yet passed : count time since last detection
-                self.noDetectCounter += dt()
+            else: # short dropout : coast on the prediction, then hold the last estimate
+                if self.noDetectCounter > Camera.coastTime:
+                    self.target.hold()
+                self.target.predict(self.updateDt)
+                self.target.write(self.averageObject)
+
+    def frameAge(self):
+        """Microseconds from when the frame largestObject came from was captured to when the current control cycle's command takes effect. \n
+        In round robin (or while locked) largestObject can come from an earlier snapshot than the latest update, so the time of its signature's snapshot is used."""
+        return frame.timestamp + Camera.commandLatency - (self.sigTime[self.largestObjectType] - Camera.frameLatency)
+
+    def predictedCenterX(self):
+        """centerX of largestObject predicted for when the current command takes effect. \n
+        The fruit's bearing changes mostly because the robot turns, so the turn since the frame was captured is taken from the gyro:
+        the heading at the snapshot largestObject came from, rolled back by the frame latency, against the current heading rolled forward by the command latency."""
+        captured = self.sigHeading[self.largestObjectType] - frame.gyroRate * Camera.frameLatency / 1000000
+        applied = frame.heading + frame.gyroRate * Camera.commandLatency / 1000000
+        turned = (applied - captured + 180) % 360 - 180 # clockwise positive, which moves the fruit left
+        return self.largestObject.centerX - turned / VisionModel.degPerPixelX
+
+    def predictedHeight(self):
+        """Pixel height of largestObject predicted for when the current command takes effect, from the target filter's range rate. \n
+        Pixel size is inversely proportional to range."""
+        if not self.target.active or self.target.dist.value <= 0:
+            return self.largestObject.height
+        dist = self.target.dist.value
+        predicted = max(dist + self.target.dist.velocity * self.frameAge() / 1000000, dist / 2) # never more than double the size in one prediction
+        return self.largestObject.height * dist / predicted
+
+    def snapshot(self, sig : int):
+        """Takes a snapshot of a single (0 indexed) signature and stores its results"""
+        now = brain.timer.system_high_res()
+        self.sigTime[sig] = now
+        self.sigHeading[sig] = frame.heading + frame.gyroRate * (now - frame.timestamp) / 1000000
+        sigResults = self.take_snapshot(self.sigList[sig])
+        results = []
+        largest = None
+        largestSize = 0
+        if sigResults != None:
+            for object in sigResults: # one pass: filter, and find the largest of what is kept
+                if object.width * object.height > Camera.minArea:
+                    results.append(object)
+                    size = Camera.size(object)
+                    if largest == None or size > largestSize:
+                        largest = object
+                        largestSize = size
+        self.visionResults[sig] = results
+        self.sigLargest[sig] = largest
+        self.sigLargestSize[sig] = largestSize
+
+class VisionModel:
+    """Pixel to range model of the vision sensor. \n
+    VisionModel.build() does the trigonometry for every possible pixel width and centerY once, so locating an object is a few table reads."""
+    sensorWidth = 316
+    sensorHeight = 212
+    radPerPixel = 0.00337
+    """angle covered by one pixel in radians"""
+    halfAngleCorrection = 0.01
+    """added to the half angle a fruit covers. A minor correction to improve distance accuracy"""
+    horizonY = 137
+    """centerY of objects level with the camera. 106 is the center, 137 corrects the angle of the camera"""
+    centerX = 158
+    degPerPixelX = 0.19
+    largeRadius = 4.45
+    """fruit radii in cm"""
+    smallRadius = 2.86
+
+    largeDist : list[float] = []
+    """distance in cm to a large fruit, indexed by pixel width"""
+    smallDist : list[float] = []
+    """distance in cm to a small fruit, indexed by pixel width"""
+    elevation : list[float] = []
+    """sine of the angle above the camera, indexed by pixel centerY"""
+
+    @classmethod
+    def build(cls):
+        """Fills the lookup tables from the constants. Run once at startup."""
+        cls.largeDist = [cls.largeRadius / math.sin(cls.radPerPixel * width / 2 + cls.halfAngleCorrection) for width in range(cls.sensorWidth + 1)]
+        cls.smallDist = [cls.smallRadius / math.sin(cls.radPerPixel * width / 2 + cls.halfAngleCorrection) for width in range(cls.sensorWidth + 1)]
+        cls.elevation = [math.sin((cls.horizonY - y) * cls.radPerPixel) for y in range(cls.sensorHeight + 1)]
+
+    @classmethod
+    def distance(cls, width : int, large : bool = True):
+        """Distance in cm to a fruit width pixels wide"""
+        width = min(max(int(width), 0), cls.sensorWidth)
+        return cls.largeDist[width] if large else cls.smallDist[width]
+
+VisionModel.build()
 
 class LocatedVisionObject:
     """Custom class for vision objects. The VEX default uses pixel positions. This does the math to get distance and relative height in cm."""
@@ -590,53 +992,385 @@ class LocatedVisionObject:
         self.fruitType = fruitType
         """0 for small fruit, 1 for large fruit"""
     @classmethod
-    def fromRaw(cls, color : int, object : VisionObject):
-        """takes in data from a VEX standard VisionObject and converts the pixel values into actual distances in cm."""
-        if object.width/object.height > 0.9:
-            fruitRadius = 4.45 # radius in cm
+    def fromRaw(cls, color : int, object : VisionObject, into = None):
+        """takes in data from a VEX standard VisionObject and converts the pixel values into actual distances in cm. \n
+        Uses the VisionModel tables, so there is no trigonometry per object. \n
+        If into is a LocatedVisionObject, it is filled in place and returned instead of allocating a new one."""
+        width = min(object.width, VisionModel.sensorWidth)
+        if object.width > 0.9 * object.height:
+            dist = VisionModel.largeDist[width]
             fruitType = 1      # wide fruit
         else:
-            fruitRadius = 2.86 # radius in cm
+            dist = VisionModel.smallDist[width]
             fruitType = 0      # narrow fruit
-        halfAngleRadians = 0.00337 * object.width / 2 + 0.01 # +0.01 is a minor correction to improve distance accuracy
-        dist = fruitRadius/math.sin(halfAngleRadians)
-        return LocatedVisionObject(dist, 
-                                   math.sin((137-object.centerY) * 0.00337) * dist, # (106-object.centerY) * 0.00337); 106 is the center, 137 corrects the angle of the camera
-                                   ((object.centerX - 158) * 0.19), 
-                                   color, fruitType) 
+        if into == None:
+            into = LocatedVisionObject(0, 0, 0, 0, 0)
+        into.dist = dist
+        into.height = VisionModel.elevation[min(object.centerY, VisionModel.sensorHeight)] * dist
+        into.angleTo = (object.centerX - VisionModel.centerX) * VisionModel.degPerPixelX
+        into.color = color
+        into.fruitType = fruitType
+        return into
     def __str__(self) -> str:
         return "Dist:"+str(self.dist)+", Height:"+str(self.height)+", Angle:"+str(self.angleTo)+", Type:"+str(self.fruitType)+", Color:"+str(self.color)
 
+class TargetFilter:
+    """Constant velocity Kalman filter of the followed fruit's dist, height and angleTo. \n
+    Each value is filtered on its own as a (value, velocity) state with a 2x2 covariance. Every camera update predicts the state forward by
+    the time since the previous update and, when the fruit was seen, corrects it with the measurement. While the fruit is not seen the
+    filter coasts on its prediction, and the covariance grows to show it. Everything is scalar math on preallocated attributes."""
+    class Axis:
+        def __init__(self, measurementVariance : float, accelerationVariance : float, velocityVariance : float) -> None:
+            self.measurementVariance = measurementVariance
+            """variance of one measurement"""
+            self.accelerationVariance = accelerationVariance
+            """variance of the unmodeled acceleration per second squared (process noise)"""
+            self.velocityVariance = velocityVariance
+            """variance of the velocity when the filter starts"""
+            self.value = 0.0
+            self.velocity = 0.0
+            """change per second"""
+            self.p00 = 0.0
+            self.p01 = 0.0
+            self.p11 = 0.0
+            """covariance of (value, velocity)"""
+        def reset(self, z : float):
+            self.value = z
+            self.velocity = 0.0
+            self.p00 = self.measurementVariance
+            self.p01 = 0.0
+            self.p11 = self.velocityVariance
+        def predict(self, dt : float):
+            """Moves the state dt seconds forward"""
+            self.value += self.velocity * dt
+            q = self.accelerationVariance
+            dt2 = dt * dt
+            self.p00 += dt * (2 * self.p01 + dt * self.p11) + q * dt2 * dt2 / 4
+            self.p01 += dt * self.p11 + q * dt2 * dt / 2
+            self.p11 += q * dt2
+        def correct(self, z : float):
+            s = self.p00 + self.measurementVariance
+            k0 = self.p00 / s
+            k1 = self.p01 / s
+            innovation = z - self.value
+            self.value += k0 * innovation
+            self.velocity += k1 * innovation
+            self.p11 -= k1 * self.p01
+            self.p01 -= k0 * self.p01
+            self.p00 -= k0 * self.p00
+        def hold(self):
+            """Stops extrapolating: the value stays where it is"""
+            self.velocity = 0.0
+
+    def __init__(self) -> None:
+        self.dist = TargetFilter.Axis(4, 10000, 400)
+        """distance in cm"""
+        self.height = TargetFilter.Axis(4, 10000, 400)
+        """height in cm"""
+        self.angleTo = TargetFilter.Axis(1, 1000000, 10000)
+        """horizontal angle in degrees. Turning the robot moves it fast, hence the large process noise."""
+        self.active = False
+        """True while the filter has a target"""
+    def reset(self, located : LocatedVisionObject):
+        """Starts filtering a new target from its first measurement"""
+        self.dist.reset(located.dist)
+        self.height.reset(located.height)
+        self.angleTo.reset(located.angleTo)
+        self.active = True
+    def predict(self, dt : int):
+        """Moves the state dt microseconds forward"""
+        seconds = dt / 1000000
+        self.dist.predict(seconds)
+        self.height.predict(seconds)
+        self.angleTo.predict(seconds)
+    def correct(self, located : LocatedVisionObject):
+        self.dist.correct(located.dist)
+        self.height.correct(located.height)
+        self.angleTo.correct(located.angleTo)
+    def hold(self):
+        self.dist.hold()
+        self.height.hold()
+        self.angleTo.hold()
+    def write(self, located : LocatedVisionObject):
+        """Copies the filtered values into a LocatedVisionObject"""
+        located.dist = self.dist.value
+        located.height = self.height.value
+        located.angleTo = self.angleTo.value
+
+class VisionTracker:
+    """Frame to frame tracker for the objects of each signature. \n
+    Each physical fruit keeps the same Track (and id) while it stays in view, so followers can stay on one fruit
+    instead of whichever object happens to be the largest this frame."""
+    class Track:
+        def __init__(self, id : int, color : int, object : VisionObject, time : int):
+            self.id = id
+            self.color = color
+            """(0 indexed) signature"""
+            self.object = object
+            """latest VisionObject matched to the track"""
+            self.centerX = float(object.centerX)
+            self.centerY = float(object.centerY)
+            self.width = float(object.width)
+            self.height = float(object.height)
+            self.velX = 0.0
+            """pixels per second"""
+            self.velY = 0.0
+            self.lastSeen = time
+            """time of the latest match in microseconds"""
+            self.hits = 1
+            self.misses = 0
+            """snapshots of the track's signature in a row without a match"""
+            self.confidence = 0.3
+            """0 to 1, rises with every match and decays with every miss"""
+            self.seen = True
+            """True if the track was matched on the latest snapshot of its signature"""
+        def predictX(self, time : int):
+            return self.centerX + self.velX * (time - self.lastSeen) / 1000000
+        def predictY(self, time : int):
+            return self.centerY + self.velY * (time - self.lastSeen) / 1000000
+        def match(self, object : VisionObject, time : int):
+            dt = (time - self.lastSeen) / 1000000
+            if dt > 0:
+                self.velX += ((object.centerX - self.centerX) / dt - self.velX) * 0.5
+                self.velY += ((object.centerY - self.centerY) / dt - self.velY) * 0.5
+            self.object = object
+            self.centerX = float(object.centerX)
+            self.centerY = float(object.centerY)
+            self.width = float(object.width)
+            self.height = float(object.height)
+            self.lastSeen = time
+            self.hits += 1
+            self.misses = 0
+            self.confidence += (1 - self.confidence) * 0.3
+            self.seen = True
+        def miss(self):
+            self.misses += 1
+            self.confidence *= 0.7
+            self.seen = False
+
+    maxMisses = 5
+    """snapshots a track can go unmatched before it is dropped"""
+    gate = 60
+    """largest match cost (in pixels) for an object to continue a track"""
+
+    def __init__(self) -> None:
+        self.tracks : list[VisionTracker.Track] = []
+        self.nextId = 1
+
+    def cost(self, track : Track, object : VisionObject, time : int):
+        """Pixel distance between the track's predicted position and size and the object"""
+        return (abs(track.predictX(time) - object.centerX) + abs(track.predictY(time) - object.centerY)
+                + (abs(track.width - object.width) + abs(track.height - object.height)) / 2)
+
+    def update(self, sig : int, objects : list[VisionObject], time : int):
+        """Matches a fresh snapshot of one signature to its tracks. Closest pairs are matched first (greedy nearest neighbour)."""
+        pairs = []
+        for track in self.tracks:
+            if track.color != sig:
+                continue
+            track.seen = False
+            for i in range(len(objects)):
+                cost = self.cost(track, objects[i], time)
+                if cost < VisionTracker.gate:
+                    pairs.append((cost, track.id, i, track))
+        pairs.sort()
+
+        matched = [False] * len(objects)
+        for cost, id, i, track in pairs:
+            if not track.seen and not matched[i]:
+                track.match(objects[i], time)
+                matched[i] = True
+
+        i = 0
+        while i < len(self.tracks):
+            track = self.tracks[i]
+            if track.color == sig and not track.seen:
+                track.miss()
+                if track.misses > VisionTracker.maxMisses:
+                    self.tracks.pop(i)
+                    continue
+            i += 1
+        for i in range(len(objects)):
+            if not matched[i]:
+                self.tracks.append(VisionTracker.Track(self.nextId, sig, objects[i], time))
+                self.nextId += 1
+
+    def clear(self, sig : int):
+        """Drops the tracks of a signature that is no longer snapshotted"""
+        self.tracks = [track for track in self.tracks if track.color != sig]
+
+    def trackOf(self, object : VisionObject):
+        """Returns the track the object was matched to on its latest snapshot, or None"""
+        for track in self.tracks:
+            if track.seen and (track.object is object or (track.object.centerX == object.centerX and track.object.centerY == object.centerY
+                                                          and track.object.width == object.width and track.object.height == object.height)):
+                return track
+        return None
+
+class Startup:
+    """Gyro calibration that runs alongside the rest of the startup. \n
+    Robot.__init__ starts it before setting up the other devices, and the CALIBRATE mode calls Startup.update() every control cycle while the
+    camera signatures upload and the arm homes. Once the gyro has calibrated, its drift is estimated from the slope of driftSamples rotation
+    readings taken one cycle apart. A calibration that drifts more than maxDrift is repeated, at most maxAttempts times. \n
+    The time and drift of the last good calibration are saved to the SD card. The gyro keeps its calibration while the brain stays on,
+    so when the program is restarted within warmAge only the drift check runs. The saved time can't prove the brain stayed on (after a power
+    cycle the clock restarts at 0 and may pass it again), so the saved calibration is only a candidate: it is used when the gyro isn't
+    calibrating itself after powering up and it passes the same drift check as a fresh calibration, otherwise the gyro is calibrated. \n
+    If no calibration passes after maxAttempts, the robot stays in CALIBRATE mode with the failure on the screens until A retries or Y accepts it."""
+    fileName = "calibration.txt"
+    calibrationTimeout = 4000000
+    """microseconds to wait for the gyro to finish calibrating before starting over"""
+    driftSamples = 50
+    maxDrift = 0.012
+    """degrees per second"""
+    maxAttempts = 3
+    """calibrations to try before giving up"""
+    warmAge = 600000000
+    """microseconds a saved calibration is trusted for. The brain's clock keeps running between programs, but not between power cycles."""
+
+    gyro : Inertial | None = None
+    done = False
+    good = False
+    """True when the calibration in use passed the drift check"""
+    warm = False
+    """True when the saved calibration was reused"""
+    attempts = 0
+    calibrating = False
+    calibrationStart = 0
+    calibratedAt = 0
+    """brain time of the calibration in use in microseconds"""
+    samples : list[float] = []
+    sampleTimes : list[int] = []
+    drift = 0.0
+    """drift of the calibration in use in degrees per second"""
+
+    @classmethod
+    def begin(cls, gyro : Inertial):
+        """Reuses the saved calibration if it is recent enough, otherwise starts calibrating"""
+        cls.gyro = gyro
+        now = brain.timer.system_high_res()
+        saved = cls.load()
+        if saved != None and saved[0] <= now and now - saved[0] < cls.warmAge and not gyro.is_calibrating():
+            cls.warm = True
+            cls.calibratedAt = saved[0]
+            cls.drift = saved[1]
+        else:
+            cls.calibrate(now)
+
+    @classmethod
+    def failed(cls):
+        """True when every attempt failed the drift check"""
+        return cls.done and not cls.good
+
+    @classmethod
+    def retry(cls):
+        """Starts over with a fresh set of attempts"""
+        cls.done = False
+        cls.attempts = 0
+        cls.calibrate(frame.timestamp)
+
+    @classmethod
+    def calibrate(cls, now : int):
+        cls.attempts += 1
+        cls.warm = False
+        cls.gyro.calibrate()
+        cls.calibrating = True
+        cls.calibrationStart = now
+        cls.samples = []
+        cls.sampleTimes = []
+
+    @classmethod
+    def update(cls):
+        """Advances the calibration by one control cycle. Returns True once it is finished."""
+        if cls.done:
+            return True
+        now = frame.timestamp
+        if cls.calibrating:
+            if cls.gyro.is_calibrating():
+                if now - cls.calibrationStart > cls.calibrationTimeout:
+                    if cls.attempts < cls.maxAttempts:
+                        cls.calibrate(now)
+                    else:
+                        cls.done = True
+                return cls.done
+            cls.calibrating = False
+            cls.calibratedAt = now
+        cls.samples.append(cls.gyro.rotation())
+        cls.sampleTimes.append(now)
+        if len(cls.samples) < cls.driftSamples:
+            return False
+        drift = cls.slope()
+        if abs(drift) <= cls.maxDrift:
+            cls.good = True
+            cls.drift = drift
+            cls.save()
+        elif cls.attempts < cls.maxAttempts: # also recalibrates when a saved calibration fails the check
+            cls.calibrate(now)
+            return False
+        else: # keep the last try
+            cls.drift = drift
+        cls.done = True
+        return True
+
+    @classmethod
+    def slope(cls):
+        """Least squares slope of the rotation samples in degrees per second"""
+        n = len(cls.samples)
+        t0 = cls.sampleTimes[0]
+        meanT = sum(cls.sampleTimes) / n - t0
+        meanR = sum(cls.samples) / n
+        covariance = 0.0
+        variance = 0.0
+        for i in range(n):
+            dt = cls.sampleTimes[i] - t0 - meanT
+            covariance += dt * (cls.samples[i] - meanR)
+            variance += dt * dt
+        if variance == 0:
+            return 0.0
+        return covariance / variance * 1000000
+
+    @classmethod
+    def load(cls):
+        """Returns (calibration time, drift) from the SD card, or None"""
+        if not brain.sdcard.is_inserted() or not brain.sdcard.exists(cls.fileName):
+            return None
+        data = brain.sdcard.loadfile(cls.fileName)
+        if data == None:
+            return None
+        values = {}
+        for line in bytes(data).decode().split("\n"):
+            parts = line.split(" ")
+            if len(parts) == 2:
+                values[parts[0]] = parts[1]
+        try:
+            return (int(values["calibrated"]), float(values["drift"]))
+        except (KeyError, ValueError):
+            return None
+
+    @classmethod
+    def save(cls):
+        if not brain.sdcard.is_inserted():
+            return
+        text = "calibrated " + str(cls.calibratedAt) + "\ndrift " + str(cls.drift) + "\n"
+        brain.sdcard.savefile(cls.fileName, bytearray(text, "utf-8"))
+
 class Robot:
     def __init__(self, PortMotorFL, PortMotorFR, PortMotorBL, PortMotorBR, PortMotorTRAY, PortGyro, PortVision, PortArmL, PortArmR, PortGripper, PortSonarB : Triport.TriportPort, PortSonarR : Triport.TriportPort, PortLineR, PortLineL):
         """initializes the hardware components of the robot"""
-        self.motor_FL = Motor(PortMotorFL)
-        self.motor_FR = Motor(PortMotorFR)
-        self.motor_BL = Motor(PortMotorBL)
-        self.motor_BR = Motor(PortMotorBR)
-        self.motor_TRAY = Motor(PortMotorTRAY)
+        self.motor_FL = CachedMotor(Motor(PortMotorFL))
+        self.motor_FR = CachedMotor(Motor(PortMotorFR))
+        self.motor_BL = CachedMotor(Motor(PortMotorBL))
+        self.motor_BR = CachedMotor(Motor(PortMotorBR))
+        self.motor_TRAY = CachedMotor(Motor(PortMotorTRAY))
         self.motor_TRAY.set_max_torque(50, PERCENT)
         self.motor_FL.set_reversed(True)
         self.motor_BL.set_reversed(True)
         self.gyro = Inertial(PortGyro)
+        Startup.begin(self.gyro) # the gyro calibrates while the rest is set up; the CALIBRATE mode waits for it
 
         self.trayState = 0
         self.navHeadingSetpoint = 0
         # self.hold = False
-        
-        # gyroPos1 = 0
-        # gyroPos2 = 1
-        # while abs(gyroPos1 - gyroPos2) > 0.012:
-        #     print("attempting gyro calibration")
-        self.gyro.calibrate()
-        while(self.gyro.is_calibrating()):
-            sleep(10)
-        #     self.gyro.reset_rotation()
-        #     sleep(1000)
-        #     gyroPos1 = self.gyro.heading()
-        #     sleep(1000)
-        #     gyroPos2 = self.gyro.heading()
-        # self.gyro.reset_rotation()
 
         self.sonarR = Sonar(PortSonarR) # uses 3wire a/b pair, so set to use a (first port of pair)
         self.sonarB = Sonar(PortSonarB)
@@ -653,7 +1387,7 @@ class Robot:
         motorGroupArm = MotorGroup(motorArmL, motorArmR)
         motorGripper = Motor(PortGripper, GearSetting.RATIO_18_1)
         motorGripper.set_max_torque(60, PERCENT)
-        self.arm = Arm(motorGroupArm, motorGripper)
+        self.arm = Arm(CachedMotor(motorGroupArm), CachedMotor(motorGripper))
 
     def trayUp(self):
         """Moves the fruit tray to the up position"""
@@ -676,6 +1410,199 @@ drivetrain = robot.drivetrain
 camera = robot.camera
 arm = robot.arm
 
+class SensorFrame:
+    """Values of every sensor read by the control loop, captured once at the top of each cycle. \n
+    Everything that runs during the cycle reads from the frame instead of the devices, so each device is read once per cycle and every decision uses the same data."""
+    def __init__(self) -> None:
+        self.timestamp = 0
+        """time the frame was captured in microseconds"""
+        self.heading = 0.0
+        """gyro heading in degrees"""
+        self.roll = 0.0
+        self.pitch = 0.0
+        self.gyroRate = 0.0
+        """gyro rate in degrees per second, assumed clockwise positive like the heading. Not yet checked on the robot: turning clockwise should read positive."""
+        self.sonarB = 0.0
+        """back sonar distance in mm"""
+        self.sonarR = 0.0
+        """right sonar distance in mm"""
+        self.lineL = 0
+        """left line sensor value in percent"""
+        self.lineR = 0
+        """right line sensor value in percent"""
+        self.driveFL = 0.0
+        """drive motor positions in degrees"""
+        self.driveFR = 0.0
+        self.driveBL = 0.0
+        self.driveBR = 0.0
+    def capture(self):
+        """Reads all sensors into the frame"""
+        self.timestamp = brain.timer.system_high_res()
+        self.heading = gyro.heading()
+        self.roll = gyro.orientation(ROLL)
+        self.pitch = gyro.orientation(PITCH)
+        self.gyroRate = gyro.gyro_rate(ZAXIS, VelocityUnits.DPS)
+        self.sonarB = sonarB.distance(MM)
+        self.sonarR = sonarR.distance(MM)
+        self.lineL = robot.lineL.value(PERCENT)
+        self.lineR = robot.lineR.value(PERCENT)
+        self.driveFL = robot.motor_FL.position(DEGREES)
+        self.driveFR = robot.motor_FR.position(DEGREES)
+        self.driveBL = robot.motor_BL.position(DEGREES)
+        self.driveBR = robot.motor_BR.position(DEGREES)
+
+frame = SensorFrame()
+"""sensor values for the current cycle"""
+frame.capture()
+drivetrain.resetOdometry()
+
+class FruitMap:
+    """Field positions of every fruit the camera has seen. \n
+    Sightings are projected from the robot's field position and heading, merged with nearby known fruits of the same color,
+    and forgotten when they go stale or the camera looks where they should be without seeing them."""
+    class Fruit:
+        def __init__(self, x : float, y : float, color : int, fruitType : int, time : int):
+            self.x = x
+            """field position in mm"""
+            self.y = y
+            self.color = color
+            """(0 indexed) signature"""
+            self.fruitType = fruitType
+            self.lastSeen = time
+            """time of the latest sighting in microseconds"""
+            self.sightings = 1
+            self.misses = 0
+            """updates in a row the fruit was in view without being seen"""
+            self.seen = False
+            """True if the fruit was seen on the current update"""
+        def add(self, x : float, y : float, time : int):
+            weight = 1 / min(self.sightings + 1, FruitMap.maxWeight) # average recent sightings, but keep following a fruit that moves
+            self.x += (x - self.x) * weight
+            self.y += (y - self.y) * weight
+            self.sightings += 1
+            self.misses = 0
+            self.lastSeen = time
+            self.seen = True
+
+    fruits : list[Fruit] = []
+    maxFruits = 20
+    """the oldest fruit is forgotten to make room beyond this many"""
+    mergeDistance = 200
+    """sightings within this many mm of a known fruit of the same color are the same fruit"""
+    maxWeight = 10
+    """number of sightings averaged into a fruit position"""
+    expireTime = 60000000
+    """microseconds after which an unseen fruit is forgotten"""
+    maxMisses = 10
+    """updates a fruit can be in view without being seen before it is forgotten"""
+    viewRange = 800
+    """mm within which the camera is expected to see a fruit in its field of view"""
+    minViewRange = 300
+    """mm from the camera within which fruits are below the image"""
+    minDist = 20
+    """sightings closer than this many cm are ignored (e.g. a fruit held by the gripper)"""
+    minSightings = 3
+    """fruits seen fewer times than this are not driven to, since they may be noise"""
+
+    @classmethod
+    def update(cls):
+        """Adds the sightings of the latest Camera.update(). Run after Camera.update()"""
+        if not drivetrain.positionKnown:
+            return
+        now = camera.updateTime
+        heading = frame.heading * math.pi / 180
+        cameraX, cameraY = cls.cameraPosition()
+
+        for fruit in cls.fruits:
+            fruit.seen = False
+        for i in range(camera.locatedCount): # the fruits Camera.update() located, only the fresh ones are mapped
+            sig = camera.locatedColor[i]
+            if not sig in camera.freshSigs:
+                continue
+            dist = camera.locatedDist[i]
+            if dist < FruitMap.minDist:
+                continue
+            height = camera.locatedHeight[i]
+            groundDist = math.sqrt(max(0, dist**2 - height**2)) * 10 # cm to mm
+            angle = heading + camera.locatedAngle[i] * math.pi / 180
+            x = cameraX + groundDist * math.sin(angle)
+            y = cameraY + groundDist * math.cos(angle)
+            if 0 < x < fieldSize[0] and 0 < y < fieldSize[1]:
+                cls.addSighting(x, y, sig, camera.locatedType[i], now)
+
+        # forget fruits that are stale or should have been seen but weren't
+        i = 0
+        while i < len(cls.fruits):
+            fruit = cls.fruits[i]
+            if not fruit.seen and fruit.color in camera.freshSigs and cls.inView(fruit, cameraX, cameraY, heading):
+                fruit.misses += 1
+            if fruit.misses >= FruitMap.maxMisses or now - fruit.lastSeen > FruitMap.expireTime:
+                cls.fruits.pop(i)
+            else:
+                i += 1
+
+    @classmethod
+    def cameraPosition(cls):
+        """Returns the field position of the camera"""
+        heading = frame.heading * math.pi / 180
+        return (drivetrain.robotPos[0] + Camera.forwardOffset * math.sin(heading), drivetrain.robotPos[1] + Camera.forwardOffset * math.cos(heading))
+
+    @classmethod
+    def addSighting(cls, x : float, y : float, color : int, fruitType : int, time : int):
+        nearest = None
+        nearestDist = FruitMap.mergeDistance
+        for fruit in cls.fruits:
+            if fruit.color == color:
+                dist = math.sqrt((fruit.x - x)**2 + (fruit.y - y)**2)
+                if dist < nearestDist:
+                    nearest = fruit
+                    nearestDist = dist
+        if nearest != None:
+            nearest.add(x, y, time)
+            return
+        if len(cls.fruits) >= FruitMap.maxFruits:
+            oldest = cls.fruits[0]
+            for fruit in cls.fruits:
+                if fruit.lastSeen < oldest.lastSeen:
+                    oldest = fruit
+            cls.fruits.remove(oldest)
+        fruit = FruitMap.Fruit(x, y, color, fruitType, time)
+        fruit.seen = True
+        cls.fruits.append(fruit)
+
+    @classmethod
+    def inView(cls, fruit : Fruit, cameraX : float, cameraY : float, heading : float):
+        """Returns whether the fruit should be visible from the camera position and heading (radians)"""
+        dx = fruit.x - cameraX
+        dy = fruit.y - cameraY
+        if dx**2 + dy**2 > FruitMap.viewRange**2 or dx**2 + dy**2 < FruitMap.minViewRange**2:
+            return False
+        bearing = (math.atan2(dx, dy) - heading + math.pi) % (2*math.pi) - math.pi
+        return abs(bearing) < Camera.fieldOfView / 2 * math.pi / 180 * 0.8 # stay clear of the edges of the image
+
+    @classmethod
+    def nearest(cls, x : float, y : float, color : int = 0):
+        """Returns the known fruit nearest to the field position, or None. color is 1-3 to only consider one color, as in currentCollectionColor."""
+        nearest = None
+        nearestDist = 0
+        for fruit in cls.fruits:
+            if (color != 0 and fruit.color + 1 != color) or fruit.sightings < FruitMap.minSightings:
+                continue
+            dist = (fruit.x - x)**2 + (fruit.y - y)**2
+            if nearest == None or dist < nearestDist:
+                nearest = fruit
+                nearestDist = dist
+        return nearest
+
+    @classmethod
+    def forget(cls, x : float, y : float, radius : float):
+        """Forgets every fruit within radius mm of the field position, e.g. once it has been picked"""
+        cls.fruits = [fruit for fruit in cls.fruits if (fruit.x - x)**2 + (fruit.y - y)**2 > radius**2]
+
+    @classmethod
+    def reset(cls):
+        cls.fruits = []
+
 class Buttons:
     A = 0
     B = 1
@@ -691,133 +1618,475 @@ class Buttons:
     R2 = 11
     
     class ControllerButtonTracker:
-        """Button tracking class. \n 
-        Uses 0 indexed list of buttons ordered: A, B, X, Y, ^, v, <, >, L1, L2, R1, R2"""
+        """Button tracking class. \n
+        Buttons are bits of an int, ordered: A, B, X, Y, ^, v, <, >, L1, L2, R1, R2. The controller's pressed/released callbacks report every edge
+        as it happens, so presses shorter than a cycle are not missed; update() polls the buttons as well and catches any edge a callback missed. \n
+        An edge is ignored if it comes less than debounce microseconds after the last one of the same button, so contact bounce doesn't trigger twice.
+        Accepted edges are also queued with their time, see nextEvent()."""
+        debounce = 30000
+        """microseconds after an edge during which further edges of the same button are ignored"""
+        queueSize = 16
         def __init__(self, controller : Controller) -> None:
             self.controller = controller
-            self.getNewButtonlist = lambda : [self.controller.buttonA.pressing(), self.controller.buttonB.pressing(), 
-                                        self.controller.buttonX.pressing(), self.controller.buttonY.pressing(),
-                                        self.controller.buttonUp.pressing(),self.controller.buttonDown.pressing(),
-                                        self.controller.buttonLeft.pressing(), self.controller.buttonRight.pressing(),
-                                        self.controller.buttonL1.pressing(), self.controller.buttonL2.pressing(),
-                                        self.controller.buttonR1.pressing(), self.controller.buttonR2.pressing()]
-            self.prevButtonList = self.getNewButtonlist()
-            self.buttonList = self.getNewButtonlist()
+            self.buttons = [controller.buttonA, controller.buttonB, controller.buttonX, controller.buttonY,
+                            controller.buttonUp, controller.buttonDown, controller.buttonLeft, controller.buttonRight,
+                            controller.buttonL1, controller.buttonL2, controller.buttonR1, controller.buttonR2]
+            self.state = 0
+            """debounced state, one bit per button"""
+            self.pressedMask = 0
+            self.releasedMask = 0
+            """edges since the last clearEdges()"""
+            self.lastEdge = [0] * 12
+            """time of each button's last accepted edge in microseconds"""
+            self.eventTime = [0] * Buttons.ControllerButtonTracker.queueSize
+            self.eventButton = [0] * Buttons.ControllerButtonTracker.queueSize
+            self.eventDown = [False] * Buttons.ControllerButtonTracker.queueSize
+            """ring buffer of accepted edges"""
+            self.eventIndex = 0
+            """slot the next event is written to"""
+            self.eventCount = 0
+            self.eventsDropped = 0
+            """events overwritten before they were read"""
+            for i in range(12):
+                self.buttons[i].pressed(self.onPressed, (i,))
+                self.buttons[i].released(self.onReleased, (i,))
+            self.update()
+        def onPressed(self, button : int):
+            self.edge(button, True, brain.timer.system_high_res())
+        def onReleased(self, button : int):
+            self.edge(button, False, brain.timer.system_high_res())
+        def edge(self, button : int, down : bool, time : int):
+            """Records an edge unless the button is already in that state or it is within the debounce time of the last edge"""
+            bit = 1 << button
+            if ((self.state & bit) != 0) == down or time - self.lastEdge[button] < self.debounce:
+                return
+            self.state ^= bit
+            if down:
+                self.pressedMask |= bit
+            else:
+                self.releasedMask |= bit
+            self.lastEdge[button] = time
+            i = self.eventIndex
+            self.eventTime[i] = time
+            self.eventButton[i] = button
+            self.eventDown[i] = down
+            self.eventIndex = (i + 1) % len(self.eventTime)
+            if self.eventCount == len(self.eventTime):
+                self.eventsDropped += 1
+            else:
+                self.eventCount += 1
         def pressing(self, button):
             """Returns whether the selected button is currently pressed down. """
-            return self.buttonList[button]
+            return (self.state >> button) & 1 == 1
         def pressed(self, button):
-            """Returns whether the selected button was pressed since the last cycle. \n
-            WARNING: may still activiate multiple times on press due to button bounce"""
-            return self.pressedButtons[button]
+            """Returns whether the selected button was pressed since the last clearEdges()."""
+            return (self.pressedMask >> button) & 1 == 1
         def released(self, button):
-            """Returns whether the selected button was released since the last cycle."""
-            return self.releasedButtons[button]
+            """Returns whether the selected button was released since the last clearEdges()."""
+            return (self.releasedMask >> button) & 1 == 1
         def update(self):
-            self.prevButtonList = self.buttonList
-            self.buttonList = self.getNewButtonlist()
-            self.pressedButtons = [self.buttonList[i] and not self.prevButtonList[i] for i in range(12)]
-            self.releasedButtons = [not self.buttonList[i] and self.prevButtonList[i] for i in range(12)]
+            """Polls the buttons. Buttons task. Presses and releases are kept until clearEdges() is called, so they are not lost or repeated when buttons are polled at a different rate than they are read."""
+            polled = 0
+            for i in range(12):
+                if self.buttons[i].pressing():
+                    polled |= 1 << i
+            changed = polled ^ self.state
+            if changed == 0:
+                return
+            now = brain.timer.system_high_res()
+            for i in range(12):
+                if (changed >> i) & 1:
+                    self.edge(i, (polled >> i) & 1 == 1, now)
+        def clearEdges(self):
+            """Marks all presses and releases as handled. Run after the state machine. Queued events are kept until nextEvent() reads them."""
+            self.pressedMask = 0
+            self.releasedMask = 0
+        def nextEvent(self):
+            """Removes and returns the oldest queued edge as (time, button, pressed), or None when the queue is empty"""
+            if self.eventCount == 0:
+                return None
+            i = (self.eventIndex - self.eventCount) % len(self.eventTime)
+            self.eventCount -= 1
+            return (self.eventTime[i], self.eventButton[i], self.eventDown[i])
 
 controllerButtons = Buttons.ControllerButtonTracker(controller)
 
 class Printer:
     
-    brainList : list[str] = [""] * 20
-    controllerList : list[str] = ["","",""]
+    brainList : list = [""] * 20
+    controllerList : list = ["","",""]
+    """raw line contents. A line is a value or a tuple of values, which are only formatted when the line is drawn."""
+    brainDrawn : list = [None] * 20
+    controllerDrawn : list = [None] * 3
+    """raw contents of each line as last drawn, to redraw only the lines that changed"""
+    brainWidths = [0] * 20
+    controllerWidths = [0] * 3
+    """length of the text last drawn on each line, so a shorter line is padded just enough to cover it"""
+    controllerQueue : list[int] = []
+    """controller lines waiting to be redrawn, oldest first"""
+    controllerInterval = 50000
+    """microseconds between controller screen updates. The controller screen goes over the radio, so only one line is sent per slot."""
+    controllerSentAt = 0
     
     @classmethod
     def addGyro(cls, location : int, index):
         """adds the gyro heading to the print list"""
         # cls.brainList[index] = (("Gryo: " + str(robot.gyro.heading())))
 
-        Printer.add("Gryo: " + str(robot.gyro.heading()), location, index)
+        Printer.add(("Gryo: ", frame.heading), location, index)
     
     @classmethod
     def addSonar(cls, location : int, index):
         """adds the sonar values (front, left) to the print list"""
         #cls.brainList[index] = (("SF:" + str(sonarF.distance(MM)) + ", SL:" + str(robot.sonarL.distance(MM))))
-        Printer.add(("SB:" + str(sonarB.distance(MM)) + ", SR:" + str(robot.sonarR.distance(MM))), location, index)
+        Printer.add(("SB:", frame.sonarB, ", SR:", frame.sonarR), location, index)
     
     @classmethod
     def add(cls, s, location : int, index : int):
         """
-        Adds str to be printed at index \n
-        Brain Indexes: 0-8
+        Adds s to be printed at index. s can be a tuple of values that are joined when the line is drawn. \n
+        Brain Indexes: 0-19 \n
+        Controller Indexes: 0-2
         """
         if location == 0:
-            cls.brainList[index] = (str(s))
+            cls.brainList[index] = s
         elif location == 1:
-            cls.controllerList[index] = (str(s))
+            cls.controllerList[index] = s
         #else:
 
+    @classmethod
+    def clearBrain(cls):
+        """Blanks every brain line, so switching pages doesn't leave lines of the previous page behind"""
+        for i in range(len(cls.brainList)):
+            cls.brainList[i] = ""
+
+    @classmethod
+    def format(cls, s):
+        if type(s) == tuple:
+            return "".join([str(part) for part in s])
+        return str(s)
+
     @classmethod
     def print(cls):
-        """Prints the contents of the print list to the brain"""
+        """Redraws the brain lines that changed and sends the oldest changed controller line if its slot is free"""
         # brain.screen.clear_screen()
-        l = 1
-        for s in cls.brainList:
-            brain.screen.set_cursor(l,1)
-            brain.screen.print(s, "                                     ")
-            l += 1
-        l = 1
-        for s in cls.controllerList:
-            controller.screen.set_cursor(l,1)
-            controller.screen.print(s, "                                     ")
-            l += 1
+        for i in range(len(cls.brainList)):
+            s = cls.brainList[i]
+            if s != cls.brainDrawn[i]:
+                text = cls.format(s)
+                brain.screen.set_cursor(i + 1, 1)
+                brain.screen.print(text + " " * (cls.brainWidths[i] - len(text)))
+                cls.brainDrawn[i] = s
+                cls.brainWidths[i] = len(text)
+
+        for i in range(len(cls.controllerList)):
+            if cls.controllerList[i] != cls.controllerDrawn[i] and not i in cls.controllerQueue:
+                cls.controllerQueue.append(i)
+        now = brain.timer.system_high_res()
+        if len(cls.controllerQueue) > 0 and now - cls.controllerSentAt >= cls.controllerInterval:
+            i = cls.controllerQueue.pop(0)
+            s = cls.controllerList[i] # the latest contents, not the ones it was queued with
+            text = cls.format(s)
+            controller.screen.set_cursor(i + 1, 1)
+            controller.screen.print(text + " " * (cls.controllerWidths[i] - len(text)))
+            cls.controllerDrawn[i] = s
+            cls.controllerWidths[i] = len(text)
+            cls.controllerSentAt = now
 
 class Delays:
+    """Timers for the control loop. \n
+    A Delay sets newState and/or calls a callback once its time is up. Delays.schedule() returns the Delay as a handle that can be cancelled.
+    Pending delays are kept in a min-heap on their due time, so checkAllDelays() only looks at the earliest one when nothing is due and
+    scheduling or firing a delay costs O(log n). \n
+    Every delay has a key, by default the state it sets. A delay is not scheduled while another with the same key is pending."""
     class Delay:
-        def __init__(self, delay, delayedState):
+        def __init__(self, delay : float, delayedState : int | None = None, callback : Callable[[], None] | None = None, key = None):
             self.delay = delay
+            """seconds"""
             self.delayedState = delayedState
+            self.callback = callback
+            self.key = delayedState if key == None else key
             self.startTime = systemTime
-        def check(self):
+            self.due = self.startTime + int(delay * 1000000)
+            """fires on the first check after this time in microseconds"""
+            self.order = 0
+            """schedule order, so delays due at the same time fire first in first out"""
+            self.pending = False
+        def before(self, other):
+            return self.due < other.due or (self.due == other.due and self.order < other.order)
+        def cancel(self):
+            """Stops the delay from firing. It stays in the heap until its time comes, but its key is free right away."""
+            if self.pending:
+                self.pending = False
+                if Delays.pendingKeys.get(self.key) is self:
+                    del Delays.pendingKeys[self.key]
+        def fire(self):
             global newState
-            if systemTime - self.startTime > self.delay * 1000000:
+            if self.delayedState != None:
                 newState = self.delayedState
-                return True
-            return False
+            if self.callback != None:
+                self.callback()
+
+    heap : list[Delay] = []
+    """pending and cancelled delays, earliest first at index 0"""
+    pendingKeys : dict = {}
+    """key -> pending delay"""
+    scheduled = 0
 
-    scheduledDelays : list[Delay] = []
-    
     @classmethod
     def schedule(cls, delay : Delay):
-        if not delay.delayedState in [d.delayedState for d in cls.scheduledDelays]:
-            cls.scheduledDelays.append(delay)
+        """Schedules the delay unless one with the same key is pending. Returns the delay that is pending for the key."""
+        if delay.key != None:
+            existing = cls.pendingKeys.get(delay.key)
+            if existing != None:
+                return existing
+            cls.pendingKeys[delay.key] = delay
+        cls.scheduled += 1
+        delay.order = cls.scheduled
+        delay.pending = True
+        heap = cls.heap
+        heap.append(delay)
+        i = len(heap) - 1
+        while i > 0: # sift up
+            parent = (i - 1) // 2
+            if not delay.before(heap[parent]):
+                break
+            heap[i] = heap[parent]
+            i = parent
+        heap[i] = delay
+        return delay
+    @classmethod
+    def after(cls, seconds : float, delayedState : int | None = None, callback : Callable[[], None] | None = None, key = None):
+        """Like schedule(Delay(...)), but returns the pending delay without creating a new one when the key is taken, so it is cheap to call every cycle"""
+        existing = cls.pendingKeys.get(delayedState if key == None else key)
+        if existing != None:
+            return existing
+        return cls.schedule(Delays.Delay(seconds, delayedState, callback, key))
+    @classmethod
+    def cancel(cls, key):
+        """Cancels the pending delay with the key, if any"""
+        existing = cls.pendingKeys.get(key)
+        if existing != None:
+            existing.cancel()
+    @classmethod
+    def pop(cls):
+        """Removes and returns the earliest delay"""
+        heap = cls.heap
+        first = heap[0]
+        last = heap.pop()
+        if len(heap) > 0: # sift the last delay down from the root
+            i = 0
+            n = len(heap)
+            while True:
+                child = 2 * i + 1
+                if child >= n:
+                    break
+                if child + 1 < n and heap[child + 1].before(heap[child]):
+                    child += 1
+                if not heap[child].before(last):
+                    break
+                heap[i] = heap[child]
+                i = child
+            heap[i] = last
+        return first
     @classmethod
     def checkAllDelays(cls):
-        for d in cls.scheduledDelays:
-            if d.check():
-                cls.scheduledDelays.remove(d)
+        """Fires every delay whose time is up, earliest first"""
+        now = systemTime
+        heap = cls.heap
+        while len(heap) > 0 and heap[0].due < now:
+            delay = cls.pop()
+            if delay.pending:
+                delay.cancel() # frees the key before the callback runs, so it can schedule the next one
+                delay.fire()
+
+class PIDBank:
+    """Storage for every PID controller, one parallel array per field. \n
+    PID objects are views that hold their index into the bank. The auto updated (bound) controllers are grouped by wrap mode,
+    so PIDBank.updateAll() updates all of them in one pass with a single dt and no per controller branching on the mode."""
+    kP = array('f')
+    kI = array('f')
+    kD = array('f')
+    maxOut = array('f')
+    """output limit, inf for no limit"""
+    sign = array('f')
+    """-1 for inverted input, 1 otherwise"""
+    wrap = array('f')
+    """period errors are wrapped to (360, 1 or 2pi), 0 for no wrapping"""
+    setpoint = array('f')
+    integrator = array('f')
+    prevError = array('f')
+    output = array('f')
+    suppliers : list[Callable[[], float | int] | None] = []
+
+    linear : list[int] = []
+    """indices of the bound controllers without wrapping"""
+    wrapped : list[int] = []
+    """indices of the bound continuous rotation controllers"""
+    wrappedHalf = array('f')
+    """half of the wrap period of each controller in PIDBank.wrapped, parallel to it"""
+    wrappedSuppliers : list[Callable[[], float | int]] = []
+    linearSuppliers : list[Callable[[], float | int]] = []
+
+    @classmethod
+    def add(cls, kP : float, kI : float, kD : float, maxOut, wrap : float, invertInput : bool, inputSupplier):
+        """Appends a controller to the bank and returns its index"""
+        cls.kP.append(kP)
+        cls.kI.append(kI)
+        cls.kD.append(kD)
+        cls.maxOut.append(float("inf") if maxOut == None else maxOut)
+        cls.sign.append(-1 if invertInput else 1)
+        cls.wrap.append(wrap)
+        cls.setpoint.append(0)
+        cls.integrator.append(0)
+        cls.prevError.append(0)
+        cls.output.append(0)
+        cls.suppliers.append(inputSupplier)
+        return len(cls.kP) - 1
+
+    @classmethod
+    def regroup(cls):
+        """Rebuilds the update groups from PIDcontrollers. Run whenever a controller is bound or unbound."""
+        cls.linear = []
+        cls.wrapped = []
+        cls.wrappedHalf = array('f')
+        cls.linearSuppliers = []
+        cls.wrappedSuppliers = []
+        for pid in PIDcontrollers:
+            i = pid.index
+            if cls.wrap[i] == 0:
+                cls.linear.append(i)
+                cls.linearSuppliers.append(cls.suppliers[i])
+            else:
+                cls.wrapped.append(i)
+                cls.wrappedHalf.append(cls.wrap[i] / 2)
+                cls.wrappedSuppliers.append(cls.suppliers[i])
+
+    @classmethod
+    def error(cls, i : int, input : float):
+        """Setpoint minus input for controller i, wrapped and signed"""
+        error = cls.setpoint[i] - input
+        wrap = cls.wrap[i]
+        if wrap != 0:
+            error = (error + wrap / 2) % wrap - wrap / 2
+        return error * cls.sign[i]
+
+    @classmethod
+    def step(cls, i : int, error : float, dtMicroseconds : int):
+        """Runs controller i on an error and returns its output"""
+        integrator = cls.integrator[i] + error * dtMicroseconds / 1000000.0
+        cls.integrator[i] = integrator
+        output = (cls.kP[i] * error) + (cls.kI[i] * integrator) + (cls.kD[i] * (error - cls.prevError[i]) / dtMicroseconds)
+        cls.prevError[i] = error
+        maxOut = cls.maxOut[i]
+        if output > maxOut:
+            output = maxOut
+        elif output < -maxOut:
+            output = -maxOut
+        cls.output[i] = output
+        return output
+
+    @classmethod
+    def updateAll(cls):
+        """Updates every bound controller from its inputSupplier"""
+        dtMicroseconds = dt()
+        dtSeconds = dtMicroseconds / 1000000.0
+        kP = cls.kP
+        kI = cls.kI
+        kD = cls.kD
+        maxOut = cls.maxOut
+        sign = cls.sign
+        setpoint = cls.setpoint
+        integrator = cls.integrator
+        prevError = cls.prevError
+        output = cls.output
+
+        suppliers = cls.linearSuppliers
+        indices = cls.linear
+        for n in range(len(indices)):
+            i = indices[n]
+            error = (setpoint[i] - suppliers[n]()) * sign[i]
+            integrator[i] += error * dtSeconds
+            out = kP[i] * error + kI[i] * integrator[i] + kD[i] * (error - prevError[i]) / dtMicroseconds
+            prevError[i] = error
+            limit = maxOut[i]
+            output[i] = limit if out > limit else (-limit if out < -limit else out)
+
+        suppliers = cls.wrappedSuppliers
+        indices = cls.wrapped
+        half = cls.wrappedHalf
+        for n in range(len(indices)):
+            i = indices[n]
+            error = ((setpoint[i] - suppliers[n]() + half[n]) % (2 * half[n]) - half[n]) * sign[i]
+            integrator[i] += error * dtSeconds
+            out = kP[i] * error + kI[i] * integrator[i] + kD[i] * (error - prevError[i]) / dtMicroseconds
+            prevError[i] = error
+            limit = maxOut[i]
+            output[i] = limit if out > limit else (-limit if out < -limit else out)
 
 class PID:
-    """Standard PID controller"""
+    """Standard PID controller. The state lives in PIDBank; a PID is a view holding its index."""
     def __init__(self, kP : float = 0, kI : float = 0, kD : float = 0, maxOut = None, inputSupplier : Callable[[], float | int] | None = None, continuousRotation : bool = False, invertInput : bool = False, angleUnits = RotationUnits.DEG):
         """Creates a new PID controller. \n
            An inputSupplier may be supplied to automatically read the input value when the PID controller is updated. \n
            The inputSupplier should be formatted as 'lambda : inputValue'"""
-        global PIDcontrollers
-        self.kP = kP
-        self.kI = kI
-        self.kD = kD
-        self.prevError = 0
-        self.output = 0
-        self.setpoint = 0
-        self.maxOut = maxOut
+        wrap = 0
+        if continuousRotation:
+            if angleUnits == RotationUnits.DEG:
+                wrap = 360
+            elif angleUnits == RotationUnits.REV:
+                wrap = 1
+            else: # use RAW for radians
+                wrap = 2*math.pi
+        self.index = PIDBank.add(kP, kI, kD, maxOut, wrap, invertInput, inputSupplier)
         self.inputSupplier = inputSupplier
-        self.integrator = 0
         self.continuousRotation = continuousRotation
         self.angleUnits = angleUnits
-        PIDcontrollers.append(self)
         self.invertInput = invertInput
+        self.bind()
+
+    # views into the bank
+    @property
+    def kP(self):
+        return PIDBank.kP[self.index]
+    @kP.setter
+    def kP(self, value):
+        PIDBank.kP[self.index] = value
+    @property
+    def kI(self):
+        return PIDBank.kI[self.index]
+    @kI.setter
+    def kI(self, value):
+        PIDBank.kI[self.index] = value
+    @property
+    def kD(self):
+        return PIDBank.kD[self.index]
+    @kD.setter
+    def kD(self, value):
+        PIDBank.kD[self.index] = value
+    @property
+    def setpoint(self):
+        return PIDBank.setpoint[self.index]
+    @setpoint.setter
+    def setpoint(self, value):
+        PIDBank.setpoint[self.index] = value
+    @property
+    def integrator(self):
+        return PIDBank.integrator[self.index]
+    @property
+    def prevError(self):
+        return PIDBank.prevError[self.index]
+    @property
+    def output(self):
+        return PIDBank.output[self.index]
+
     def reset(self, resetSetpoint : bool = False):
         """Resets the PID controller to its initial state. ***DOES NOT RESET SETPOINT BY DEFAULT"""
-        self.prevError = 0
-        self.output = 0
-        self.integrator = 0
+        PIDBank.prevError[self.index] = 0
+        PIDBank.output[self.index] = 0
+        PIDBank.integrator[self.index] = 0
         if resetSetpoint:
-            self.setpoint = 0
+            PIDBank.setpoint[self.index] = 0
     def update(self, input = None):
         """Updates the output value of the PID controller. This should be run once per cycle. \n
            Returns the PID instance, which may be used for method chaining."""
@@ -826,59 +2095,28 @@ class PID:
             input = self.inputSupplier()
         if input == None:                                # if no supplier and no input, raise an error
             raise RuntimeError("No input value given.")
-        
-        # calculate error
-        if self.continuousRotation == False: # standard PID
-            error = self.setpoint - input
-        else:                                # continuous rotation PID
-            if self.angleUnits == RotationUnits.DEG:
-                error = ((self.setpoint - input) + 180) % 360 - 180
-            elif self.angleUnits == RotationUnits.REV:
-                error = ((self.setpoint - input) + 0.5) % 1 - 0.5
-            else: # use RAW for radians
-                error = ((self.setpoint - input) + math.pi) % (2*math.pi) - math.pi
-        
-        if self.invertInput:
-            error = -error
-
-        self.integrator += error * dt() / 1000000.0
-        
-        # calculate new output
-        self.output = (self.kP * error) + (self.kI * self.integrator) + (self.kD * (error - self.prevError) / dt())
-        self.prevError = error
-        
-        # clamp output if requested
-        if self.maxOut != None:
-            if self.output > self.maxOut:
-                self.output = self.maxOut
-            elif self.output < -self.maxOut:
-                self.output = -self.maxOut
-        
-        # returns the PID instance
+        PIDBank.step(self.index, PIDBank.error(self.index, input), dt())
         return self
     def setNewSetpoint(self, setpoint  : float):
         """Sets a new setpoint"""
-        if self.continuousRotation == False: # standard PID
-            self.setpoint = setpoint
-        else:                                # continuous rotation PID
-            if self.angleUnits == RotationUnits.DEG:
-                self.setpoint = ((setpoint) + 3*180) % 360 - 180
-            elif self.angleUnits == RotationUnits.REV:
-                self.setpoint = ((setpoint) + 3*0.5) % 1 - 0.5
-            else: # use RAW for radians
-                self.setpoint = ((setpoint) + 3*math.pi) % (2*math.pi) - math.pi
+        wrap = PIDBank.wrap[self.index]
+        if wrap != 0: # continuous rotation PID
+            setpoint = (setpoint + 3 * wrap / 2) % wrap - wrap / 2
+        PIDBank.setpoint[self.index] = setpoint
         return self
     def getOutput(self):
         """Returns the output value of the PID controller. This value may be sent dirrectly to motors, etc. \n
            May be called on the return value of PID.update()"""
-        return self.output
+        return PIDBank.output[self.index]
     def unbind(self):
         """Unbinds this instance from the auto update list. Returns this instance. Use bind() to reverse this action."""
         PIDcontrollers.remove(self)
+        PIDBank.regroup()
         return self
     def bind(self):
         """Binds this instance to the auto update list. Returns this instance. Use unbind() to reverse this action."""
         PIDcontrollers.append(self)
+        PIDBank.regroup()
         return self
     def isAutoUpdate(self):
         """Returns whether this PID instance is bound to the auto update list"""
@@ -888,34 +2126,147 @@ class PID:
             input = self.inputSupplier()
         if input == None:
             raise RuntimeError("No input value given.")
-        if self.continuousRotation == False: # standard PID
-            error = self.setpoint - input
-        else:                                # continuous rotation PID
-            if self.angleUnits == RotationUnits.DEG:
-                error = ((self.setpoint - input) + 180) % 360 - 180
-            elif self.angleUnits == RotationUnits.REV:
-                error = ((self.setpoint - input) + 0.5) % 1 - 0.5
-            else: # use RAW for radians
-                error = ((self.setpoint - input) + math.pi) % (2*math.pi) - math.pi
-        return abs(error) < tolerance
+        return abs(PIDBank.error(self.index, input)) < tolerance
     @classmethod
     def updateAllPIDs(cls):
-        for pid in PIDcontrollers:
-            pid.update()
+        PIDBank.updateAll()
 
 PIDcontrollers : list[PID] = []
 """List of all active PID controllers"""
 
-turnPID = PID(5, 0, 0, 100, gyro.heading, True, angleUnits=RotationUnits.DEG)
+turnPID = PID(5, 0, 0, 100, lambda: frame.heading, True, angleUnits=RotationUnits.DEG)
 """Turn handler"""
 
-fruitTurnPID = PID(2,0,1, 100, None, False, invertInput=True) # fruitTurnPID = PID(1,0,1, 100, None, False, invertInput=True)
+class TurnProfile:
+    """Trapezoidal heading profile for turning in place. \n
+    Instead of stepping turnPID to the target, the setpoint moves along the profile while a feedforward from the profile rate and
+    feedback on the gyro rate drive the turn, so turns neither crawl over the last degrees nor overshoot.
+    The profile (re)starts whenever the PID's setpoint is changed by anything else, so setNewSetpoint() call sites need no changes.
+    While a turn runs the PID is unbound from the bank and updated by the profile instead, so it is still only updated once per cycle.
+    The PID's setpoint is then partway along the turn: use TurnProfile.heading() for the heading being turned to. \n
+    The rates, accelerations and gains below were tuned in the sim only, which also assumes the gyro rate sign (see SensorFrame.gyroRate)."""
+    maxRate = 230
+    """deg/s"""
+    acceleration = 2400
+    """deg/s^2"""
+    kV = 0.4
+    """percent output per deg/s of profile rate (the drivetrain turns about 240 deg/s at 100%)"""
+    kA = 0.02
+    """percent output per deg/s^2 of profile acceleration, to make up for the drive motors' spin up time"""
+    kRate = 0
+    """percent output per deg/s the gyro rate is behind the profile rate. 0.2 in the sim; 0 until the gyro rate sign is checked on the robot,
+    since with the wrong sign this feedback pushes the turn the wrong way."""
+    settleError = 2
+    """degrees"""
+    settleRate = 15
+    """deg/s"""
+
+    def __init__(self, pid : PID) -> None:
+        self.pid = pid
+        self.target = 0.0
+        self.startHeading = 0.0
+        self.distance = 0.0
+        """degrees to turn, positive clockwise"""
+        self.direction = 1
+        self.startTime = 0
+        self.v0 = 0.0
+        self.peakRate = 0.0
+        self.deceleration = TurnProfile.acceleration
+        self.accelTime = 0.0
+        """seconds"""
+        self.cruiseTime = 0.0
+        self.decelTime = 0.0
+        self.written = None
+        """setpoint last written by the profile, to notice when another caller changes it"""
+        self.rate = 0.0
+        """profile rate of the latest update in deg/s"""
+        self.unbound = False
+        """True while the profile has unbound the PID from the bank, see TurnProfile.stop()"""
+
+    def start(self, target : float):
+        """Plans a turn from the current heading and gyro rate to target (degrees)"""
+        if self.pid.isAutoUpdate():
+            self.pid.unbind()
+            self.unbound = True
+        self.target = target
+        self.startHeading = frame.heading
+        self.startTime = frame.timestamp
+        error = (target - frame.heading + 180) % 360 - 180
+        self.direction = 1 if error >= 0 else -1
+        self.distance = abs(error)
+        a = TurnProfile.acceleration
+        self.v0 = min(max(frame.gyroRate * self.direction, 0), TurnProfile.maxRate) # keep turning if already turning the right way
+        self.peakRate = TurnProfile.maxRate
+        if (self.peakRate**2 - self.v0**2) / (2*a) + self.peakRate**2 / (2*a) > self.distance: # too short to reach maxRate
+            self.peakRate = math.sqrt((2*a*self.distance + self.v0**2) / 2)
+        self.deceleration = a
+        if self.peakRate < self.v0: # already too fast to stop at the normal rate, brake harder
+            self.peakRate = self.v0
+            self.deceleration = self.v0**2 / (2*self.distance) if self.distance > 0 else a
+        self.accelTime = (self.peakRate - self.v0) / a
+        self.decelTime = self.peakRate / self.deceleration if self.deceleration > 0 else 0
+        cruiseDistance = self.distance - (self.peakRate**2 - self.v0**2) / (2*a) - self.peakRate**2 / (2*self.deceleration)
+        self.cruiseTime = max(cruiseDistance, 0) / self.peakRate if self.peakRate > 0 else 0
+
+    def duration(self):
+        return self.accelTime + self.cruiseTime + self.decelTime
+
+    def sample(self, t : float):
+        """Returns (degrees turned, rate, acceleration) t seconds into the profile"""
+        a = TurnProfile.acceleration
+        if t < self.accelTime:
+            return (self.v0*t + a*t*t/2, self.v0 + a*t, a)
+        accelDistance = (self.peakRate**2 - self.v0**2) / (2*a)
+        t -= self.accelTime
+        if t < self.cruiseTime:
+            return (accelDistance + self.peakRate*t, self.peakRate, 0.0)
+        t -= self.cruiseTime
+        if t < self.decelTime:
+            return (accelDistance + self.peakRate*self.cruiseTime + self.peakRate*t - self.deceleration*t*t/2, self.peakRate - self.deceleration*t, -self.deceleration)
+        return (self.distance, 0.0, 0.0)
+
+    def getOutput(self):
+        """Advances the profile and returns the turn output. Call once per cycle while turning."""
+        if self.written == None or self.pid.setpoint != self.written: # new target from a setNewSetpoint() call
+            self.start(self.pid.setpoint)
+        position, self.rate, acceleration = self.sample((frame.timestamp - self.startTime) / 1000000)
+        self.pid.setNewSetpoint(self.startHeading + self.direction * position)
+        self.written = self.pid.setpoint
+        self.pid.update() # unbound while the profile runs, so this is the only update this cycle
+        rate = self.direction * self.rate
+        feedforward = TurnProfile.kV * rate + TurnProfile.kA * self.direction * acceleration
+        return self.pid.getOutput() + feedforward + TurnProfile.kRate * (rate - frame.gyroRate)
+
+    def heading(self):
+        """Heading being turned to: the target while a turn runs, otherwise the PID's setpoint"""
+        if self.written != None and self.pid.setpoint == self.written:
+            return self.target
+        return self.pid.setpoint
+
+    def settled(self):
+        """True once the profile has finished and the heading error and rate are both small"""
+        if (frame.timestamp - self.startTime) / 1000000 < self.duration():
+            return False
+        error = (self.target - frame.heading + 180) % 360 - 180
+        return abs(error) < TurnProfile.settleError and abs(frame.gyroRate) < TurnProfile.settleRate
+
+    def stop(self):
+        """Forgets the current turn and binds the PID again. The next getOutput() plans a new one."""
+        self.written = None
+        if self.unbound:
+            self.pid.bind()
+            self.unbound = False
+
+turnProfile = TurnProfile(turnPID)
+"""profiled turns in place with turnPID, used by the TURNING state"""
+
+fruitTurnPID = PID(2,0,1, 100, None, False, invertInput=True) # PID(4,0,2) worked with the latency compensated input in the sim only. Keep these until the gyroRate sign is checked on the robot
 """PID to use vision object pixel position to turn the robot. \n
 Similar behavior may be achieved by scaling the pixel value to degrees from center, then using the turnPID. turnPID would have to be unbound from auto update for turnPID to work correctly for this behavior."""
 fruitTurnPID.unbind() # prevent the state machine from automatically updating this PID. An input supplier must be given for auto update to work
 fruitTurnPID.setNewSetpoint(160) # 160 with pixel data
 
-fruitDistPID = PID(4,0,1, 100, None, False) # fruitDistPID = PID(5,0,1, 100, None, False)
+fruitDistPID = PID(4,0,1, 100, None, False) # PID(6,0,1.5) worked with the latency compensated input in the sim only
 fruitDistPID.unbind()
 fruitDistPID.setNewSetpoint(300) # 220 with pixel data
 
@@ -927,25 +2278,740 @@ wallPID = PID(1, 0, 1, 150,None, False, False)
 wallPID.unbind()
 wallPID.setNewSetpoint(125)
 
-lineTurnPID = PID(1,0,0,100,lambda: robot.lineL.value(PERCENT) - robot.lineR.value(PERCENT))
+lineTurnPID = PID(1,0,0,100,lambda: frame.lineL - frame.lineR)
 lineTurnPID.setNewSetpoint(0) # difference of 0
-# lineDistPID = PID(1,0,0,100,lambda: (robot.lineL.value(PERCENT) + robot.lineR.value(PERCENT)) / 2, invertInput=True)
-lineDistPID = PID(1,0,0,100,lambda: min(robot.lineL.value(PERCENT), robot.lineR.value(PERCENT)), invertInput=True)
+# lineDistPID = PID(1,0,0,100,lambda: (frame.lineL + frame.lineR) / 2, invertInput=True)
+lineDistPID = PID(1,0,0,100,lambda: min(frame.lineL, frame.lineR), invertInput=True)
 lineDistPID.setNewSetpoint(65)
 
 class TimeLogger:
-    times = []
-    timeUsage = []
+    """Section level cycle profiler. \n
+    TimeLogger.time(name) records the time since the previous mark as the named section. Every section keeps a rolling window for min/mean/p95/max and a fixed size histogram. \n
+    While disabled every call returns immediately. Use TimeLogger.setEnabled() to switch it, which takes effect at the start of the next cycle."""
+    enabled = False
+    pendingEnabled = False
+    """enabled as last set by TimeLogger.setEnabled(), applied by the next TimeLogger.startCycle() so no cycle is timed from a stale mark"""
+    onScreen = False
+    """True to show the profile on the brain screen instead of the normal printout"""
+    windowSize = 100
+    """number of samples kept per section for min/mean/p95/max"""
+    histogramBins = 16
+    """bin 0 counts times under 64us, each following bin doubles the limit, the last bin counts everything else"""
+
+    class Section:
+        def __init__(self, name : str):
+            self.name = name
+            self.samples = [0] * TimeLogger.windowSize
+            """rolling window of section times in microseconds"""
+            self.index = 0
+            self.count = 0
+            self.histogram = [0] * TimeLogger.histogramBins
+            self.latest = 0
+            self.latestCycle = -1
+            """cycle number of the latest sample"""
+            self.inWorstCycle = 0
+            """time this section took during the worst cycle"""
+        def add(self, t : int):
+            self.samples[self.index] = t
+            self.index = (self.index + 1) % TimeLogger.windowSize
+            if self.count < TimeLogger.windowSize:
+                self.count += 1
+            self.latest = t
+            self.latestCycle = TimeLogger.cycleNumber
+            bin = 0
+            limit = 64
+            while t >= limit and bin < TimeLogger.histogramBins - 1:
+                bin += 1
+                limit *= 2
+            self.histogram[bin] += 1
+        def stats(self):
+            """Returns (min, mean, p95, max) over the rolling window. Sorts a copy of the window, so it is only meant for reports."""
+            if self.count == 0:
+                return (0, 0, 0, 0)
+            window = sorted(self.samples[:self.count])
+            return (window[0], sum(window) // self.count, window[(self.count - 1) * 95 // 100], window[-1])
+
+    sections : dict[str, Section] = {}
+    mark = 0
+    """time of the previous mark in microseconds"""
+    cycleStart = 0
+    cycleNumber = 0
+    worstCycle = 0
+    """longest control cycle seen in microseconds"""
+
+    @classmethod
+    def start(cls):
+        """Sets the mark the next section is timed from"""
+        if not cls.enabled:
+            return
+        cls.mark = brain.timer.system_high_res()
+    @classmethod
+    def setEnabled(cls, enabled : bool):
+        """Turns the profiler on or off from the next control cycle. Turning it on starts a new profile."""
+        cls.pendingEnabled = enabled
+    @classmethod
+    def startCycle(cls):
+        """Starts timing a control cycle"""
+        if cls.pendingEnabled != cls.enabled:
+            cls.enabled = cls.pendingEnabled
+            if cls.enabled:
+                cls.reset()
+        if not cls.enabled:
+            return
+        cls.cycleNumber += 1
+        cls.cycleStart = brain.timer.system_high_res()
+        cls.mark = cls.cycleStart
+    @classmethod
+    def time(cls, name : str):
+        """Records the time since the previous mark as the named section and moves the mark"""
+        if not cls.enabled:
+            return
+        now = brain.timer.system_high_res()
+        cls.record(name, now - cls.mark)
+        cls.mark = now
+    @classmethod
+    def record(cls, name : str, t : int):
+        """Adds a time in microseconds to the named section"""
+        section = cls.sections.get(name)
+        if section == None:
+            section = TimeLogger.Section(name)
+            cls.sections[name] = section
+        section.add(t)
+    @classmethod
+    def endCycle(cls):
+        """Ends the control cycle and keeps the breakdown of the worst cycle"""
+        if not cls.enabled:
+            return
+        total = brain.timer.system_high_res() - cls.cycleStart
+        if total > cls.worstCycle:
+            cls.worstCycle = total
+            for section in cls.sections.values():
+                section.inWorstCycle = section.latest if section.latestCycle == cls.cycleNumber else 0
+    @classmethod
+    def reset(cls):
+        cls.sections.clear()
+        cls.worstCycle = 0
+    @classmethod
+    def report(cls):
+        """Queues all sections for serial through Telemetry, so the report goes out at its rate instead of blocking the cycle"""
+        Telemetry.message("Profile (us) section: min mean p95 max | worst cycle | histogram from <64us")
+        for section in cls.sections.values():
+            stats = section.stats()
+            Telemetry.message(section.name + ": " + " ".join([str(v) for v in stats]) + " | " + str(section.inWorstCycle) + " | " + str(section.histogram))
+        Telemetry.message("Worst cycle: " + str(cls.worstCycle))
+    @classmethod
+    def addToPrinter(cls):
+        """Adds one line per section to the brain print list"""
+        line = 0
+        for section in cls.sections.values():
+            if line >= len(Printer.brainList) - 1:
+                break
+            stats = section.stats()
+            Printer.add((section.name, " ", stats[0], "/", stats[1], "/", stats[2], "/", stats[3]), 0, line)
+            line += 1
+        Printer.add(("Worst cycle: ", cls.worstCycle), 0, line)
+
+class Telemetry:
+    """Rate limited serial telemetry. \n
+    Fields are registered with a name, a sample rate and a supplier. Telemetry.update() samples the fields that are due and queues one CSV frame:
+    the timestamp in ms followed by one column per field, left empty when the field was not sampled. A "#" header line names the columns. \n
+    Frames are only written while the byte budget allows. When the queue is full new frames are dropped instead of blocking the program,
+    and the number dropped is itself a field."""
+    enabled = True
+    bytesPerSecond = 2000
+    """serial budget. Printing blocks once the serial buffer is full, so stay well below the link speed."""
+    maxBurst = 500
+    """most bytes written in one update"""
+    maxQueued = 20
+    """frames waiting to be written before new ones are dropped"""
+    headerInterval = 5000000
+    """microseconds between header lines, so a reader that connects late still gets the column names"""
+
+    class Field:
+        def __init__(self, name : str, rate : float, supplier : Callable[[], object]):
+            self.name = name
+            self.interval = int(1000000 / rate)
+            """microseconds between samples"""
+            self.supplier = supplier
+            self.nextSample = 0
+
+    fields : list[Field] = []
+    queue : list[str] = []
+    dropped = 0
+    """frames dropped because the queue was full"""
+    budget = 0.0
+    """bytes that may be written now"""
+    lastUpdate = 0
+    headerDue = 0
+
+    @classmethod
+    def register(cls, name : str, rate : float, supplier : Callable[[], object]):
+        """Adds a field sampled rate times per second"""
+        cls.fields.append(Telemetry.Field(name, rate, supplier))
+        cls.headerDue = 0
+
+    @classmethod
+    def message(cls, text : str):
+        """Queues a line of text, written like the frames within the byte budget. It starts with "# " so CSV readers can skip it.
+        Messages are never dropped, but frames are while they fill the queue."""
+        cls.queue.append("# " + text)
+
+    @classmethod
+    def format(cls, value):
+        if value == None:
+            return "-"
+        if type(value) == float:
+            return str(round(value, 2))
+        return str(value)
+
+    @classmethod
+    def sample(cls, now : int):
+        """Queues a frame with the fields that are due, or drops it if the queue is full"""
+        columns = [str(now // 1000)]
+        due = False
+        for field in cls.fields:
+            if now >= field.nextSample:
+                field.nextSample = max(field.nextSample + field.interval, now) # don't catch up on missed samples
+                columns.append(cls.format(field.supplier()))
+                due = True
+            else:
+                columns.append("")
+        if not due:
+            return
+        if len(cls.queue) >= cls.maxQueued:
+            cls.dropped += 1
+            return
+        cls.queue.append(",".join(columns))
+
+    @classmethod
+    def update(cls):
+        """Samples the due fields and writes queued frames within the byte budget. Call from a task at least as fast as the fastest field."""
+        if not cls.enabled:
+            return
+        now = brain.timer.system_high_res()
+        cls.budget = min(cls.budget + (now - cls.lastUpdate) * cls.bytesPerSecond / 1000000, cls.maxBurst)
+        cls.lastUpdate = now
+        if now >= cls.headerDue:
+            cls.queue.insert(0, "#t," + ",".join([field.name for field in cls.fields]))
+            cls.headerDue = now + cls.headerInterval
+        cls.sample(now)
+        while len(cls.queue) > 0 and len(cls.queue[0]) + 1 <= cls.budget:
+            line = cls.queue.pop(0)
+            cls.budget -= len(line) + 1
+            print(line)
+
+class FlightRecorder:
+    """Binary log of every control cycle on the SD card. \n
+    Each cycle packs one fixed size record (FlightRecorder.recordFormat) into a ring of preallocated blocks.
+    Full blocks are written by a writer thread with one appendfile each. Threads are cooperative, so a write still holds the brain while it runs:
+    the writer only starts one when the scheduler is sleeping with at least FlightRecorder.writeTime to spare, so writes fit the idle time
+    between tasks instead of delaying them. If writes take longer than any idle time, blocks pile up; once forceBlocks are waiting one is
+    written anyway, delaying the next task rather than losing the log. If the ring still fills, records are dropped and counted (shown on
+    the brain screen); the cycle counter in each record shows where. Whenever the robot goes back to DEFAULT mode, everything recorded so far
+    is written, including the partly filled block. \n
+    The log is flightN.bin with a text description in flightN.txt: the struct format, the field names and the mode and state names.
+    tools/flightlog.py reads both on the host."""
+    recordFormat = "<IBBH26f"
+    fieldNames = ["t", "mode", "state", "cycle",
+                  "heading", "roll", "pitch", "gyroRate", "sonarB", "sonarR", "lineL", "lineR",
+                  "driveFL", "driveFR", "driveBL", "driveBR", "posX", "posY",
+                  "turnPID", "wallPID", "fruitTurnPID", "fruitDistPID", "armFruitPID",
+                  "cmdFL", "cmdFR", "cmdBL", "cmdBR", "cmdLift", "cmdGripper", "cmdTray"]
+    recordSize = struct.calcsize(recordFormat)
+    recordsPerBlock = 100
+    """one second of records, so the fixed cost of each appendfile is paid once a second"""
+    blockCount = 4
+    writerSleep = 5
+    """milliseconds the writer thread sleeps between checks for a full block"""
+    forceBlocks = 2
+    """full blocks waiting after which the writer writes without waiting for idle time"""
+    writeTime = 3000
+    """microseconds one block write is expected to take, the average of the writes so far"""
+
+    enabled = False
+    name = ""
+    blocks : list[bytearray] = []
+    full : list[int] = []
+    """indexes of blocks waiting to be written, oldest first"""
+    block = 0
+    """index of the block being filled"""
+    offset = 0
+    """byte offset of the next record in the block being filled"""
+    cycle = 0
+    dropped = 0
+    """records dropped because every block was waiting to be written"""
+
     @classmethod
-    def time(cls):
-        """records the current time to the timing list"""
-        cls.times.append(brain.timer.system_high_res())
+    def start(cls):
+        """Picks an unused log name and allocates the blocks. Does nothing without an SD card."""
+        if not brain.sdcard.is_inserted():
+            return
+        i = 0
+        while brain.sdcard.exists("flight" + str(i) + ".bin") or brain.sdcard.exists("flight" + str(i) + ".txt"):
+            i += 1
+        cls.name = "flight" + str(i)
+        cls.blocks = [bytearray(cls.recordSize * cls.recordsPerBlock) for _ in range(cls.blockCount)]
+        description = "format " + cls.recordFormat + "\nfields " + " ".join(cls.fieldNames) + "\n"
+        for i in range(len(Modes.names)):
+            description += "mode " + str(i) + " " + Modes.names[i] + "\n"
+        for i in range(len(States.names)):
+            description += "state " + str(i) + " " + States.names[i] + "\n"
+        brain.sdcard.savefile(cls.name + ".txt", bytearray(description, "utf-8"))
+        cls.enabled = True
+        Thread(cls.writer)
+
+    @classmethod
+    def record(cls):
+        """Packs this cycle into the current block. Call once per control cycle, after the motor outputs."""
+        if not cls.enabled:
+            return
+        cls.cycle = (cls.cycle + 1) % 65536
+        if cls.block in cls.full: # the writer hasn't caught up with the whole ring
+            cls.dropped += 1
+            return
+        struct.pack_into(cls.recordFormat, cls.blocks[cls.block], cls.offset,
+                         frame.timestamp % 4294967296, currentMode, currentState, cls.cycle,
+                         frame.heading, frame.roll, frame.pitch, frame.gyroRate, frame.sonarB, frame.sonarR, frame.lineL, frame.lineR,
+                         frame.driveFL, frame.driveFR, frame.driveBL, frame.driveBR, drivetrain.robotPos[0], drivetrain.robotPos[1],
+                         turnPID.output, wallPID.output, fruitTurnPID.output, fruitDistPID.output, armFruitPID.output,
+                         robot.motor_FL.value, robot.motor_FR.value, robot.motor_BL.value, robot.motor_BR.value,
+                         arm.liftGroup.value, arm.gripper.value, robot.motor_TRAY.value)
+        cls.offset += cls.recordSize
+        if cls.offset >= len(cls.blocks[cls.block]):
+            cls.full.append(cls.block)
+            cls.block = (cls.block + 1) % cls.blockCount
+            cls.offset = 0
+
+    @classmethod
+    def writer(cls):
+        """Writer thread. Writes at most one full block per wake up, and only while the scheduler is idle for long enough."""
+        while True:
+            now = brain.timer.system_high_res()
+            if len(cls.full) >= cls.forceBlocks or (len(cls.full) > 0 and Scheduler.idleUntil - now >= cls.writeTime):
+                brain.sdcard.appendfile(cls.name + ".bin", cls.blocks[cls.full[0]])
+                cls.full.pop(0) # only free the block once it is written
+                cls.writeTime += (brain.timer.system_high_res() - now - cls.writeTime) * 0.2
+            sleep(cls.writerSleep)
+
+    @classmethod
+    def flush(cls):
+        """Writes the full blocks now"""
+        while len(cls.full) > 0:
+            brain.sdcard.appendfile(cls.name + ".bin", cls.blocks[cls.full[0]])
+            cls.full.pop(0)
+
+    @classmethod
+    def transition(cls, now : int, fromMode : int, fromState : int, toMode : int, toState : int):
+        """State machine listener. Writes the log whenever a run ends, however it ends."""
+        if toMode == Modes.DEFAULT and fromMode != Modes.DEFAULT:
+            cls.stop()
+
+    @classmethod
+    def stop(cls):
+        """Writes everything recorded so far, including the partly filled block"""
+        if not cls.enabled:
+            return
+        cls.flush()
+        if cls.offset > 0:
+            brain.sdcard.appendfile(cls.name + ".bin", cls.blocks[cls.block][:cls.offset])
+            cls.offset = 0
+
+class Scheduler:
+    """Cooperative fixed-rate scheduler. Each registered task runs at its own period. \n
+    Tasks never interrupt each other; when several are due, the one registered first runs first."""
+    class Task:
+        def __init__(self, name : str, period : int, callback : Callable[[], None]):
+            self.name = name
+            self.period = period
+            """microseconds between runs"""
+            self.callback = callback
+            self.nextRun = 0
+            """time the task is next due in microseconds"""
+            self.runs = 0
+            self.misses = 0
+            """number of periods skipped because the task started more than a full period late"""
+            self.jitter = 0
+            """microseconds the latest run started after it was due"""
+            self.averageJitter = 0.0
+            """exponential moving average of jitter"""
+            self.maxJitter = 0
+        def run(self, now : int):
+            self.jitter = now - self.nextRun
+            self.averageJitter += (self.jitter - self.averageJitter) * 0.05
+            if self.jitter > self.maxJitter:
+                self.maxJitter = self.jitter
+            self.runs += 1
+
+            if TimeLogger.enabled:
+                self.callback()
+                TimeLogger.record(self.name, brain.timer.system_high_res() - now)
+            else:
+                self.callback()
+
+            self.nextRun += self.period
+            if self.nextRun <= now: # more than a period behind: skip the missed runs instead of running them back to back
+                missed = (now - self.nextRun) // self.period + 1
+                self.misses += missed
+                self.nextRun += missed * self.period
+
+    tasks : list[Task] = []
+    idleUntil = 0
+    """while Scheduler.run() sleeps, the time it wakes up in microseconds. 0 while a task runs."""
+
+    @classmethod
+    def addTask(cls, name : str, frequency : float, callback : Callable[[], None]):
+        """Registers a task to run frequency times per second. Tasks registered first have priority."""
+        task = Scheduler.Task(name, int(1000000 / frequency), callback)
+        cls.tasks.append(task)
+        return task
+    @classmethod
+    def run(cls):
+        """Runs the registered tasks forever"""
+        now = brain.timer.system_high_res()
+        for task in cls.tasks:
+            task.nextRun = now
+        while True:
+            now = brain.timer.system_high_res()
+            nextRun = cls.tasks[0].nextRun
+            for task in cls.tasks:
+                if now >= task.nextRun:
+                    task.run(now)
+                    break # start over from the highest priority task
+                if task.nextRun < nextRun:
+                    nextRun = task.nextRun
+            else: # nothing was due
+                if nextRun - now >= 1000:
+                    cls.idleUntil = nextRun
+                    sleep((nextRun - now) // 1000) # sleeping also lets other threads (event callbacks, the flight recorder writer) run
+                    cls.idleUntil = 0
+
+class StateMachine:
+    """Table driven state machine. \n
+    Every (mode, state) pair can have a handler with tick, enter and exit hooks, and every mode a tick that runs before the state's.
+    Handlers request a new state through newState (or change currentMode directly); the change happens at the start of the next cycle,
+    when the old pair's exit hook and the new pair's enter hook run. \n
+    The latest transitions are kept in a ring buffer and the time spent in each state is totalled."""
+    stateCount = len(States.names)
+    modeCount = len(Modes.names)
+
+    class Handler:
+        def __init__(self, tick : Callable[[], None] | None, enter : Callable[[], None] | None, exit : Callable[[], None] | None):
+            self.tick = tick
+            self.enter = enter
+            self.exit = exit
+
+    handlers : list[Handler | None] = [None] * (modeCount * stateCount)
+    """indexed by mode * stateCount + state"""
+    modeTicks : list[Callable[[], None] | None] = [None] * modeCount
+
+    historySize = 32
+    historyTime = [0] * historySize
+    historyFromMode = [0] * historySize
+    historyFromState = [0] * historySize
+    historyToMode = [0] * historySize
+    historyToState = [0] * historySize
+    historyIndex = 0
+    """slot the next transition is written to"""
+    historyCount = 0
+
+    dwellTotal = [0] * stateCount
+    """microseconds spent in each state, not counting the current visit"""
+    entries = [0] * stateCount
+    """number of times each state was entered"""
+    mode = currentMode
+    state = currentState
+    """the (mode, state) pair whose enter hook ran last"""
+    enteredAt = 0
+    listeners : list[Callable[[int, int, int, int, int], None]] = []
+    """called on every transition with (time, from mode, from state, to mode, to state), before the new pair's enter hook"""
+
+    @classmethod
+    def register(cls, mode : int, state : int, tick : Callable[[], None] | None, enter : Callable[[], None] | None = None, exit : Callable[[], None] | None = None):
+        cls.handlers[mode * cls.stateCount + state] = StateMachine.Handler(tick, enter, exit)
+    @classmethod
+    def registerMode(cls, mode : int, tick : Callable[[], None]):
+        cls.modeTicks[mode] = tick
+    @classmethod
+    def listen(cls, listener : Callable[[int, int, int, int, int], None]):
+        cls.listeners.append(listener)
+
+    @classmethod
+    def transition(cls):
+        """Applies newState and runs the hooks if the (mode, state) pair changed"""
+        global currentState
+        global newState
+        if newState != None:
+            currentState = newState
+        newState = None
+        if currentMode == cls.mode and currentState == cls.state:
+            return
+        handler = cls.handlers[cls.mode * cls.stateCount + cls.state]
+        if handler != None and handler.exit != None:
+            handler.exit()
+        now = frame.timestamp
+        cls.dwellTotal[cls.state] += now - cls.enteredAt
+        i = cls.historyIndex
+        cls.historyTime[i] = now
+        cls.historyFromMode[i] = cls.mode
+        cls.historyFromState[i] = cls.state
+        cls.historyToMode[i] = currentMode
+        cls.historyToState[i] = currentState
+        cls.historyIndex = (i + 1) % cls.historySize
+        cls.historyCount = min(cls.historyCount + 1, cls.historySize)
+        cls.mode = currentMode
+        cls.state = currentState
+        cls.enteredAt = now
+        cls.entries[currentState] += 1
+        for listener in cls.listeners:
+            listener(now, cls.historyFromMode[i], cls.historyFromState[i], currentMode, currentState)
+        handler = cls.handlers[currentMode * cls.stateCount + currentState]
+        if handler != None and handler.enter != None:
+            handler.enter()
+
+    @classmethod
+    def run(cls):
+        """Runs one cycle: the pending transition, then the mode's tick and the state's tick"""
+        if cls.enteredAt == 0: # first cycle
+            cls.enteredAt = frame.timestamp
+        cls.transition()
+        mode = currentMode # a mode tick that changes the mode still lets this cycle's state tick run
+        modeTick = cls.modeTicks[mode]
+        if modeTick != None:
+            modeTick()
+        handler = cls.handlers[mode * cls.stateCount + currentState]
+        if handler != None and handler.tick != None:
+            handler.tick()
+
+    @classmethod
+    def dwell(cls):
+        """Microseconds since the current state was entered"""
+        return frame.timestamp - cls.enteredAt
+    @classmethod
+    def history(cls):
+        """Returns the kept transitions, oldest first, as (time, from mode, from state, to mode, to state)"""
+        result = []
+        for n in range(cls.historyCount):
+            i = (cls.historyIndex - cls.historyCount + n) % cls.historySize
+            result.append((cls.historyTime[i], cls.historyFromMode[i], cls.historyFromState[i], cls.historyToMode[i], cls.historyToState[i]))
+        return result
+
+class RunStats:
+    """Accounts for where the time of a run goes. \n
+    A run starts when the robot leaves DEFAULT mode and ends when it goes back to it. RunStats listens to the state machine's transitions
+    and totals the time spent in every (mode, state) pair. In collection mode the time is also split into per fruit cycles made of five
+    phases: search, approach, grasp, stow and return. After a fruit is stowed its cycle stays open through the search for the next fruit,
+    and ends when the robot approaches that fruit, or, if it goes to the baskets instead, once it has unloaded and backed away.
+    So the trip to the baskets is charged to the fruit that filled the tray. \n
+    At the end of a run the summary is shown on the brain screen and saved to runN.csv on the SD card by the low rate RunStats.update() task;
+    tools/runstats.py compares runs."""
+    SEARCH = 0
+    APPROACH = 1
+    GRASP = 2
+    STOW = 3
+    RETURN = 4
+    phaseNames = ["search", "approach", "grasp", "stow", "return"]
+
+    class Cycle:
+        def __init__(self, start : int):
+            self.start = start
+            self.end = 0
+            self.phaseTime = [0] * len(RunStats.phaseNames)
+            """microseconds spent in each phase"""
+            self.fruit = False
+            """True once a fruit the gripper held was stowed. A grasp that closes on nothing doesn't count."""
+            self.unloaded = False
+            """True once the robot reached the baskets"""
+        def total(self):
+            return sum(self.phaseTime)
+
+    active = False
+    onScreen = False
+    """True to show the summary of the latest run on the brain screen"""
+    startedAt = 0
+    endedAt = 0
+    lastTransition = 0
+    pairTime = [0] * (StateMachine.modeCount * StateMachine.stateCount)
+    """microseconds spent in each (mode, state) pair during the run, indexed like StateMachine.handlers"""
+    pairEntries = [0] * (StateMachine.modeCount * StateMachine.stateCount)
+    cycles : list[Cycle] = []
+    """finished cycles of the run, oldest first"""
+    cycle : Cycle | None = None
+    """the cycle in progress"""
+    phase : int | None = None
+    """phase of the current state, None outside collection mode"""
+    fileName = ""
+    """name of the latest export"""
+    exportPending = False
+    """True when a finished run is waiting for RunStats.update() to save it"""
+
+    @classmethod
+    def transition(cls, now : int, fromMode : int, fromState : int, toMode : int, toState : int):
+        """State machine listener"""
+        if cls.active:
+            cls.add(now - cls.lastTransition, fromMode, fromState)
+            if toMode == Modes.DEFAULT:
+                cls.finish(now)
+                return
+        elif toMode != Modes.DEFAULT:
+            cls.begin(now)
+        else:
+            return
+        cls.lastTransition = now
+        cls.pairEntries[toMode * StateMachine.stateCount + toState] += 1
+        cls.enterPhase(now, toMode, toState)
+
+    @classmethod
+    def begin(cls, now : int):
+        cls.active = True
+        if cls.onScreen:
+            cls.onScreen = False
+            Printer.clearBrain()
+        cls.startedAt = now
+        cls.pairTime = [0] * len(cls.pairTime)
+        cls.pairEntries = [0] * len(cls.pairEntries)
+        cls.cycles = []
+        cls.cycle = RunStats.Cycle(now)
+        cls.phase = None
+
+    @classmethod
+    def add(cls, t : int, mode : int, state : int):
+        """Charges t microseconds to a (mode, state) pair and to the current phase"""
+        cls.pairTime[mode * StateMachine.stateCount + state] += t
+        if cls.phase != None:
+            cls.cycle.phaseTime[cls.phase] += t
+
+    @classmethod
+    def enterPhase(cls, now : int, mode : int, state : int):
+        """Works out the phase of the state being entered and closes the cycle when a new one begins"""
+        if mode != Modes.COLLECTION:
+            cls.phase = None
+            return
+        cycle = cls.cycle
+        if state == States.CLOSING:
+            phase = cls.GRASP
+        elif state == States.DROPFRUIT:
+            phase = cls.STOW
+        elif state == States.BASKET_FOLLOWING or state == States.UNLOAD_RAISE_ARM or state == States.UNLOAD or state == States.UNLOAD_LOWER_ARM:
+            cycle.unloaded = True
+            phase = cls.RETURN
+        elif state == States.BACK_AWAY:
+            if cls.phase == cls.STOW: # the fruit was just put in the tray
+                phase = cls.STOW
+                if arm.holdingFruit(): # the gripper only lets go while backing away
+                    cycle.fruit = True
+            elif cycle.unloaded:
+                phase = cls.RETURN
+            else: # backing off a fruit that was lost
+                phase = cls.APPROACH
+        elif state == States.FRUITFOLLOWING or state == States.DRIVE_TO_FRUIT:
+            phase = cls.APPROACH
+        elif returningToBaskets:
+            phase = cls.RETURN
+        else:
+            phase = cls.SEARCH
+        unloadFinished = cycle.unloaded and cls.phase == cls.RETURN and phase != cls.RETURN
+        nextFruit = cycle.fruit and phase == cls.APPROACH and (cls.phase == cls.SEARCH or cls.phase == cls.STOW) and not returningToBaskets # a fruit seen on the way to the baskets doesn't start a new cycle
+        if unloadFinished or nextFruit:
+            cycle.end = now
+            cls.cycles.append(cycle)
+            cls.cycle = RunStats.Cycle(now)
+        cls.phase = phase
+
+    @classmethod
+    def finish(cls, now : int):
+        """Ends the run, keeps the unfinished cycle if it took any time, shows the summary and exports it"""
+        cls.active = False
+        cls.endedAt = now
+        if cls.cycle.total() > 0:
+            cls.cycle.end = now
+            cls.cycles.append(cls.cycle)
+        cls.cycle = None
+        cls.phase = None
+        cls.onScreen = True
+        Printer.clearBrain()
+        cls.exportPending = True # saving touches the SD card, so it isn't done inside the transition
+
+    @classmethod
+    def update(cls):
+        """Saves a finished run. Low rate task."""
+        if cls.exportPending:
+            cls.exportPending = False
+            cls.export()
+
+    @classmethod
+    def seconds(cls, t : int):
+        return round(t / 1000000, 2)
+
     @classmethod
-    def timeUsageCalc(cls):
-        """calculates the time for each item this cycle using the timing list"""
-        cls.timeUsage.clear()
-        for i in range(len(cls.times)-1):
-            cls.timeUsage.append(cls.times[i+1]-cls.times[i])
+    def modeTime(cls, mode : int):
+        """Microseconds spent in a mode during the run"""
+        i = mode * StateMachine.stateCount
+        return sum(cls.pairTime[i:i + StateMachine.stateCount])
+
+    @classmethod
+    def phaseTotals(cls):
+        """Microseconds spent in each phase over the finished cycles"""
+        totals = [0] * len(cls.phaseNames)
+        for cycle in cls.cycles:
+            for p in range(len(totals)):
+                totals[p] += cycle.phaseTime[p]
+        return totals
+
+    @classmethod
+    def export(cls):
+        """Saves the run to the first unused runN.csv. Every line starts with its kind; a line starting with # names the kind's columns."""
+        if not brain.sdcard.is_inserted():
+            return
+        i = 0
+        while brain.sdcard.exists("run" + str(i) + ".csv"):
+            i += 1
+        cls.fileName = "run" + str(i) + ".csv"
+        fruits = len([cycle for cycle in cls.cycles if cycle.fruit])
+        lines = ["#run,seconds,cycles,fruits,flight",
+                 "run," + str(cls.seconds(cls.endedAt - cls.startedAt)) + "," + str(len(cls.cycles)) + "," + str(fruits) + "," + FlightRecorder.name,
+                 "#cycle,number,fruit,start," + ",".join(cls.phaseNames) + ",total"]
+        for n in range(len(cls.cycles)):
+            cycle = cls.cycles[n]
+            lines.append("cycle," + str(n + 1) + "," + str(int(cycle.fruit)) + "," + str(cls.seconds(cycle.start - cls.startedAt)) + ","
+                         + ",".join([str(cls.seconds(t)) for t in cycle.phaseTime]) + "," + str(cls.seconds(cycle.total())))
+        lines.append("#mode,name,seconds")
+        for mode in range(StateMachine.modeCount):
+            if cls.modeTime(mode) > 0:
+                lines.append("mode," + Modes.names[mode] + "," + str(cls.seconds(cls.modeTime(mode))))
+        lines.append("#state,mode,name,seconds,entries")
+        for i in range(len(cls.pairTime)):
+            if cls.pairEntries[i] > 0:
+                lines.append("state," + Modes.names[i // StateMachine.stateCount] + "," + States.names[i % StateMachine.stateCount] + ","
+                             + str(cls.seconds(cls.pairTime[i])) + "," + str(cls.pairEntries[i]))
+        brain.sdcard.savefile(cls.fileName, bytearray("\n".join(lines) + "\n", "utf-8"))
+
+    @classmethod
+    def addToPrinter(cls):
+        """Shows the run on the brain screen: totals, the time per phase of the latest cycles and the states that took longest"""
+        end = frame.timestamp if cls.active else cls.endedAt
+        fruits = len([cycle for cycle in cls.cycles if cycle.fruit])
+        Printer.add(("Run ", cls.seconds(end - cls.startedAt), "s ", fruits, " fruits ", cls.fileName), 0, 0)
+        Printer.add("#  " + " ".join(cls.phaseNames), 0, 1)
+        line = 2
+        for n in range(max(0, len(cls.cycles) - 8), len(cls.cycles)):
+            cycle = cls.cycles[n]
+            Printer.add((n + 1, "" if cycle.fruit else "x", "  ", " ".join([str(cls.seconds(t)) for t in cycle.phaseTime])), 0, line)
+            line += 1
+        if len(cls.cycles) > 0:
+            Printer.add(("mean ", " ".join([str(cls.seconds(t // len(cls.cycles))) for t in cls.phaseTotals()])), 0, line)
+            line += 1
+        order = sorted(range(len(cls.pairTime)), key=lambda i: -cls.pairTime[i])
+        for i in order:
+            if line >= len(Printer.brainList) or cls.pairTime[i] == 0:
+                break
+            Printer.add((States.names[i % StateMachine.stateCount], " ", cls.seconds(cls.pairTime[i]), "s x", cls.pairEntries[i]), 0, line)
+            line += 1
+        while line < len(Printer.brainList):
+            Printer.add("", 0, line)
+            line += 1
+
+StateMachine.listen(RunStats.transition)
+StateMachine.listen(FlightRecorder.transition) # so the end of the run is on the card even if the robot is switched off next
 
 def updateCurrentWall(newWall):
     global currentWall
@@ -979,318 +3045,466 @@ cycleStartWall = 0
 prevWall = 0
 prevprevwall = 0
 wallTotal = 0
+wallLinePos : tuple[float, float] | None = None
+"""odometry position where the robot left the wall to follow a fruit, used to drive straight back to the wall"""
+targetFruit : FruitMap.Fruit | None = None
+"""known fruit the robot is driving to in DRIVE_TO_FRUIT"""
+
+def nearestWall():
+    """Returns the wall closest to the robot's field position"""
+    x = drivetrain.robotPos[0]
+    y = drivetrain.robotPos[1]
+    dists = [x, y, fieldSize[0] - x, fieldSize[1] - y]
+    return dists.index(min(dists))
 
 def stateMachine():
     """Runs the state machine."""
     global currentMode
-    global currentState
-    global PIDcontrollers
-    global returnState
-    global returnMode
-    global fruitSearching
-    global collectedCount
-    global currentWall
-    global prevWallDist
-    global inFrontOfBasket
     global newState
-    global returningToBaskets
-    global unloadCount
-    global boxCount
-    global inSpace
-    global currentCollectionColor
-    global tempColor
-    global boxOrder
-    global stateTimer
-    global gyroZeroed
-    global collectedCount
-    global cycleStartWall
-    global wallTotal
 
 # exit
-    if controllerButtons.pressed(Buttons.B): # exit button -- Do NOT remove, for safety
+    if controllerButtons.pressed(Buttons.B) and currentMode != Modes.CALIBRATE: # exit button -- Do NOT remove, for safety. Nothing drives while calibrating.
         newState = States.DEFAULT
         currentMode = Modes.DEFAULT
-# state transitions
-    if newState != None and newState != currentState:
-        currentState = newState
-    newState = None
+    StateMachine.run()
+
+def lockCamera():
+    camera.lock() # follow the same fruit until it is grabbed
+
 # modes
-    if currentMode == Modes.DEFAULT:
-        newState = States.DEFAULT
+def calibrateMode():
+    global currentMode
+    if Startup.done:
+        if controllerButtons.pressed(Buttons.A):
+            Startup.retry()
+        elif controllerButtons.pressed(Buttons.Y): # drive anyway, headings will wander
+            currentMode = Modes.DEFAULT
+    elif Startup.update():
+        if Startup.good:
+            currentMode = Modes.DEFAULT
+        else: # wait in CALIBRATE for the driver, see globalPrinter()
+            controller.rumble("---")
+
+def defaultMode():
+    global newState
+    global currentMode
+    global currentCollectionColor
+    global inSpace
+    global boxCount
+    newState = States.DEFAULT
 
-        if controllerButtons.pressed(Buttons.A): # end condition 
-            currentMode = Modes.TELEOP   # end behavior (state change + additional behaviors)
-            turnPID.setNewSetpoint(gyro.heading())
+    if controllerButtons.pressed(Buttons.A): # end condition 
+        currentMode = Modes.TELEOP   # end behavior (state change + additional behaviors)
+        turnPID.setNewSetpoint(frame.heading)
 
-        if controllerButtons.pressed(Buttons.X):
-            currentMode = Modes.COLLECTION
+    if controllerButtons.pressed(Buttons.X):
+        currentMode = Modes.COLLECTION
 
-        if controllerButtons.pressed(Buttons.Y):
-            currentMode = Modes.COLLECTION
-            newState = States.BASKET_FOLLOWING
-            currentCollectionColor = 2
-            inSpace = False
-            boxCount = 0
+    if controllerButtons.pressed(Buttons.Y):
+        currentMode = Modes.COLLECTION
+        newState = States.BASKET_FOLLOWING
+        currentCollectionColor = 2
+        inSpace = False
+        boxCount = 0
 
-        if controllerButtons.pressing(Buttons.LEFT):
-            print("BRHUHHH")
-            arm.goDefault()
+    if controllerButtons.pressing(Buttons.LEFT):
+        arm.goDefault()
 
-    elif currentMode == Modes.TELEOP:
-        # do
-        
-        turnPID.setpoint += controller.axis1.position() * .25 * dt()/1000000
-        drivetrain.drive(controller.axis3.position(), controller.axis4.position(), turnPID.getOutput(), controllerButtons.pressing(Buttons.RIGHT))
-
-        if controllerButtons.pressing(Buttons.L1):
-            arm.lift(20)
-        if controllerButtons.pressing(Buttons.L2):
-            arm.lift(-20)
-        if controllerButtons.pressed(Buttons.R1):
-            arm.open()
-            # controller.rumble(".")
-        if controllerButtons.pressed(Buttons.R2):
-            arm.close()
-            # controller.rumble("-")
-        if controllerButtons.pressed(Buttons.UP):
-            robot.trayUp()
-        if controllerButtons.pressed(Buttons.DOWN):
-            robot.trayDown()
-        #end
-        if controllerButtons.pressed(Buttons.A):
+    if controllerButtons.pressed(Buttons.UP): # toggle the profiler and its page on the brain screen
+        TimeLogger.onScreen = not TimeLogger.onScreen
+        TimeLogger.setEnabled(TimeLogger.onScreen)
+        Printer.clearBrain()
+
+    if controllerButtons.pressed(Buttons.DOWN):
+        TimeLogger.report()
+
+    if controllerButtons.pressed(Buttons.RIGHT): # toggle the summary of the latest run
+        RunStats.onScreen = not RunStats.onScreen
+        Printer.clearBrain()
+
+def teleopMode():
+    global currentMode
+    global newState
+    # do
+    
+    turnPID.setpoint += controller.axis1.position() * .25 * dt()/1000000
+    drivetrain.drive(controller.axis3.position(), controller.axis4.position(), turnPID.getOutput(), controllerButtons.pressing(Buttons.RIGHT))
+
+    if controllerButtons.pressing(Buttons.L1):
+        arm.lift(20)
+    if controllerButtons.pressing(Buttons.L2):
+        arm.lift(-20)
+    if controllerButtons.pressed(Buttons.R1):
+        arm.open()
+        # controller.rumble(".")
+    if controllerButtons.pressed(Buttons.R2):
+        arm.close()
+        # controller.rumble("-")
+    if controllerButtons.pressed(Buttons.UP):
+        robot.trayUp()
+    if controllerButtons.pressed(Buttons.DOWN):
+        robot.trayDown()
+    #end
+    if controllerButtons.pressed(Buttons.A):
+        currentMode = Modes.DEFAULT
+        newState = States.DEFAULT
+
+    if controllerButtons.pressing(Buttons.LEFT):
+        if arm.goDefault():
+            controller.rumble("--")
+
+def collectionMode():
+    global returningToBaskets
+    global newState
+    global currentMode
+    # if currentState != States.FRUITFOLLOWING:
+    #     """Put the arm back down after you get the fruit :()"""
+    #     if(arm.zero() == True):
+    #         newState = States.WALL_FOLLOWING
+    
+    if wallTotal > 12:
+        returningToBaskets = True
+        newState = States.WALL_RETURN
+        if currentCollectionColor == 0:
             currentMode = Modes.DEFAULT
-            newState = States.DEFAULT
 
-        if controllerButtons.pressing(Buttons.LEFT):
-            if arm.goDefault():
-                controller.rumble("--")
+# fruit following mode
+def followFruit():
+    global newState
+    if camera.largestObject != None:
+        drivetrain.drive(fruitDistPID.update(camera.predictedHeight()).getOutput(), 0, fruitTurnPID.update(camera.predictedCenterX()).getOutput(), True)
+        arm.lift(armFruitPID.update(camera.largestObject.centerY).getOutput())
+        arm.open()
+        if(camera.largestObject.width > 300):
+            arm.close()
+            newState = States.CLOSING
+    else:
+        drivetrain.stopAll()
 
-    elif currentMode == Modes.FRUITFOLLOWING:
-        if currentState == States.FRUITFOLLOWING:
-            if camera.largestObject != None:
-                drivetrain.drive(fruitDistPID.update(camera.largestObject.height).getOutput(), 0, fruitTurnPID.update(camera.largestObject.centerX).getOutput(), True)
-                arm.lift(armFruitPID.update(camera.largestObject.centerY).getOutput())
-                arm.open()
-                if(camera.largestObject.width > 300):
-                    arm.close()
-                    newState = States.CLOSING
-            else:
-                drivetrain.stopAll()
-        elif currentState == States.CLOSING:
-            if(arm.gripperStatus == 1):
-                newState = States.DROPFRUIT
-        elif currentState == States.DROPFRUIT:
-            if(arm.zero()):
-                arm.open()
-                newState = States.FRUITFOLLOWING
+def closeOnFruit():
+    global newState
+    if(arm.gripperStatus == 1):
+        newState = States.DROPFRUIT
+
+def dropFollowedFruit():
+    global newState
+    if(arm.zero()):
+        arm.open()
+        newState = States.FRUITFOLLOWING
 
 ############################################################################################################################################################
 ############################################################################################################################################################
 ############################################################################################################################################################
 
-    elif currentMode == Modes.COLLECTION:
-        # if currentState != States.FRUITFOLLOWING:
-        #     """Put the arm back down after you get the fruit :()"""
-        #     if(arm.zero() == True):
-        #         newState = States.WALL_FOLLOWING
-        
-        if wallTotal > 12:
+# collection mode
+def collectionInit():
+    global collectedCount
+    global fruitSearching
+    global currentWall
+    global newState
+    collectedCount = 0
+    fruitSearching = True
+    FruitMap.reset() # the robot may have been moved since the last run
+    drivetrain.positionKnown = False
+    wallPID.reset()
+    if controllerButtons.pressed(Buttons.DOWN):
+        currentWall = 0
+    if controllerButtons.pressed(Buttons.RIGHT):
+        currentWall = 1
+    if controllerButtons.pressed(Buttons.UP):
+        currentWall = 2
+    if controllerButtons.pressed(Buttons.LEFT):
+        currentWall = 3
+    if controllerButtons.pressed(Buttons.DOWN) or controllerButtons.pressed(Buttons.RIGHT) or controllerButtons.pressed(Buttons.UP) or controllerButtons.pressed(Buttons.LEFT):
+        drivetrain.setHeading(wallHeadings[currentWall])
+        turnPID.setNewSetpoint(wallHeadings[currentWall])
+        newState = States.WALL_RETURN
+
+def collectionStart():
+    global newState
+    if arm.zeroed and arm.goDefault():
+        arm.open()
+        newState = States.COLLECTION_INIT
+
+def followWall():
+    global newState
+    global wallLinePos
+    nearWall = wallFollowing(False)
+    # if nearWall and ...
+    if fruitSearching and camera.averageLargestObject != None and camera.averageLargestObject.dist < 50: # enforce max distance of 50 cm, otherwise fruit is ignored
+        if (currentCollectionColor == 0) or (camera.averageLargestObject.color + 1 == currentCollectionColor):
+            arm.open()
+            newState = States.FRUITFOLLOWING
+            wallLinePos = drivetrain.robotPos
+            armFruitPID.reset()
+            fruitDistPID.reset()
+            fruitTurnPID.reset()
+
+def followWallReverse(): # limited feature reversed wall following direction (no fruit)
+    wallFollowing(True)
+
+def returnToWall(): # decides what to do after grabbing a fruit
+    global cycleStartWall
+    global wallTotal
+    global wallLinePos
+    global returningToBaskets
+    global returnState
+    global newState
+    cycleStartWall = currentWall
+    wallTotal = 0
+    returnSpeed = 50
+    if wallLinePos != None: # reverse at full speed until close to where the robot left the wall, then let the sonar finish the approach
+        returnSpeed = max(50, min(100, drivetrain.distanceFrom(wallLinePos, wallHeadings[currentWall]) / 3)) # 300 mm away => 100%
+    drivetrain.drive(-returnSpeed, 0, turnPID.getOutput(), True)
+    # if abs(gyro.orientation(ROLL)) > 8 or abs(gyro.orientation(PITCH)) > 8: # stepped up to a wall without seeing it
+    #     currentMode = Modes.DEFAULT
+    if frame.sonarB < wallPID.setpoint + 25:
+        wallLinePos = None
+        # if returnState != None:
+        #     newState = returnState
+        #     returnState = None
+        if collectedCount >= 2 or returningToBaskets == True:
             returningToBaskets = True
-            newState = States.WALL_RETURN
-            if currentCollectionColor == 0:
-                currentMode = Modes.DEFAULT
-
-        if currentState == States.COLLECTION_INIT:
-            collectedCount = 0
-            fruitSearching = True
-            wallPID.reset()
-            if controllerButtons.pressed(Buttons.DOWN):
-                currentWall = 0
-            if controllerButtons.pressed(Buttons.RIGHT):
-                currentWall = 1
-            if controllerButtons.pressed(Buttons.UP):
-                currentWall = 2
-            if controllerButtons.pressed(Buttons.LEFT):
-                currentWall = 3
-            if controllerButtons.pressed(Buttons.DOWN) or controllerButtons.pressed(Buttons.RIGHT) or controllerButtons.pressed(Buttons.UP) or controllerButtons.pressed(Buttons.LEFT):
-                gyro.set_heading(wallHeadings[currentWall])
-                turnPID.setNewSetpoint(wallHeadings[currentWall])
-                newState = States.WALL_RETURN
-            
-        elif currentState == States.DEFAULT and arm.zeroed:
-            if arm.goDefault():
-                arm.open()
-                newState = States.COLLECTION_INIT
-
-        elif currentState == States.WALL_FOLLOWING:
-            nearWall = wallFollowing(False)
-            # if nearWall and ...
-            if fruitSearching and camera.averageLargestObject != None and camera.averageLargestObject.dist < 50: # enforce max distance of 50 cm, otherwise fruit is ignored
-                if (currentCollectionColor == 0) or (camera.averageLargestObject.color + 1 == currentCollectionColor):
-                    arm.open()
-                    newState = States.FRUITFOLLOWING
-                    armFruitPID.reset()
-                    fruitDistPID.reset()
-                    fruitTurnPID.reset()
-        
-        elif currentState == States.WALL_FOLLOWING_REVERSE: # limited feature reversed wall following direction (no fruit)
-            wallFollowing(True)
- 
-        elif currentState == States.WALL_RETURN: # decides what to do after grabbing a fruit
-            cycleStartWall = currentWall
-            wallTotal = 0
-            drivetrain.drive(-50, 0, turnPID.getOutput(), True)
-            # if abs(gyro.orientation(ROLL)) > 8 or abs(gyro.orientation(PITCH)) > 8: # stepped up to a wall without seeing it
-            #     currentMode = Modes.DEFAULT
-            if sonarB.distance(MM) < wallPID.setpoint + 25:
-                # if returnState != None:
-                #     newState = returnState
-                #     returnState = None
-                if collectedCount >= 2 or returningToBaskets == True:
-                    returningToBaskets = True
-                    if currentWall == 1:
-                        returnState = States.WALL_FOLLOWING_REVERSE
-                        newState = States.TURNING
-                        turnPID.setNewSetpoint(turnPID.setpoint + 90)
-                    else:
-                        newState = States.WALL_FOLLOWING
-                else: 
-                    newState = States.WALL_FOLLOWING
-
-        elif currentState == States.TURNING:
-            drivetrain.drive(0,0,turnPID.getOutput(), True)
-            if turnPID.atSetpoint():
-                if ((currentWall == 0 and returnState == States.WALL_FOLLOWING_REVERSE) or (currentWall == 1 and returnState == States.WALL_FOLLOWING)) and returningToBaskets:
-                    # newState = States.TURNING
-                    turnPID.setNewSetpoint(wallHeadings[2])
-                    boxCount = 0
-                    inSpace = False
-                    returnState = States.BASKET_FOLLOWING
-                    gyroZeroed = False
-                elif returnState == None:
-                    newState = States.WALL_FOLLOWING
-                else:
-                    newState = returnState
-                    returnState = None
-        
-        elif currentState == States.FRUITFOLLOWING:
-            if (camera.averageLargestObject != None and camera.largestObject != None):
-                if (currentCollectionColor != 0) and (camera.averageLargestObject.color + 1 != currentCollectionColor):
-                    newState = States.TURNING
-                
-                # if(arm.liftGroup.position() < 200):
-                #     collectedCount = 2
-                #     newState = States.WALL_RETURN
-
-                drivetrain.drive(fruitDistPID.update(camera.largestObject.height).getOutput(), 0, fruitTurnPID.update(camera.largestObject.centerX).getOutput(), True)
-                if(camera.largestObject.height < 200):
-                    arm.lift(armFruitPID.update(camera.largestObject.centerY).getOutput())
-                arm.open()
-                if(camera.largestObject.width > 300 and camera.averageLargestObject.fruitType == 1) or (camera.largestObject.width > 150 and camera.averageLargestObject.fruitType == 0): # test threshold
-                    arm.close()
-                    newState = States.CLOSING
-                tempColor = camera.averageLargestObject.color + 1
-            else:
-                drivetrain.stopAll()
-            
-            if camera.averageLargestObject == None:
-                newState = States.BACK_AWAY
-                
-        elif currentState == States.CLOSING:
-            if arm.gripperCommand == 0:
-                newState = States.DROPFRUIT
-                collectedCount += 1
-                if collectedCount >= 2:
-                    returningToBaskets = True
-
-        elif currentState == States.DROPFRUIT:
-            # drivetrain.drive(-25,0,0,True)
-            if arm.goDefault():
-                currentCollectionColor = tempColor
-                newState = States.BACK_AWAY
-                stateTimer = 0
-                if collectedCount >= 2:
-                    returningToBaskets = True
-
-        elif currentState == States.BACK_AWAY:
-            drivetrain.drive(-50,0,0, True)
-            stateTimer += dt()
-            if stateTimer > 1500000:
-                if collectedCount < 2: # only release the fruit if there is not one in the tray
-                    arm.open()
-                returnState = States.WALL_RETURN
+            if currentWall == 1:
+                returnState = States.WALL_FOLLOWING_REVERSE
                 newState = States.TURNING
-                turnPID.setNewSetpoint(wallHeadings[currentWall])
-                stateTimer = 0
-
-        elif currentState == States.BASKET_FOLLOWING:
-            if inSpace:
-                drivetrain.drive(0, 40, 0,True)
-                if(robot.lineL.value(PERCENT) <= 70) and (robot.lineR.value(PERCENT) <= 70):
-                    inSpace = False
+                turnPID.setNewSetpoint(turnProfile.heading() + 90)
             else:
-                if (robot.lineR.value(PERCENT) > 70) and (robot.lineL.value(PERCENT) <= 68):
-                    inSpace = True
-                    boxCount += 1
-                elif (robot.lineL.value(PERCENT) <= 70) and (robot.lineR.value(PERCENT) <= 70):
-                    drivetrain.drive(lineDistPID.getOutput(),50,lineTurnPID.getOutput(),True)
-                else:
-                    drivetrain.drive(20,0,0,True)
-            
-            if not gyroZeroed and robot.lineL.value(PERCENT) == robot.lineR.value(PERCENT):
-                gyro.set_heading(wallHeadings[2])
-                gyroZeroed = True
-
-            try:
-                if boxOrder.index(currentCollectionColor) == boxCount:
-                    controller.rumble("--")
-                    if(boxOrder.index(currentCollectionColor) == 0):
-                        if (robot.lineL.value(PERCENT) <= 70) and (robot.lineR.value(PERCENT) <= 70):
-                            newState = States.UNLOAD_RAISE_ARM
-                    else:
-                        Delays.schedule(
-                            Delays.Delay(1.5, States.UNLOAD_RAISE_ARM)
-                        )
-            except:
-                raise RuntimeError("Current color" + str(currentCollectionColor) + "not in colorList")
-
-        elif currentState == States.UNLOAD_RAISE_ARM:
-            if arm.goHigh():
-                newState = States.UNLOAD
-
-        elif currentState == States.UNLOAD:
-            cycleStartWall = 0
-            if unloadCount == 0:
-                stateTimer = 0
-            if robot.motor_TRAY.is_done() and arm.gripperCommand != -1 and ((stateTimer > 1500000 and unloadCount >= 3) or unloadCount < 3):
-                unloadCount += 1
-                if robot.trayState == 0:
-                    robot.trayUp()
-                else:
-                    robot.trayDown()
-            if unloadCount == 3:
-                if stateTimer == 0:
-                    arm.open()    
-                stateTimer += dt()
-
-            if unloadCount >= 8: # cycle 3 times
-                robot.trayDown()
-                unloadCount = 0
-                turnPID.setNewSetpoint(wallHeadings[0])
-                collectedCount = 0
-                currentCollectionColor = 0
-                # returnState = States.WALL_FOLLOWING
-                newState = States.UNLOAD_LOWER_ARM
-                returningToBaskets = False
-                stateTimer = 0
-
-        elif currentState == States.UNLOAD_LOWER_ARM:
-            if arm.goDefault():
-                newState = States.BACK_AWAY
+                newState = States.WALL_FOLLOWING
+        else: 
+            newState = States.WALL_FOLLOWING
 
-############################################################################################################################################################
-############################################################################################################################################################
-############################################################################################################################################################
+def turn():
+    global boxCount
+    global inSpace
+    global returnState
+    global gyroZeroed
+    global newState
+    drivetrain.drive(0,0,turnProfile.getOutput(), True)
+    if turnProfile.settled():
+        if ((currentWall == 0 and returnState == States.WALL_FOLLOWING_REVERSE) or (currentWall == 1 and returnState == States.WALL_FOLLOWING)) and returningToBaskets:
+            # newState = States.TURNING
+            turnPID.setNewSetpoint(wallHeadings[2])
+            boxCount = 0
+            inSpace = False
+            returnState = States.BASKET_FOLLOWING
+            gyroZeroed = False
+        elif returnState == None:
+            newState = States.WALL_FOLLOWING
+        else:
+            newState = returnState
+            returnState = None
+
+def grabFruit():
+    global newState
+    global tempColor
+    if (camera.averageLargestObject != None and camera.largestObject != None):
+        if (currentCollectionColor != 0) and (camera.averageLargestObject.color + 1 != currentCollectionColor):
+            newState = States.TURNING
+        
+        # if(arm.liftGroup.position() < 200):
+        #     collectedCount = 2
+        #     newState = States.WALL_RETURN
+
+        drivetrain.drive(fruitDistPID.update(camera.predictedHeight()).getOutput(), 0, fruitTurnPID.update(camera.predictedCenterX()).getOutput(), True)
+        if(camera.largestObject.height < 200):
+            arm.lift(armFruitPID.update(camera.largestObject.centerY).getOutput())
+        arm.open()
+        if(camera.largestObject.width > 300 and camera.averageLargestObject.fruitType == 1) or (camera.largestObject.width > 150 and camera.averageLargestObject.fruitType == 0): # test threshold
+            arm.close()
+            newState = States.CLOSING
+        tempColor = camera.averageLargestObject.color + 1
+    else:
+        drivetrain.stopAll()
+    
+    if camera.averageLargestObject == None:
+        newState = States.BACK_AWAY
+
+def closeGripper():
+    global newState
+    global collectedCount
+    global returningToBaskets
+    if arm.gripperCommand == 0:
+        newState = States.DROPFRUIT
+        collectedCount += 1
+        cameraX, cameraY = FruitMap.cameraPosition()
+        FruitMap.forget(cameraX, cameraY, FruitMap.mergeDistance)
+        if collectedCount >= 2:
+            returningToBaskets = True
+
+def dropFruit():
+    global currentCollectionColor
+    global newState
+    global stateTimer
+    global returningToBaskets
+    # drivetrain.drive(-25,0,0,True)
+    if arm.goDefault():
+        currentCollectionColor = tempColor
+        newState = States.BACK_AWAY
+        stateTimer = 0
+        if collectedCount >= 2:
+            returningToBaskets = True
+
+def backAway():
+    global stateTimer
+    global targetFruit
+    global returnState
+    global newState
+    drivetrain.drive(-50,0,0, True)
+    stateTimer += dt()
+    if returnState == States.DRIVE_TO_FRUIT and abs((frame.heading - wallHeadings[2] + 180) % 360 - 180) < 20 and 0 < frame.sonarB < 2000:
+        drivetrain.locateFromWall(2, frame.sonarB, frame.sonarR) # backing away from the baskets has the back to wall 2, so the odometry lost pushing on the baskets is corrected
+    if stateTimer > 1500000:
+        if collectedCount < 2: # only release the fruit if there is not one in the tray
+            arm.open()
+        stateTimer = 0
+        targetFruit = None
+        if returnState == States.DRIVE_TO_FRUIT and drivetrain.positionKnown: # just unloaded: go straight to the nearest fruit seen so far
+            targetFruit = FruitMap.nearest(drivetrain.robotPos[0], drivetrain.robotPos[1])
+        if targetFruit != None:
+            returnState = None
+            newState = States.DRIVE_TO_FRUIT
+        else:
+            returnState = States.WALL_RETURN
+            newState = States.TURNING
+            turnPID.setNewSetpoint(wallHeadings[currentWall])
+
+def driveToFruit(): # drives to a fruit seen earlier instead of searching the walls for one
+    global stateTimer
+    global returnState
+    global newState
+    stateTimer += dt()
+    if not targetFruit in FruitMap.fruits or stateTimer > 8000000: # the fruit was not there anymore or could not be reached
+        updateCurrentWall(nearestWall())
+        returnState = States.WALL_RETURN
+        newState = States.TURNING
+        turnPID.setNewSetpoint(wallHeadings[currentWall])
+        stateTimer = 0
+    elif camera.largestObject != None: # the camera has found the fruit, so steer with it instead of the odometry
+        drivetrain.drive(30, 0, fruitTurnPID.update(camera.predictedCenterX()).getOutput(), True)
+        if camera.averageLargestObject != None and camera.averageLargestObject.dist < 50 and camera.averageLargestObject.color == targetFruit.color:
+            updateCurrentWall(nearestWall()) # the wall to return to with the fruit
+            arm.open()
+            newState = States.FRUITFOLLOWING
+            armFruitPID.reset()
+            fruitDistPID.reset()
+            fruitTurnPID.reset()
+            stateTimer = 0
+    else:
+        dx = targetFruit.x - drivetrain.robotPos[0]
+        dy = targetFruit.y - drivetrain.robotPos[1]
+        dist = math.sqrt(dx**2 + dy**2) - Camera.forwardOffset
+        turnPID.setNewSetpoint(math.atan2(dx, dy) * 180 / math.pi)
+        speed = 0
+        if turnPID.atSetpoint(20): # only drive once roughly facing the fruit so the camera gets it in view
+            speed = max(-20, min(60, (dist - 2 * FruitMap.minViewRange) / 5)) # stops well before the fruit would drop out of view, backs up if already too close
+        drivetrain.drive(speed, 0, turnPID.getOutput(), True)
+
+def followBaskets():
+    global inSpace
+    global boxCount
+    global gyroZeroed
+    global newState
+    if inSpace:
+        drivetrain.drive(0, 40, 0,True)
+        if(frame.lineL <= 70) and (frame.lineR <= 70):
+            inSpace = False
+    else:
+        if (frame.lineR > 70) and (frame.lineL <= 68):
+            inSpace = True
+            boxCount += 1
+        elif (frame.lineL <= 70) and (frame.lineR <= 70):
+            drivetrain.drive(lineDistPID.getOutput(),50,lineTurnPID.getOutput(),True)
+        else:
+            drivetrain.drive(20,0,0,True)
+    
+    if not gyroZeroed and frame.lineL == frame.lineR:
+        drivetrain.setHeading(wallHeadings[2])
+        gyroZeroed = True
+
+    try:
+        if boxOrder.index(currentCollectionColor) == boxCount:
+            controller.rumble("--")
+            if(boxOrder.index(currentCollectionColor) == 0):
+                if (frame.lineL <= 70) and (frame.lineR <= 70):
+                    newState = States.UNLOAD_RAISE_ARM
+            else:
+                Delays.after(1.5, States.UNLOAD_RAISE_ARM) # keeps the delay scheduled the first time
+    except:
+        raise RuntimeError("Current color" + str(currentCollectionColor) + "not in colorList")
+
+def cancelUnloadDelay():
+    Delays.cancel(States.UNLOAD_RAISE_ARM) # don't raise the arm if the robot left the baskets before the delay was up
+
+def raiseArmToUnload():
+    global newState
+    if arm.goHigh():
+        newState = States.UNLOAD
+
+def unload():
+    global cycleStartWall
+    global stateTimer
+    global unloadCount
+    global collectedCount
+    global currentCollectionColor
+    global newState
+    global returnState
+    global returningToBaskets
+    cycleStartWall = 0
+    if unloadCount == 0:
+        stateTimer = 0
+    if robot.motor_TRAY.is_done() and arm.gripperCommand != -1 and ((stateTimer > 1500000 and unloadCount >= 3) or unloadCount < 3):
+        unloadCount += 1
+        if robot.trayState == 0:
+            robot.trayUp()
+        else:
+            robot.trayDown()
+    if unloadCount == 3:
+        if stateTimer == 0:
+            arm.open()    
+        stateTimer += dt()
+
+    if unloadCount >= 8: # cycle 3 times
+        robot.trayDown()
+        unloadCount = 0
+        turnPID.setNewSetpoint(wallHeadings[0])
+        collectedCount = 0
+        currentCollectionColor = 0
+        # returnState = States.WALL_FOLLOWING
+        newState = States.UNLOAD_LOWER_ARM
+        returnState = States.DRIVE_TO_FRUIT # checked once the robot has backed away from the baskets
+        returningToBaskets = False
+        stateTimer = 0
+
+def lowerArmAfterUnload():
+    global newState
+    if arm.goDefault():
+        newState = States.BACK_AWAY
+
+StateMachine.registerMode(Modes.CALIBRATE, calibrateMode)
+StateMachine.registerMode(Modes.DEFAULT, defaultMode)
+StateMachine.registerMode(Modes.TELEOP, teleopMode)
+StateMachine.registerMode(Modes.COLLECTION, collectionMode)
+
+StateMachine.register(Modes.FRUITFOLLOWING, States.FRUITFOLLOWING, followFruit, lockCamera, camera.unlock)
+StateMachine.register(Modes.FRUITFOLLOWING, States.CLOSING, closeOnFruit)
+StateMachine.register(Modes.FRUITFOLLOWING, States.DROPFRUIT, dropFollowedFruit)
+
+StateMachine.register(Modes.COLLECTION, States.COLLECTION_INIT, collectionInit)
+StateMachine.register(Modes.COLLECTION, States.DEFAULT, collectionStart)
+StateMachine.register(Modes.COLLECTION, States.WALL_FOLLOWING, followWall)
+StateMachine.register(Modes.COLLECTION, States.WALL_FOLLOWING_REVERSE, followWallReverse)
+StateMachine.register(Modes.COLLECTION, States.WALL_RETURN, returnToWall)
+StateMachine.register(Modes.COLLECTION, States.TURNING, turn, turnProfile.stop, turnProfile.stop) # plan each turn from where the robot is when it starts
+StateMachine.register(Modes.COLLECTION, States.FRUITFOLLOWING, grabFruit, lockCamera, camera.unlock)
+StateMachine.register(Modes.COLLECTION, States.CLOSING, closeGripper)
+StateMachine.register(Modes.COLLECTION, States.DROPFRUIT, dropFruit)
+StateMachine.register(Modes.COLLECTION, States.BACK_AWAY, backAway)
+StateMachine.register(Modes.COLLECTION, States.DRIVE_TO_FRUIT, driveToFruit)
+StateMachine.register(Modes.COLLECTION, States.BASKET_FOLLOWING, followBaskets, None, cancelUnloadDelay)
+StateMachine.register(Modes.COLLECTION, States.UNLOAD_RAISE_ARM, raiseArmToUnload)
+StateMachine.register(Modes.COLLECTION, States.UNLOAD, unload)
+StateMachine.register(Modes.COLLECTION, States.UNLOAD_LOWER_ARM, lowerArmAfterUnload)
 
 def wallFollowing(reversed = False, speed = 100): # created to prevent duplicate code between normal and reversed wall following
     global prevWallDist
@@ -1302,11 +3516,11 @@ def wallFollowing(reversed = False, speed = 100): # created to prevent duplicate
     global returningToBaskets
 
     if reversed:
-        wallSonar = sonarR
-        sideSonar = sonarB
+        wallDist = frame.sonarR
+        sideDist = frame.sonarB
     else:
-        wallSonar = sonarB
-        sideSonar = sonarR
+        wallDist = frame.sonarB
+        sideDist = frame.sonarR
 
     if speed > 100 or speed < 0:
         raise RuntimeError("Speed out of bounds. Speed = " + str(speed))
@@ -1314,105 +3528,178 @@ def wallFollowing(reversed = False, speed = 100): # created to prevent duplicate
     wallPID.setNewSetpoint(150)
 
     if reversed:
-        if wallSonar.distance(MM) < 2000:
-            drivetrain.drive(-speed, -wallPID.update(wallSonar.distance(MM)).getOutput(), turnPID.getOutput(), True)
+        if wallDist < 2000:
+            drivetrain.drive(-speed, -wallPID.update(wallDist).getOutput(), turnPID.getOutput(), True)
         else:
             drivetrain.drive(-speed/2, 0, turnPID.getOutput(), True)
     else:
-        if wallSonar.distance(MM) < 2000:
-            drivetrain.drive(wallPID.update(wallSonar.distance(MM)).getOutput(), speed, turnPID.getOutput(), True)
+        if wallDist < 2000:
+            drivetrain.drive(wallPID.update(wallDist).getOutput(), speed, turnPID.getOutput(), True)
         else:
             drivetrain.drive(0, speed/2, turnPID.getOutput(), True)
     
-    nearWall = wallPID.atSetpoint(25, sonarB.distance(MM))
+    nearWall = wallPID.atSetpoint(25, frame.sonarB)
+    if nearWall and not reversed and abs((frame.heading - wallHeadings[currentWall] + 180) % 360 - 180) < 5: # square to the wall
+        drivetrain.locateFromWall(currentWall, wallDist, sideDist)
     
-    if nearWall and (sideSonar.distance(MM) < 200 or (((currentWall == 3 and not reversed) or (currentWall == 1 and reversed)) and sideSonar.distance(MM) < 400)):
+    if nearWall and (sideDist < 200 or (((currentWall == 3 and not reversed) or (currentWall == 1 and reversed)) and sideDist < 400)):
         newState = States.TURNING
         if(collectedCount == 1):
             collectedCount = 2
             returningToBaskets = True
         if reversed:
-            turnPID.setNewSetpoint(turnPID.setpoint + 90) # will always maintain (0 <= setpoint < 360) due to continuous rotation mode
+            turnPID.setNewSetpoint(turnProfile.heading() + 90) # will always maintain (0 <= setpoint < 360) due to continuous rotation mode
             returnState = States.WALL_FOLLOWING_REVERSE
             updateCurrentWall(currentWall-1)
             wallTotal += currentWall
         else:
-            turnPID.setNewSetpoint(turnPID.setpoint - 90)
+            turnPID.setNewSetpoint(turnProfile.heading() - 90)
             updateCurrentWall(currentWall+1)
             wallTotal += currentWall
             returnState = States.WALL_FOLLOWING
-    if abs(gyro.orientation(ROLL)) > 8 or abs(gyro.orientation(PITCH)) > 8: # stepped up to a wall without seeing it
+    if abs(frame.roll) > 8 or abs(frame.pitch) > 8: # stepped up to a wall without seeing it
         currentMode = Modes.DEFAULT
     return nearWall
 
-def globalPrinter():
-    """Method to print in another thread. Always use this to print everything."""
-    while True:
-        print("DT:", str(dt()))
-        print("Heading:", gyro.heading())
-        
-        cameraObject = camera.largestObject # store the value to prevent the main thread from updating the value from a VisionObject to None between the if and the print
-        if cameraObject != None:
-            print("Largest:", cameraObject.centerX, cameraObject.centerY, cameraObject.width, cameraObject.height)
-        else:
-            print("No object detected this cycle")
-            
-        averagedVisionObject = camera.averageLargestObject
-        if averagedVisionObject != None:
-            print(averagedVisionObject)
-        else : print("No object detected")
-
-        print(camera.visionResults)
-        print("SB:" + str(sonarB.distance(MM)) + ", SR:" + str(sonarR.distance(MM)))
+def scheduleCameraSignatures():
+    """Tells the camera which signatures the current mode and state need. Run before Camera.update()"""
+    if currentMode == Modes.COLLECTION:
+        if currentState == States.FRUITFOLLOWING:
+            if currentCollectionColor != 0:
+                camera.schedule(camera.onlySig(currentCollectionColor-1))
+            elif camera.averageLargestObject != None: # stay locked onto the color being followed
+                camera.schedule(camera.onlySig(camera.averageLargestObject.color))
+            else:
+                camera.schedule(camera.configuredSigs)
+        elif currentState == States.DRIVE_TO_FRUIT and targetFruit != None:
+            camera.schedule(camera.onlySig(targetFruit.color))
+        elif currentState == States.WALL_FOLLOWING and fruitSearching:
+            if currentCollectionColor != 0:
+                camera.schedule(camera.onlySig(currentCollectionColor-1))
+            else:
+                camera.schedule(camera.configuredSigs, True)
+        else: # no other collection state looks at the camera
+            camera.schedule(camera.noSigs)
+    elif currentMode == Modes.FRUITFOLLOWING:
+        camera.schedule(camera.configuredSigs)
+    else: # vision is only displayed while idle or driving manually
+        camera.schedule(camera.configuredSigs, True)
 
-        Printer.add((str(currentMode) + ", " + str(currentState)), 0, 4)
-        Printer.add((str(currentMode) + ", " + str(currentState)), 1, 0)
-        Printer.add(("Stat:"+str(arm.gripperStatus) + " Com:"+str(arm.gripperCommand)), 1, 1)
-        Printer.add((str(arm.gripper.current())), 1, 2)
+def globalPrinter():
+    """Printer task. Updates the brain and controller screens; serial output goes through Telemetry."""
+    Printer.add((Modes.names[currentMode], ", ", States.names[currentState]), 1, 0)
+    Printer.add(("Stat:", arm.gripperStatus, " Com:", arm.gripperCommand), 1, 1)
+    if currentMode == Modes.CALIBRATE and Startup.failed():
+        Printer.add(("Gyro drift ", round(Startup.drift, 3), " A:retry Y:use"), 1, 2)
+    else:
+        Printer.add(arm.gripper.current(), 1, 2)
+    if TimeLogger.onScreen:
+        TimeLogger.addToPrinter()
+    elif RunStats.onScreen:
+        RunStats.addToPrinter()
+    else:
+        Printer.add((Modes.names[currentMode], ", ", States.names[currentState]), 0, 4)
         Printer.addSonar(0,1)
         Printer.addGyro(0,2)
-        Printer.add("CPS:" + str(1000000/dt()), 0, 3)
-        Printer.add("Pos: (" + str(drivetrain.robotPos[0])+", "+str(drivetrain.robotPos[1])+")", 0, 6)
-        Printer.add("Box count " + str(boxCount), 0, 9)
-        Printer.add("Collected count " + str(collectedCount), 0, 10)
-        Printer.add("Arm height: " + str(arm.liftGroup.position()), 0, 7)
-
-        Printer.print()
-        printThread.sleep_for(50)
-        print("setpoint:", wallPID.setpoint)
-    
-printThread = Thread(globalPrinter)
-
-while True:
+        Printer.add(("CPS:", 1000000/dt()), 0, 3)
+        Printer.add(("Gyro drift:", round(Startup.drift, 4), " tries:", Startup.attempts, " warm" if Startup.warm else "", " FAILED" if Startup.failed() else ""), 0, 5)
+        Printer.add(("Pos: (", int(drivetrain.robotPos[0]), ", ", int(drivetrain.robotPos[1]), ") Vel: (", int(drivetrain.robotVel[0]), ", ", int(drivetrain.robotVel[1]), ")"), 0, 6)
+        Printer.add(("Box count ", boxCount), 0, 9)
+        Printer.add(("Collected count ", collectedCount), 0, 10)
+        Printer.add(("Known fruits ", len(FruitMap.fruits)), 0, 11)
+        Printer.add(("Arm height: ", arm.liftGroup.position()), 0, 7)
+        Printer.add(("Motor cmds sent:", CachedMotor.totalSent, " skipped:", CachedMotor.totalSuppressed), 0, 8)
+        for i in range(len(Scheduler.tasks)):
+            task = Scheduler.tasks[i]
+            Printer.add((task.name, " miss:", task.misses, " jit:", int(task.averageJitter), "/", task.maxJitter), 0, 12 + i)
+        if FlightRecorder.enabled:
+            Printer.add(("Log ", FlightRecorder.name, " dropped:", FlightRecorder.dropped, " waiting:", len(FlightRecorder.full)), 0, 19)
+
+    Printer.print()
+
+def largestField(attribute : str):
+    """Telemetry supplier for an attribute of the largest vision object, None when there is none"""
+    def supplier():
+        cameraObject = camera.largestObject # store the value so the vision task can't change it to None between the check and the read
+        return None if cameraObject == None else getattr(cameraObject, attribute)
+    return supplier
+
+def averageField(attribute : str):
+    """Telemetry supplier for an attribute of the averaged largest object, None when there is none"""
+    def supplier():
+        averagedVisionObject = camera.averageLargestObject
+        return None if averagedVisionObject == None else getattr(averagedVisionObject, attribute)
+    return supplier
+
+Telemetry.register("dt", 10, dt)
+Telemetry.register("state", 2, lambda: States.names[currentState])
+Telemetry.register("heading", 20, lambda: frame.heading)
+Telemetry.register("gyroRate", 20, lambda: frame.gyroRate) # for checking its sign on the robot, see SensorFrame.gyroRate
+Telemetry.register("largestX", 10, largestField("centerX"))
+Telemetry.register("largestY", 10, largestField("centerY"))
+Telemetry.register("largestW", 10, largestField("width"))
+Telemetry.register("largestH", 10, largestField("height"))
+Telemetry.register("averageDist", 10, averageField("dist"))
+Telemetry.register("averageAngle", 10, averageField("angleTo"))
+Telemetry.register("objects", 5, lambda: camera.locatedCount)
+Telemetry.register("sonarB", 10, lambda: frame.sonarB)
+Telemetry.register("sonarR", 10, lambda: frame.sonarR)
+Telemetry.register("wallSetpoint", 5, lambda: wallPID.setpoint)
+Telemetry.register("turnSetpoint", 5, lambda: turnPID.setpoint)
+Telemetry.register("dropped", 1, lambda: Telemetry.dropped)
+
+def controlCycle():
+    """Control task: reads the sensors, runs the state machine and sends the motor outputs."""
+    global prevSystemTime
+    global systemTime
 
 # loop initialization
+    TimeLogger.startCycle()
+    frame.capture()
+    prevSystemTime = systemTime
+    systemTime = frame.timestamp
     drivetrain.active = False
     arm.active = False
+    TimeLogger.time("sensors")
 
 # inputs
-    controllerButtons.update()
-    camera.update()
-    # drivetrain.updateOdometry() # has very little function and does not currently work correctly
+    drivetrain.updateOdometry()
+    TimeLogger.time("odometry")
     PID.updateAllPIDs()
+    TimeLogger.time("PIDs")
 
 # scheduling
     Delays.checkAllDelays()
+    TimeLogger.time("delays")
 
 # main run
     stateMachine()
+    controllerButtons.clearEdges()
+    TimeLogger.time("stateMachine")
 
 # extra outputs
     arm.updateArm()
+    TimeLogger.time("updateArm")
     if not drivetrain.active:
         drivetrain.stopAll()
     if not arm.active:
         arm.stop()
-
-# timing
-    prevSystemTime = systemTime
-    # while systemTime-prevSystemTime < 100000: # enforce minimum cycle time
-    systemTime = brain.timer.system_high_res()
-
-# logged time usage
-    #TimeLogger.timeUsageCalc()
-    #print("timeUsage:", TimeLogger.timeUsage)
\ No newline at end of file
+    TimeLogger.time("motors")
+    FlightRecorder.record()
+    TimeLogger.time("recorder")
+    TimeLogger.endCycle()
+
+def visionCycle():
+    """Vision task: snapshots the signatures the current mode and state need."""
+    scheduleCameraSignatures()
+    camera.update()
+    FruitMap.update()
+
+Scheduler.addTask("control", 100, controlCycle)
+Scheduler.addTask("buttons", 50, controllerButtons.update)
+Scheduler.addTask("vision", 50, visionCycle) # vision sensor frame rate
+Scheduler.addTask("printer", 10, globalPrinter)
+Scheduler.addTask("telemetry", 20, Telemetry.update)
+Scheduler.addTask("runstats", 1, RunStats.update)
+FlightRecorder.start()
+Scheduler.run()
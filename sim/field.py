@@ -0,0 +1,387 @@
+"""2D field and robot model used by the simulated vex module.
+
+Coordinates are in mm with x east and y north. Headings follow the VEX inertial sensor: degrees clockwise from north.
+Walls are numbered the way the robot programs number them: 0 is the basket wall (west) and the numbers increase
+counterclockwise (1 south, 2 east, 3 north), so wallHeadings = [90, 0, 270, 180] is the heading with the robot's back to each wall.
+"""
+import math
+import random
+
+GEAR_RPM = {"RATIO_36_1": 100, "RATIO_18_1": 200, "RATIO_6_1": 600}
+
+class Fruit:
+    def __init__(self, x : float, y : float, z : float, color : int, large : bool):
+        self.x = x
+        self.y = y
+        self.z = z
+        """height of the fruit center above the floor in mm"""
+        self.color = color
+        """0 indexed vision signature"""
+        self.large = large
+        self.radius = 44.5 if large else 28.6
+    def __repr__(self):
+        return "Fruit(" + str(round(self.x)) + ", " + str(round(self.y)) + ", " + str(round(self.z)) + ", color=" + str(self.color) + ", large=" + str(self.large) + ")"
+
+class Basket:
+    def __init__(self, color : int, y0 : float, y1 : float, depth : float):
+        self.color = color
+        """1 indexed color id, as used in boxOrder"""
+        self.y0 = y0
+        self.y1 = y1
+        self.depth = depth
+        """distance from the basket wall to the basket front face"""
+        self.fruits : list[Fruit] = []
+
+class MotorState:
+    """Physical model of one motor. Positions are kept in the frame the program sees (reversing is ignored since it applies to both commands and readings)."""
+    def __init__(self, port : int, maxRpm : float):
+        self.port = port
+        self.maxRpm = maxRpm
+        self.position = 0.0
+        """physical position in degrees"""
+        self.offset = 0.0
+        """physical position the program's encoder zero is at"""
+        self.velocity = 0.0
+        """rpm"""
+        self.mode = "stop"
+        self.targetRpm = 0.0
+        self.targetPosition = 0.0
+        self.lo = None
+        """physical limits in degrees, None for no limit"""
+        self.hi = None
+        self.blocked = 0
+        """-1 or 1 while pushing into a limit"""
+        self.maxTorque = 2.1 * 200 / maxRpm
+        self.stallTorque = self.maxTorque
+    def command(self, mode : str, rpm : float = 0, position : float = 0):
+        self.mode = mode
+        self.targetRpm = max(-self.maxRpm, min(self.maxRpm, rpm))
+        self.targetPosition = position + self.offset
+    def isDone(self):
+        if self.mode != "position":
+            return True
+        return abs(self.targetPosition - self.position) < 2 or self.blocked != 0
+    def torque(self):
+        if self.blocked != 0 and self.mode != "stop":
+            return min(self.stallTorque, self.maxTorque)
+        return 0.02 + abs(self.velocity) / self.maxRpm * 0.1
+    def step(self, dt : float):
+        if self.mode == "stop" and self.velocity == 0:
+            self.blocked = 0
+            return
+        if self.mode == "velocity":
+            target = self.targetRpm
+        elif self.mode == "position":
+            error = self.targetPosition - self.position
+            target = max(-abs(self.targetRpm), min(abs(self.targetRpm), error * 1.7))
+            if abs(error) < 1:
+                target = 0
+        else:
+            target = 0
+        self.velocity += (target - self.velocity) * min(1.0, dt / 0.05)
+        if abs(self.velocity) < 1e-3 and target == 0:
+            self.velocity = 0
+        self.position += self.velocity * 6 * dt
+        self.blocked = 0
+        if self.lo != None and self.position <= self.lo:
+            self.position = self.lo
+            if target <= 0:
+                self.blocked = -1
+                self.velocity = max(self.velocity, 0)
+        if self.hi != None and self.position >= self.hi:
+            self.position = self.hi
+            if target >= 0:
+                self.blocked = 1
+                self.velocity = min(self.velocity, 0)
+
+class Field:
+    def __init__(self, width : float = 2440, height : float = 2440, boxOrder : list[int] | None = None):
+        self.width = width
+        self.height = height
+        self.fruits : list[Fruit] = []
+        if boxOrder == None:
+            boxOrder = [1, 2, 3]
+        # baskets along the west wall, ordered left to right when facing the wall (south to north), starting
+        # close to the south corner so both line sensors see the first basket right after the corner turn
+        self.baskets = []
+        basketWidth = 300
+        gap = 150
+        start = 50
+        for i in range(len(boxOrder)):
+            y0 = start + i * (basketWidth + gap)
+            self.baskets.append(Basket(boxOrder[i], y0, y0 + basketWidth, 250))
+
+    def addRandomFruits(self, count : int, rng : random.Random):
+        """Places fruits 600 to 750 mm away from a random wall, where a wall following robot can see them"""
+        for _ in range(count):
+            wall = rng.randrange(4)
+            offset = rng.uniform(600, 750)
+            along = rng.uniform(500, self.width - 500)
+            if wall == 0:
+                x, y = offset + 250, along
+            elif wall == 1:
+                x, y = along, offset
+            elif wall == 2:
+                x, y = self.width - offset, along
+            else:
+                x, y = along, self.height - offset
+            self.fruits.append(Fruit(x, y, rng.uniform(150, 450), rng.randrange(3), rng.random() < 0.5))
+
+    def raycast(self, x : float, y : float, angle : float, basketsOnly : bool = False):
+        """Distance in mm from (x, y) to the first wall or basket along the heading angle (degrees)"""
+        dx = math.sin(math.radians(angle))
+        dy = math.cos(math.radians(angle))
+        best = math.inf
+        if not basketsOnly:
+            if dx > 1e-9:
+                best = min(best, (self.width - x) / dx)
+            elif dx < -1e-9:
+                best = min(best, -x / dx)
+            if dy > 1e-9:
+                best = min(best, (self.height - y) / dy)
+            elif dy < -1e-9:
+                best = min(best, -y / dy)
+        for basket in self.baskets:
+            t = rayBox(x, y, dx, dy, 0, basket.y0, basket.depth, basket.y1)
+            if t != None and t < best:
+                best = t
+        return best
+
+    def basketAt(self, y : float):
+        for basket in self.baskets:
+            if basket.y0 <= y <= basket.y1:
+                return basket
+        return None
+
+def rayBox(x, y, dx, dy, x0, y0, x1, y1):
+    """Slab test: distance along the ray to the box, or None"""
+    tmin = -math.inf
+    tmax = math.inf
+    for p, d, lo, hi in ((x, dx, x0, x1), (y, dy, y0, y1)):
+        if abs(d) < 1e-9:
+            if p < lo or p > hi:
+                return None
+        else:
+            t1 = (lo - p) / d
+            t2 = (hi - p) / d
+            tmin = max(tmin, min(t1, t2))
+            tmax = min(tmax, max(t1, t2))
+    if tmax < max(tmin, 0):
+        return None
+    return max(tmin, 0)
+
+class World:
+    """Robot on the field: drivetrain kinematics, arm, gripper, tray and the sensors' view of the field."""
+    halfLength = 200
+    """center to front/back face in mm"""
+    halfWidth = 200
+    wheelDiameter = 101.6
+    wheelRadiusFromCenter = 250
+    cameraForward = 200
+    lineSensorForward = 200
+    lineSensorSpacing = 80
+    drivePorts = (0, 1, 2, 3)
+    """FL, FR, BL, BR"""
+    trayPort = 9
+    armPorts = (5, 6)
+    gripperPort = 19
+
+    def __init__(self, field : Field, x : float, y : float, heading : float, rng : random.Random | None = None, visionNoise : float = 0):
+        self.field = field
+        self.x = x
+        self.y = y
+        self.heading = heading
+        """degrees clockwise from north, continuous"""
+        self.forwardVel = 0.0
+        self.rightVel = 0.0
+        self.turnRate = 0.0
+        """deg/s, clockwise positive"""
+        self.t = 0
+        """simulated time of the last physics step in microseconds"""
+        self.stepSize = 2000
+        self.motors : dict[int, MotorState] = {}
+        self.rng = rng if rng != None else random.Random(0)
+        self.visionNoise = visionNoise
+        self.held : Fruit | None = None
+        self.tray : list[Fruit] = []
+        self.picked = 0
+        self.scored = 0
+        self.misplaced = 0
+        self.dropped = 0
+
+    # motors
+    def motor(self, port : int, gearing : str):
+        if port not in self.motors:
+            motor = MotorState(port, GEAR_RPM.get(gearing, 200))
+            if port in self.armPorts:
+                motor.lo = 0
+                motor.hi = 1.4 * 360
+                motor.position = 0.2 * 360
+            elif port == self.gripperPort:
+                motor.lo = -200
+                motor.hi = 0
+                motor.position = -60
+            elif port == self.trayPort:
+                motor.lo = -90
+                motor.hi = 5
+            motor.offset = motor.position
+            self.motors[port] = motor
+        return self.motors[port]
+    def armTurns(self):
+        motor = self.motors.get(self.armPorts[0])
+        return 0 if motor == None else motor.position / 360
+
+    # geometry
+    def forward(self):
+        h = math.radians(self.heading)
+        return (math.sin(h), math.cos(h))
+    def right(self):
+        h = math.radians(self.heading)
+        return (math.cos(h), -math.sin(h))
+    def cameraPosition(self):
+        fx, fy = self.forward()
+        return (self.x + fx * self.cameraForward, self.y + fy * self.cameraForward, 150 + self.armTurns() * 250)
+
+    # sensors
+    def sonar(self, back : bool):
+        fx, fy = self.forward()
+        rx, ry = self.right()
+        if back:
+            return self.field.raycast(self.x - fx * self.halfLength, self.y - fy * self.halfLength, self.heading + 180)
+        return self.field.raycast(self.x + rx * self.halfWidth, self.y + ry * self.halfWidth, self.heading + 90)
+    def line(self, left : bool):
+        """Line sensors face forward from the front of the robot and see the basket front faces when close to them"""
+        fx, fy = self.forward()
+        rx, ry = self.right()
+        side = -self.lineSensorSpacing if left else self.lineSensorSpacing
+        px = self.x + fx * self.lineSensorForward + rx * side
+        py = self.y + fy * self.lineSensorForward + ry * side
+        d = self.field.raycast(px, py, self.heading, True)
+        if d > 120:
+            return 100
+        return max(0, min(100, 40 + d * 0.5))
+    def visionObjects(self, sig : int):
+        """Projects the fruits of one (0 indexed) signature into sensor pixels, largest first. Returns (centerX, centerY, width, height) tuples."""
+        cx, cy, cz = self.cameraPosition()
+        fx, fy = self.forward()
+        rx, ry = self.right()
+        found = []
+        for fruit in self.field.fruits:
+            if fruit.color != sig:
+                continue
+            dx = fruit.x - cx
+            dy = fruit.y - cy
+            ahead = dx * fx + dy * fy
+            side = dx * rx + dy * ry
+            if ahead < 30:
+                continue
+            dz = fruit.z - cz
+            dist = math.sqrt(ahead * ahead + side * side + dz * dz)
+            if dist <= fruit.radius * 1.05:
+                continue
+            bearing = math.degrees(math.atan2(side, ahead))
+            halfAngle = math.asin(fruit.radius / dist)
+            width = (halfAngle - 0.01) * 2 / 0.00337
+            if width < 4:
+                continue
+            height = width if fruit.large else width / 0.75
+            centerX = 158 + bearing / 0.19
+            centerY = 137 - math.asin(dz / dist) / 0.00337
+            if self.visionNoise > 0:
+                centerX += self.rng.gauss(0, self.visionNoise)
+                centerY += self.rng.gauss(0, self.visionNoise)
+                width *= 1 + self.rng.gauss(0, self.visionNoise / 100)
+            # clip the box to the 316x212 image
+            left = max(0, centerX - width / 2)
+            rightEdge = min(315, centerX + width / 2)
+            top = max(0, centerY - height / 2)
+            bottom = min(211, centerY + height / 2)
+            if rightEdge - left < 2 or bottom - top < 2:
+                continue
+            found.append((int((left + rightEdge) / 2), int((top + bottom) / 2), int(rightEdge - left), int(bottom - top)))
+        found.sort(key=lambda o: -o[2] * o[3])
+        return found
+
+    # mechanisms
+    def grabbableFruit(self):
+        cx, cy, cz = self.cameraPosition()
+        fx, fy = self.forward()
+        best = None
+        for fruit in self.field.fruits:
+            dx = fruit.x - cx
+            dy = fruit.y - cy
+            ahead = dx * fx + dy * fy
+            if ahead < -20 or ahead > 150:
+                continue
+            if math.hypot(dx, dy) > 160 or abs(fruit.z - cz) > 90:
+                continue
+            if best == None or ahead < best[0]:
+                best = (ahead, fruit)
+        return None if best == None else best[1]
+    def nearBaskets(self):
+        fx, fy = self.forward()
+        d = self.field.raycast(self.x + fx * self.halfLength, self.y + fy * self.halfLength, self.heading, True)
+        return d < 200
+    def deliver(self, fruit : Fruit):
+        basket = self.field.basketAt(self.y) if self.nearBaskets() else None
+        if basket == None:
+            self.dropped += 1
+            return
+        basket.fruits.append(fruit)
+        if basket.color == fruit.color + 1:
+            self.scored += 1
+        else:
+            self.misplaced += 1
+    def updateMechanisms(self):
+        gripper = self.motors.get(self.gripperPort)
+        if gripper != None:
+            closing = gripper.mode == "velocity" and gripper.targetRpm > 0
+            if self.held == None and closing and gripper.position > -45:
+                fruit = self.grabbableFruit()
+                if fruit != None:
+                    self.field.fruits.remove(fruit)
+                    self.held = fruit
+                    self.picked += 1
+            gripper.hi = -40 if self.held != None else 0
+            if self.held != None and gripper.position < -70:
+                if self.armTurns() > 0.9:
+                    self.deliver(self.held)
+                else:
+                    self.tray.append(self.held)
+                self.held = None
+        tray = self.motors.get(self.trayPort)
+        if tray != None and tray.position < -60 and len(self.tray) > 0 and self.nearBaskets():
+            for fruit in self.tray:
+                self.deliver(fruit)
+            self.tray.clear()
+
+    # physics
+    def stepTo(self, t : int):
+        while self.t + self.stepSize <= t:
+            self.step(self.stepSize / 1000000)
+            self.t += self.stepSize
+    def step(self, dt : float):
+        for motor in self.motors.values():
+            motor.step(dt)
+        wheels = [self.motors[p].velocity if p in self.motors else 0 for p in self.drivePorts]
+        if wheels[0] == 0 and wheels[1] == 0 and wheels[2] == 0 and wheels[3] == 0:
+            self.forwardVel = self.rightVel = self.turnRate = 0.0
+            self.updateMechanisms()
+            return
+        fl, fr, bl, br = [rpm / 60 * math.pi * self.wheelDiameter for rpm in wheels]
+        self.forwardVel = (fl + fr + bl + br) / 4 * math.sqrt(2)
+        self.rightVel = (fl - fr - bl + br) / 4 * math.sqrt(2)
+        self.turnRate = math.degrees((fl - fr + bl - br) / 4 / self.wheelRadiusFromCenter)
+        self.heading += self.turnRate * dt
+        fx, fy = self.forward()
+        rx, ry = self.right()
+        self.x += (self.forwardVel * fx + self.rightVel * rx) * dt
+        self.y += (self.forwardVel * fy + self.rightVel * ry) * dt
+        # keep the robot on the field and out of the baskets
+        margin = self.halfLength
+        minX = margin
+        if self.field.basketAt(self.y) != None:
+            minX += self.field.baskets[0].depth
+        self.x = max(minX, min(self.field.width - margin, self.x))
+        self.y = max(margin, min(self.field.height - margin, self.y))
+        self.updateMechanisms()
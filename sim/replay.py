@@ -0,0 +1,273 @@
+"""Records the sensor streams of a simulated run and replays them through other versions of the program.
+
+    python sim/replay.py record --out run7.json.gz --time 180 --input 3:X --input 8:RIGHT --seed 7
+    python sim/replay.py replay run7.json.gz main2.py main-auto-tweaks.py
+
+Recording runs the program on the simulated field and keeps every sensor value the field produced: gyro heading and
+rate, sonars, line sensors and motor encoders each physics step, and the vision objects of every signature at the
+sensor's 50 Hz frame rate. The controller inputs are kept too.
+
+Replay serves those values back to each program through the same fake vex module, with no field model, so it runs as
+fast as the host allows. It is open loop: the motor commands a program sends are recorded but do not move anything.
+That is the point, since every version sees exactly the same inputs; the report compares the state transitions (when
+each state was first reached) and the motor command streams of the two programs.
+
+To compare against an older version, write it out first, e.g. `git show HEAD~3:main-auto-tweaks.py > /tmp/old.py`.
+"""
+import argparse
+import bisect
+import gzip
+import json
+import os
+import sys
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SIM_DIR)
+
+import field
+import run
+import vex
+
+visionPeriod = 20000
+"""microseconds between vision frames"""
+
+def rounded(value):
+    if isinstance(value, float):
+        return round(value, 3)
+    if isinstance(value, (list, tuple)):
+        return [rounded(v) for v in value]
+    return value
+
+class Recorder:
+    """Kernel hook that samples the world after every physics step. Only changes are stored, as per channel [times, values]."""
+    def __init__(self, world : field.World):
+        self.world = world
+        self.streams : dict[str, list[list]] = {}
+        self.lastStep = -1
+        self.nextVision = 0
+        self.vision : dict[int, list] = {}
+        """latest vision frame of each signature, served to the program so it sees what was recorded"""
+        world.visionObjects = self.visionObjects # instance attribute, shadows the method for the program's Vision objects
+    def add(self, channel : str, t : int, value):
+        value = rounded(value)
+        stream = self.streams.get(channel)
+        if stream == None:
+            stream = self.streams[channel] = [[], []]
+        elif stream[1][-1] == value:
+            return
+        stream[0].append(t)
+        stream[1].append(value)
+    def visionObjects(self, sig : int):
+        return self.vision.get(sig, [])
+    def __call__(self, now : int):
+        world = self.world
+        if world.t == self.lastStep:
+            return
+        self.lastStep = world.t
+        t = world.t
+        self.add("heading", t, world.heading)
+        self.add("turnRate", t, world.turnRate)
+        self.add("sonarB", t, world.sonar(True))
+        self.add("sonarR", t, world.sonar(False))
+        self.add("lineL", t, world.line(True))
+        self.add("lineR", t, world.line(False))
+        for port, motor in world.motors.items():
+            self.add("motor" + str(port), t, (motor.position, motor.velocity, motor.torque(), motor.blocked))
+        if t >= self.nextVision:
+            self.nextVision = t - t % visionPeriod + visionPeriod
+            for sig in range(7):
+                objects = [list(o) for o in field.World.visionObjects(world, sig)]
+                self.vision[sig] = rounded(objects)
+                self.add("vision" + str(sig), t, objects)
+
+class Stream:
+    """Sample and hold lookup of one recorded channel"""
+    def __init__(self, times : list, values : list):
+        self.times = times
+        self.values = values
+    def at(self, t : int):
+        i = bisect.bisect_right(self.times, t) - 1
+        return self.values[max(i, 0)]
+
+class ReplayMotor:
+    """Stands in for field.MotorState: readings come from the recording, commands are logged"""
+    def __init__(self, port : int, maxRpm : float, stream : Stream | None, commands : list):
+        self.port = port
+        self.maxRpm = maxRpm
+        self.maxTorque = 2.1 * 200 / maxRpm
+        self.stallTorque = self.maxTorque
+        self.stream = stream
+        self.commands = commands
+        self.position = 0.0
+        self.velocity = 0.0
+        self.torqueValue = 0.0
+        self.blocked = 0
+        self.offset = 0.0
+        self.mode = "stop"
+        self.targetPosition = 0.0
+        self.t = 0
+    def update(self, t : int):
+        if self.stream != None:
+            self.position, self.velocity, self.torqueValue, self.blocked = self.stream.at(t)
+        if self.t == 0:
+            self.offset = self.position # the program's encoders start at zero, like field.World.motor()
+        self.t = t
+    def command(self, mode : str, rpm : float = 0, position : float = 0):
+        self.mode = mode
+        self.targetPosition = position + self.offset
+        self.commands.append((vex.kernel.now, self.port, mode, round(rpm, 3), round(position, 3)))
+    def isDone(self):
+        if self.mode != "position":
+            return True
+        return abs(self.targetPosition - self.position) < 2 or self.blocked != 0
+    def torque(self):
+        return self.torqueValue
+
+class ReplayWorld:
+    """Stands in for field.World, serving the recorded sensor values"""
+    def __init__(self, recording : dict):
+        self.streams = {name: Stream(times, values) for name, (times, values) in recording["streams"].items()}
+        self.t = 0
+        self.stepSize = 2000
+        self.heading = self.streams["heading"].at(0)
+        self.turnRate = 0.0
+        self.motors : dict[int, ReplayMotor] = {}
+        self.commands : list[tuple] = []
+        """(time, port, mode, rpm, position) of every motor command"""
+    def motor(self, port : int, gearing : str):
+        if port not in self.motors:
+            motor = ReplayMotor(port, field.GEAR_RPM.get(gearing, 200), self.streams.get("motor" + str(port)), self.commands)
+            motor.update(max(self.t, 1))
+            self.motors[port] = motor
+        return self.motors[port]
+    def stepTo(self, t : int):
+        self.t = t - t % self.stepSize
+        self.heading = self.streams["heading"].at(self.t)
+        self.turnRate = self.streams["turnRate"].at(self.t)
+        for motor in self.motors.values():
+            motor.update(self.t)
+    def sonar(self, back : bool):
+        return self.streams["sonarB" if back else "sonarR"].at(self.t)
+    def line(self, left : bool):
+        return self.streams["lineL" if left else "lineR"].at(self.t)
+    def visionObjects(self, sig : int):
+        return self.streams["vision" + str(sig)].at(self.t)
+
+def record(args):
+    kernel = vex.kernel
+    run.setup(args, kernel)
+    recorder = Recorder(kernel.world)
+    program = {}
+    trace = run.StateTrace(program)
+    kernel.hooks.append(recorder)
+    kernel.hooks.append(trace)
+    run.runProgram(args.program, kernel, program)
+    recording = {"program": os.path.basename(args.program), "time": args.time, "inputs": args.input, "seed": args.seed,
+                 "streams": recorder.streams, "transitions": [[t, str(m), str(s)] for t, m, s in trace.changes]}
+    with gzip.open(args.recording, "wt") as f:
+        json.dump(recording, f)
+    samples = sum(len(times) for times, _ in recorder.streams.values())
+    world = recorder.world
+    print("recorded %.1f s, %d channels, %d samples to %s" % (kernel.now / 1000000, len(recorder.streams), samples, args.recording))
+    print("fruits picked %d, scored %d" % (world.picked, world.scored))
+
+class Replay:
+    """Result of replaying a recording through one program"""
+    def __init__(self, path : str, recording : dict):
+        kernel = vex.kernel
+        kernel.reset()
+        self.world = ReplayWorld(recording)
+        kernel.world = self.world
+        kernel.limit = int(recording["time"] * 1000000)
+        for text in recording["inputs"]:
+            run.parseInput(kernel, text)
+        program = {}
+        trace = run.StateTrace(program)
+        kernel.hooks.append(trace)
+        self.path = path
+        run.runProgram(path, kernel, program)
+        self.transitions = [(t, str(m), str(s)) for t, m, s in trace.changes]
+        self.commands = self.world.commands
+
+    def firstReached(self):
+        """{(mode, state): time first reached}"""
+        first = {}
+        for t, mode, state in self.transitions:
+            first.setdefault((mode, state), t)
+        return first
+
+    def commandAt(self, port : int, times : list):
+        """The velocity command (rpm, 0 while stopped) in effect on a port at each time"""
+        commands = [(t, rpm if mode == "velocity" else 0) for t, p, mode, rpm, _ in self.commands if p == port]
+        starts = [t for t, _ in commands]
+        values = []
+        for t in times:
+            i = bisect.bisect_right(starts, t) - 1
+            values.append(commands[i][1] if i >= 0 else 0)
+        return values
+
+def divergence(a : list, b : list):
+    """Describes where two lists of (time, mode, state) transitions first differ in mode or state"""
+    for i in range(max(len(a), len(b))):
+        tA = a[i] if i < len(a) else None
+        tB = b[i] if i < len(b) else None
+        if tA == None or tB == None or tA[1:] != tB[1:]:
+            return "transition sequences diverge at #%d: %s vs %s" % (i, tA, tB)
+    return "transition sequences match"
+
+def compare(a : Replay, b : Replay, duration : float):
+    print("state transitions: %s %d, %s %d" % (a.path, len(a.transitions), b.path, len(b.transitions)))
+    firstA = a.firstReached()
+    firstB = b.firstReached()
+    print("first time each state was reached (s):")
+    for key in sorted(set(firstA) | set(firstB), key=lambda k: min(firstA.get(k, float("inf")), firstB.get(k, float("inf")))):
+        tA = firstA.get(key)
+        tB = firstB.get(key)
+        delta = "" if tA == None or tB == None else "%+8.3f" % ((tB - tA) / 1000000)
+        print("  %9s %9s %s  %s / %s" % ("-" if tA == None else "%.3f" % (tA / 1000000), "-" if tB == None else "%.3f" % (tB / 1000000), delta, key[0], key[1]))
+    print(divergence(a.transitions, b.transitions))
+
+    print("motor commands (count, mean |rpm difference| over a 10 ms grid, first time they differ by more than 5 rpm):")
+    times = list(range(0, int(duration * 1000000), 10000))
+    ports = sorted(set(c[1] for c in a.commands) | set(c[1] for c in b.commands))
+    for port in ports:
+        valuesA = a.commandAt(port, times)
+        valuesB = b.commandAt(port, times)
+        differences = [abs(x - y) for x, y in zip(valuesA, valuesB)]
+        diverge = next((times[i] for i in range(len(times)) if differences[i] > 5), None)
+        countA = sum(1 for c in a.commands if c[1] == port)
+        countB = sum(1 for c in b.commands if c[1] == port)
+        print("  port %2d: %6d vs %6d commands, mean diff %7.2f rpm, %s" % (port, countA, countB, sum(differences) / max(len(differences), 1),
+                                                                       "same" if diverge == None else "differ from %.3f s" % (diverge / 1000000)))
+
+def replay(args):
+    with gzip.open(args.recording, "rt") as f:
+        recording = json.load(f)
+    replays = [Replay(path, recording) for path in args.programs]
+    for r in replays:
+        print("%s: %d transitions, %d motor commands" % (r.path, len(r.transitions), len(r.commands)))
+    if len(replays) == 2:
+        compare(replays[0], replays[1], recording["time"])
+    else: # against the closed loop run the recording was made from
+        print("recorded run (" + recording["program"] + ") vs replay: " + divergence([tuple(t) for t in recording["transitions"]], replays[0].transitions))
+        if args.trace:
+            for t, mode, state in replays[0].transitions:
+                print("%9.3f  %s / %s" % (t / 1000000, mode, state))
+
+def main():
+    p = argparse.ArgumentParser(description="Record sensor streams from the simulator and replay them through programs.")
+    commands = p.add_subparsers(dest="command", required=True)
+    recordParser = commands.add_parser("record", parents=[run.parser()], add_help=False, help="run on the simulated field and save the sensor streams")
+    recordParser.add_argument("--out", dest="recording", required=True, help="file to save the recording to (.json.gz)")
+    replayParser = commands.add_parser("replay", help="replay a recording through one or two programs")
+    replayParser.add_argument("recording")
+    replayParser.add_argument("programs", nargs="+", help="one program to check against the recorded run, or two to compare")
+    replayParser.add_argument("--trace", action="store_true", help="print the transitions of a single program")
+    args = p.parse_args()
+    if args.command == "record":
+        record(args)
+    else:
+        replay(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Runs a robot program unmodified against the simulated vex module, faster than real time.
+
+    python sim/run.py                                   # the project's main file, 60 simulated seconds
+    python sim/run.py main-auto-tweaks.py --time 180 --input 3:X --input 8:RIGHT --trace
+
+Inputs are TIME:BUTTON (a 100 ms press) or TIME:axisN=VALUE, with TIME in simulated seconds.
+X then RIGHT starts a collection run on wall 1 with the default starting pose.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SIM_DIR)
+sys.path.insert(0, SIM_DIR)
+
+import field
+import vex
+
+def projectMain():
+    """The program the VEX extension uploads, from .vscode/vex_project_settings.json"""
+    try:
+        with open(os.path.join(REPO_DIR, ".vscode", "vex_project_settings.json")) as f:
+            return os.path.join(REPO_DIR, json.load(f)["project"]["python"]["main"])
+    except (OSError, KeyError, ValueError):
+        return os.path.join(REPO_DIR, "main.py")
+
+def parseInput(kernel : vex.Kernel, text : str):
+    when, _, what = text.partition(":")
+    seconds = float(when)
+    def controller():
+        return kernel.controllers[0]
+    if what.startswith("axis"):
+        name, _, value = what.partition("=")
+        kernel.at(seconds, lambda: setattr(getattr(controller(), name), "current", float(value)))
+    else:
+        kernel.at(seconds, lambda: controller().button(what).set(True))
+        kernel.at(seconds + 0.1, lambda: controller().button(what).set(False))
+
+class StateTrace:
+    """Records every change of the program's currentMode/currentState globals"""
+    def __init__(self, program : dict):
+        self.program = program
+        self.last = None
+        self.changes : list[tuple[int, object, object]] = []
+    def name(self, kind : str, value):
+        """Display name of an integer mode/state id, from the program's Modes.names/States.names"""
+        names = getattr(self.program.get(kind), "names", None)
+        if isinstance(value, int) and names != None and 0 <= value < len(names):
+            return names[value]
+        return value
+    def __call__(self, now : int):
+        current = (self.program.get("currentMode"), self.program.get("currentState"))
+        if current != self.last and current[0] != None:
+            self.last = current
+            self.changes.append((now, self.name("Modes", current[0]), self.name("States", current[1])))
+
+def setup(args, kernel : vex.Kernel):
+    """Builds the field and robot and resets the kernel for a new run"""
+    kernel.reset()
+    rng = random.Random(args.seed)
+    simField = field.Field(args.field[0], args.field[1])
+    simField.addRandomFruits(args.fruits, rng)
+    kernel.world = field.World(simField, args.start[0], args.start[1], args.start[2], rng, args.vision_noise)
+    kernel.limit = int(args.time * 1000000)
+    kernel.sdPath = args.sd
+    for text in args.input:
+        parseInput(kernel, text)
+
+def runProgram(path : str, kernel : vex.Kernel, program : dict, serial = None):
+    """Executes the program in the given globals until it returns or the time limit ends it. Returns the number of characters printed to serial."""
+    with open(path) as f:
+        code = compile(f.read(), path, "exec")
+    program.update({"__name__": "__main__", "__file__": path})
+    stdout = sys.stdout
+    sys.stdout = vex._Stdout(serial)
+    try:
+        exec(code, program)
+    except vex.SimulationEnd:
+        pass
+    finally:
+        serialChars = sys.stdout.chars
+        sys.stdout = stdout
+    if kernel.error != None:
+        raise kernel.error
+    return serialChars
+
+def numbers(text : str):
+    return [float(v) for v in text.split(",")]
+
+def parser():
+    p = argparse.ArgumentParser(description="Run a robot program on the simulated field.")
+    p.add_argument("program", nargs="?", default=projectMain())
+    p.add_argument("--time", type=float, default=60, help="simulated seconds to run")
+    p.add_argument("--input", action="append", default=[], help="TIME:BUTTON or TIME:axisN=VALUE")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--fruits", type=int, default=6)
+    p.add_argument("--field", type=numbers, default=[2440, 2440], help="WIDTH,HEIGHT in mm")
+    p.add_argument("--start", type=numbers, default=[1220, 350, 0], help="X,Y,HEADING of the robot center")
+    p.add_argument("--vision-noise", type=float, default=0, help="pixel standard deviation")
+    p.add_argument("--serial", choices=["quiet", "show"], default="quiet", help="show or drop the program's serial output")
+    p.add_argument("--sd", default=None, help="host directory to use as the SD card")
+    p.add_argument("--trace", action="store_true", help="print every mode/state change")
+    return p
+
+def main():
+    args = parser().parse_args()
+    kernel = vex.kernel
+    setup(args, kernel)
+    program = {}
+    trace = StateTrace(program)
+    if args.trace:
+        kernel.hooks.append(trace)
+
+    wallStart = time.perf_counter()
+    serialChars = runProgram(args.program, kernel, program, sys.stdout if args.serial == "show" else None)
+    wall = time.perf_counter() - wallStart
+
+    world = kernel.world
+    simulated = kernel.now / 1000000
+    for when, mode, state in trace.changes:
+        print("%9.3f  %s / %s" % (when / 1000000, mode, state))
+    print("simulated %.1f s in %.2f s (%.0fx real time)" % (simulated, wall, simulated / wall if wall > 0 else 0))
+    print("final: %s / %s" % (trace.name("Modes", program.get("currentMode")), trace.name("States", program.get("currentState"))))
+    print("fruits picked %d, scored %d, misplaced %d, dropped %d, left %d" % (world.picked, world.scored, world.misplaced, world.dropped, len(world.field.fruits)))
+    print("serial output %d characters" % serialChars)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,733 @@
+"""Pure Python stand-in for the VEX V5 `vex` module, for running robot programs on a desktop.
+
+Time is virtual. Every device call charges a modeled cost to the virtual clock and sleeps jump it forward, so a
+program runs as fast as the host can execute it. Threads are real host threads, but only the one holding the clock
+runs; the others wait until their wake time, which keeps every run deterministic. As on the brain, threads only
+switch when the running one sleeps, waits or makes a blocking call.
+
+The hardware is modeled by field.World. Use sim/run.py to run a program; it sets `kernel` up before the program
+imports this module.
+"""
+import heapq
+import os
+import threading
+from typing import Callable
+
+import field
+
+COSTS = {
+    "timer": 10,
+    "device": 40,
+    "adi": 20,
+    "command": 40,
+    "snapshot": 500,
+    "screen": 150,
+    "controllerScreen": 200,
+    "serialChar": 10,
+}
+"""modeled cost of each kind of call in microseconds of brain time"""
+
+class SimulationEnd(SystemExit):
+    """Raised in the program when the simulated time limit is reached"""
+
+class _Fiber:
+    def __init__(self, name : str):
+        self.name = name
+        self.event = threading.Event()
+
+class Kernel:
+    """Virtual clock and cooperative thread switcher"""
+    def __init__(self):
+        self.now = 0
+        """simulated time in microseconds"""
+        self.limit = None
+        self.world : field.World | None = None
+        self.queue = []
+        """heap of (wake time, sequence, fiber) for every fiber that is not running"""
+        self.seq = 0
+        self.main = _Fiber("main")
+        self.current = self.main
+        self.finished = False
+        self.error = None
+        self.inputs = []
+        """heap of (time, sequence, callable) input events"""
+        self.hooks : list[Callable[[int], None]] = []
+        """called with the time after every clock advance"""
+        self.costs = dict(COSTS)
+        self.controllers : list[Controller] = []
+        self.sdPath = None
+        """host directory backing the SD card, None to keep files in memory"""
+        self.nextEvent = 0
+        """earliest time handleEvents() has anything to do"""
+
+    def reset(self):
+        self.__init__()
+
+    # time
+    def charge(self, kind : str):
+        """Advances the clock by the modeled cost of a call. Never switches threads: like VEX's cooperative threads, the running thread
+        keeps the brain until it sleeps, waits or makes a blocking call, even if another thread became due in the meantime."""
+        self.now += self.costs[kind]
+        self.afterAdvance()
+    def chargeTime(self, us : int):
+        self.now += us
+        self.afterAdvance()
+    def sleep(self, us : int):
+        self.enqueue(self.current, self.now + max(0, int(us)))
+        self.switch()
+    def afterAdvance(self):
+        if self.now >= self.nextEvent:
+            self.handleEvents()
+    def handleEvents(self):
+        """Ends the run at the time limit, steps the physics and delivers inputs. Only runs when one of those is due."""
+        if self.limit != None and self.now >= self.limit:
+            self.finished = True
+        if self.finished:
+            self.end()
+        nextEvent = self.limit if self.limit != None else float("inf")
+        if self.world != None:
+            self.world.stepTo(self.now)
+            nextEvent = min(nextEvent, self.world.t + self.world.stepSize)
+        while self.inputs and self.inputs[0][0] <= self.now:
+            heapq.heappop(self.inputs)[2]()
+        if self.inputs:
+            nextEvent = min(nextEvent, self.inputs[0][0])
+        self.nextEvent = nextEvent
+        for hook in self.hooks:
+            hook(self.now)
+    def end(self):
+        if self.current is not self.main:
+            self.main.event.set() # the main fiber raises SimulationEnd when it wakes
+        raise SimulationEnd()
+
+    # fibers
+    def enqueue(self, fiber : _Fiber, wake : int):
+        self.seq += 1
+        heapq.heappush(self.queue, (wake, self.seq, fiber))
+    def switch(self):
+        """Passes the clock to the fiber due first, advancing time if it is not due yet"""
+        wake, _, fiber = heapq.heappop(self.queue)
+        if wake > self.now:
+            self.now = wake
+            self.afterAdvance()
+        if fiber is self.current:
+            return
+        previous = self.current
+        self.current = fiber
+        fiber.event.set()
+        previous.event.wait()
+        previous.event.clear()
+        if self.finished:
+            raise SimulationEnd()
+    def exitFiber(self):
+        """Passes the clock on for good from a fiber whose callback returned"""
+        wake, _, fiber = heapq.heappop(self.queue)
+        if wake > self.now:
+            self.now = wake
+        self.current = fiber
+        fiber.event.set()
+    def spawn(self, name : str, callback : Callable, args : tuple = ()):
+        fiber = _Fiber(name)
+        def body():
+            fiber.event.wait()
+            fiber.event.clear()
+            if self.finished:
+                return
+            try:
+                callback(*args)
+            except SimulationEnd:
+                return
+            except BaseException as e:
+                self.error = e
+                self.finished = True
+                self.main.event.set()
+                return
+            self.exitFiber()
+        thread = threading.Thread(target=body, name=name, daemon=True)
+        thread.start()
+        self.enqueue(fiber, self.now)
+        return fiber
+
+    # inputs
+    def at(self, seconds : float, action : Callable[[], None]):
+        """Schedules an input event (button press, axis move) at a simulated time"""
+        self.seq += 1
+        heapq.heappush(self.inputs, (int(seconds * 1000000), self.seq, action))
+        self.nextEvent = 0
+
+kernel = Kernel()
+
+# enums
+class _Enum:
+    def __init__(self, kind : str, name : str, value = None):
+        self.kind = kind
+        self.name = name
+        self.value = value
+    def __repr__(self):
+        return self.kind + "." + self.name
+
+class DirectionType:
+    FORWARD = _Enum("DirectionType", "FORWARD", 1)
+    REVERSE = _Enum("DirectionType", "REVERSE", -1)
+    UNDEFINED = _Enum("DirectionType", "UNDEFINED", 0)
+class VelocityUnits:
+    PERCENT = _Enum("VelocityUnits", "PERCENT")
+    RPM = _Enum("VelocityUnits", "RPM")
+    DPS = _Enum("VelocityUnits", "DPS")
+class PercentUnits:
+    PERCENT = VelocityUnits.PERCENT
+class RotationUnits:
+    DEG = _Enum("RotationUnits", "DEG")
+    REV = _Enum("RotationUnits", "REV")
+    RAW = _Enum("RotationUnits", "RAW")
+class TimeUnits:
+    SECONDS = _Enum("TimeUnits", "SECONDS")
+    MSEC = _Enum("TimeUnits", "MSEC")
+class DistanceUnits:
+    MM = _Enum("DistanceUnits", "MM")
+    IN = _Enum("DistanceUnits", "IN")
+    CM = _Enum("DistanceUnits", "CM")
+class TorqueUnits:
+    NM = _Enum("TorqueUnits", "NM")
+    INLB = _Enum("TorqueUnits", "INLB")
+class CurrentUnits:
+    AMP = _Enum("CurrentUnits", "AMP")
+class TemperatureUnits:
+    CELSIUS = _Enum("TemperatureUnits", "CELSIUS")
+    FAHRENHEIT = _Enum("TemperatureUnits", "FAHRENHEIT")
+class BrakeType:
+    COAST = _Enum("BrakeType", "COAST")
+    BRAKE = _Enum("BrakeType", "BRAKE")
+    HOLD = _Enum("BrakeType", "HOLD")
+class GearSetting:
+    RATIO_36_1 = _Enum("GearSetting", "RATIO_36_1")
+    RATIO_18_1 = _Enum("GearSetting", "RATIO_18_1")
+    RATIO_6_1 = _Enum("GearSetting", "RATIO_6_1")
+class AxisType:
+    XAXIS = _Enum("AxisType", "XAXIS")
+    YAXIS = _Enum("AxisType", "YAXIS")
+    ZAXIS = _Enum("AxisType", "ZAXIS")
+class OrientationType:
+    ROLL = _Enum("OrientationType", "ROLL")
+    PITCH = _Enum("OrientationType", "PITCH")
+    YAW = _Enum("OrientationType", "YAW")
+
+FORWARD = DirectionType.FORWARD
+REVERSE = DirectionType.REVERSE
+PERCENT = VelocityUnits.PERCENT
+RPM = VelocityUnits.RPM
+DPS = VelocityUnits.DPS
+DEGREES = RotationUnits.DEG
+TURNS = RotationUnits.REV
+SECONDS = TimeUnits.SECONDS
+MSEC = TimeUnits.MSEC
+MM = DistanceUnits.MM
+INCHES = DistanceUnits.IN
+NM = TorqueUnits.NM
+AMP = CurrentUnits.AMP
+CELSIUS = TemperatureUnits.CELSIUS
+COAST = BrakeType.COAST
+BRAKE = BrakeType.BRAKE
+HOLD = BrakeType.HOLD
+XAXIS = AxisType.XAXIS
+YAXIS = AxisType.YAXIS
+ZAXIS = AxisType.ZAXIS
+ROLL = OrientationType.ROLL
+PITCH = OrientationType.PITCH
+YAW = OrientationType.YAW
+
+class Ports:
+    pass
+for _i in range(1, 22):
+    setattr(Ports, "PORT" + str(_i), _i - 1)
+
+# time and threads
+def sleep(duration, units = MSEC):
+    kernel.sleep(duration * 1000000 if units == SECONDS else duration * 1000)
+
+def wait(duration, units = MSEC):
+    sleep(duration, units)
+
+class Thread:
+    def __init__(self, callback : Callable, args : tuple | None = None):
+        self.fiber = kernel.spawn(getattr(callback, "__name__", "thread"), callback, args if args != None else ())
+    @staticmethod
+    def sleep_for(duration, units = MSEC):
+        sleep(duration, units)
+    @staticmethod
+    def sleep_until(time, units = MSEC):
+        target = time * 1000000 if units == SECONDS else time * 1000
+        kernel.sleep(target - kernel.now)
+    def stop(self):
+        pass
+
+class Timer:
+    def __init__(self):
+        self.start = kernel.now
+    def time(self, units = MSEC):
+        kernel.charge("timer")
+        elapsed = kernel.now - self.start
+        return elapsed / 1000000 if units == SECONDS else elapsed // 1000
+    def value(self):
+        return self.time(SECONDS)
+    def clear(self):
+        self.start = kernel.now
+    def reset(self):
+        self.clear()
+    def system(self):
+        kernel.charge("timer")
+        return kernel.now // 1000
+    def system_high_res(self):
+        kernel.charge("timer")
+        return kernel.now
+
+def _percentOf(value, units, maxRpm):
+    if units == RPM:
+        return value
+    if units == DPS:
+        return value / 6
+    return value / 100 * maxRpm
+
+def _fromDegrees(value, units):
+    if units == TURNS:
+        return value / 360
+    return value
+
+def _toDegrees(value, units):
+    if units == TURNS:
+        return value * 360
+    return value
+
+# brain
+class _Screen:
+    def __init__(self, rows : int, cost : str):
+        self.rows = [""] * rows
+        self.row = 1
+        self.cost = cost
+    def set_cursor(self, row, col):
+        kernel.charge(self.cost)
+        self.row = row
+    def print(self, *args, sep = " "):
+        kernel.charge(self.cost)
+        if 1 <= self.row <= len(self.rows):
+            self.rows[self.row - 1] = sep.join(str(a) for a in args)
+    def clear_screen(self, *args):
+        kernel.charge(self.cost)
+        self.rows = [""] * len(self.rows)
+    def clear_line(self, row = None, *args):
+        kernel.charge(self.cost)
+        row = self.row if row == None else row
+        if 1 <= row <= len(self.rows):
+            self.rows[row - 1] = ""
+    def new_line(self):
+        self.row += 1
+    def next_row(self):
+        self.row += 1
+    def __getattr__(self, name):
+        # drawing, fonts and colors are accepted and ignored
+        def ignored(*args, **kwargs):
+            kernel.charge(self.cost)
+        return ignored
+
+class TriportPort:
+    def __init__(self, letter : str):
+        self.letter = letter
+
+class Triport:
+    TriportPort = TriportPort
+    def __init__(self, port = None):
+        for letter in "abcdefgh":
+            setattr(self, letter, TriportPort(letter))
+
+class _Sdcard:
+    """In memory SD card, or a host directory if kernel.sdPath is set"""
+    def __init__(self):
+        self.files : dict[str, bytes] = {}
+    def _path(self, name):
+        return os.path.join(kernel.sdPath, name)
+    def is_inserted(self):
+        return True
+    def exists(self, name):
+        if kernel.sdPath != None:
+            return os.path.exists(self._path(name))
+        return name in self.files
+    def filesize(self, name):
+        data = self.loadfile(name)
+        return 0 if data == None else len(data)
+    def loadfile(self, name, *args):
+        kernel.charge("device")
+        if kernel.sdPath != None:
+            try:
+                with open(self._path(name), "rb") as f:
+                    return bytearray(f.read())
+            except OSError:
+                return None
+        data = self.files.get(name)
+        return None if data == None else bytearray(data)
+    def savefile(self, name, data = bytearray()):
+        kernel.charge("device")
+        kernel.chargeTime(len(data) // 4)
+        if kernel.sdPath != None:
+            with open(self._path(name), "wb") as f:
+                f.write(bytes(data))
+        else:
+            self.files[name] = bytes(data)
+        return len(data)
+    def appendfile(self, name, data = bytearray()):
+        kernel.charge("device")
+        kernel.chargeTime(len(data) // 4)
+        if kernel.sdPath != None:
+            with open(self._path(name), "ab") as f:
+                f.write(bytes(data))
+        else:
+            self.files[name] = self.files.get(name, b"") + bytes(data)
+        return len(data)
+
+class _Battery:
+    def capacity(self, *args):
+        return 100
+    def voltage(self, *args):
+        return 12.8
+    def current(self, *args):
+        return 2.0
+    def temperature(self, *args):
+        return 30
+
+class Brain:
+    def __init__(self):
+        self.screen = _Screen(20, "screen")
+        self.timer = Timer()
+        self.timer.start = 0
+        self.three_wire_port = Triport()
+        self.sdcard = _Sdcard()
+        self.battery = _Battery()
+
+# controller
+class _Axis:
+    def __init__(self):
+        self.current = 0
+    def position(self, *args):
+        kernel.charge("device")
+        return self.current
+    def value(self):
+        return self.position()
+
+class _Button:
+    def __init__(self, name : str):
+        self.name = name
+        self.down = False
+        self.pressedCallbacks = []
+        self.releasedCallbacks = []
+    def pressing(self):
+        kernel.charge("device")
+        return self.down
+    def pressed(self, callback, args = ()):
+        self.pressedCallbacks.append((callback, args))
+    def released(self, callback, args = ()):
+        self.releasedCallbacks.append((callback, args))
+    def set(self, down : bool):
+        if down == self.down:
+            return
+        self.down = down
+        for callback, args in (self.pressedCallbacks if down else self.releasedCallbacks):
+            kernel.spawn(self.name, callback, tuple(args))
+
+class Controller:
+    BUTTONS = ("A", "B", "X", "Y", "Up", "Down", "Left", "Right", "L1", "L2", "R1", "R2")
+    def __init__(self, *args):
+        for i in range(1, 5):
+            setattr(self, "axis" + str(i), _Axis())
+        for name in Controller.BUTTONS:
+            setattr(self, "button" + name, _Button(name))
+        self.screen = _Screen(3, "controllerScreen")
+        self.rumbles = []
+        kernel.controllers.append(self)
+    def rumble(self, pattern):
+        kernel.charge("controllerScreen")
+        self.rumbles.append((kernel.now, pattern))
+    def button(self, name : str) -> _Button:
+        for candidate in Controller.BUTTONS:
+            if candidate.lower() == name.lower():
+                return getattr(self, "button" + candidate)
+        raise ValueError("Unknown button " + name)
+
+# smart devices
+class Motor:
+    def __init__(self, port, *args):
+        gearing = GearSetting.RATIO_18_1
+        self.reversed = False
+        for arg in args:
+            if isinstance(arg, _Enum) and arg.kind == "GearSetting":
+                gearing = arg
+            elif isinstance(arg, bool):
+                self.reversed = arg
+        self.port = port
+        self.state = kernel.world.motor(port, gearing.name)
+        self.defaultVelocity = 50
+        self.defaultVelocityUnits = PERCENT
+        self.stopping = BRAKE
+    def _rpm(self, direction, velocity, units):
+        if velocity == None:
+            velocity = self.defaultVelocity
+            units = self.defaultVelocityUnits
+        rpm = _percentOf(velocity, units, self.state.maxRpm)
+        return -rpm if direction == REVERSE else rpm
+    def spin(self, direction, velocity = None, units = RPM):
+        kernel.charge("command")
+        self.state.command("velocity", self._rpm(direction, velocity, units))
+    def stop(self, mode = None):
+        kernel.charge("command")
+        self.state.command("stop")
+    def spin_to_position(self, rotation, units = DEGREES, velocity = None, units_v = RPM, wait = True):
+        kernel.charge("command")
+        self.state.command("position", self._rpm(FORWARD, velocity, units_v), _toDegrees(rotation, units))
+        if wait:
+            self._waitDone()
+    def spin_for(self, direction, rotation, units = DEGREES, velocity = None, units_v = RPM, wait = True):
+        kernel.charge("command")
+        if units in (SECONDS, MSEC):
+            self.spin(direction, velocity, units_v)
+            if wait:
+                sleep(rotation, units)
+                self.stop()
+            return
+        delta = _toDegrees(rotation, units) * (-1 if direction == REVERSE else 1)
+        self.state.command("position", self._rpm(FORWARD, velocity, units_v), self.state.position - self.state.offset + delta)
+        if wait:
+            self._waitDone()
+    def _waitDone(self):
+        for _ in range(1000):
+            if self.state.isDone():
+                return
+            sleep(10)
+    def is_done(self):
+        kernel.charge("device")
+        return self.state.isDone()
+    def is_spinning(self):
+        return not self.is_done()
+    def position(self, units = DEGREES):
+        kernel.charge("device")
+        return _fromDegrees(self.state.position - self.state.offset, units)
+    def set_position(self, value, units = DEGREES):
+        kernel.charge("command")
+        self.state.offset = self.state.position - _toDegrees(value, units)
+    def reset_position(self):
+        self.set_position(0)
+    def velocity(self, units = RPM):
+        kernel.charge("device")
+        if units == PERCENT:
+            return self.state.velocity / self.state.maxRpm * 100
+        if units == DPS:
+            return self.state.velocity * 6
+        return self.state.velocity
+    def torque(self, units = NM):
+        kernel.charge("device")
+        return self.state.torque()
+    def current(self, units = AMP):
+        kernel.charge("device")
+        return self.state.torque() * 2.5
+    def power(self, *args):
+        kernel.charge("device")
+        return abs(self.state.torque() * self.state.velocity * 0.1047)
+    def efficiency(self, *args):
+        return 50
+    def temperature(self, units = CELSIUS):
+        kernel.charge("device")
+        return 30
+    def set_stopping(self, mode):
+        self.stopping = mode
+    def set_max_torque(self, value, units = PERCENT):
+        if units == PERCENT:
+            self.state.maxTorque = self.state.stallTorque * value / 100
+        else:
+            self.state.maxTorque = value
+    def set_reversed(self, value : bool):
+        self.reversed = value
+    def set_velocity(self, value, units = RPM):
+        self.defaultVelocity = value
+        self.defaultVelocityUnits = units
+    def set_timeout(self, *args):
+        pass
+    def installed(self):
+        return True
+
+class MotorGroup:
+    def __init__(self, *motors):
+        self.motors = list(motors)
+    def spin(self, direction, velocity = None, units = RPM):
+        for motor in self.motors:
+            motor.spin(direction, velocity, units)
+    def stop(self, mode = None):
+        for motor in self.motors:
+            motor.stop(mode)
+    def spin_to_position(self, rotation, units = DEGREES, velocity = None, units_v = RPM, wait = True):
+        for motor in self.motors:
+            motor.spin_to_position(rotation, units, velocity, units_v, False)
+        if wait:
+            self.motors[0]._waitDone()
+    def spin_for(self, direction, rotation, units = DEGREES, velocity = None, units_v = RPM, wait = True):
+        for motor in self.motors:
+            motor.spin_for(direction, rotation, units, velocity, units_v, False)
+        if wait:
+            self.motors[0]._waitDone()
+    def is_done(self):
+        return all(motor.is_done() for motor in self.motors)
+    def is_spinning(self):
+        return not self.is_done()
+    def position(self, units = DEGREES):
+        return self.motors[0].position(units)
+    def set_position(self, value, units = DEGREES):
+        for motor in self.motors:
+            motor.set_position(value, units)
+    def velocity(self, units = RPM):
+        return sum(motor.velocity(units) for motor in self.motors) / len(self.motors)
+    def torque(self, units = NM):
+        return sum(motor.torque(units) for motor in self.motors)
+    def current(self, units = AMP):
+        return sum(motor.current(units) for motor in self.motors)
+    def set_stopping(self, mode):
+        for motor in self.motors:
+            motor.set_stopping(mode)
+    def set_max_torque(self, value, units = PERCENT):
+        for motor in self.motors:
+            motor.set_max_torque(value, units)
+    def set_velocity(self, value, units = RPM):
+        for motor in self.motors:
+            motor.set_velocity(value, units)
+    def count(self):
+        return len(self.motors)
+
+class Inertial:
+    calibrationTime = 2000000
+    def __init__(self, port = None):
+        self.port = port
+        self.headingOffset = 0.0
+        self.rotationOffset = 0.0
+        self.calibratedAt = None
+    def _raw(self):
+        kernel.charge("device")
+        return kernel.world.heading
+    def calibrate(self):
+        kernel.charge("command")
+        self.calibratedAt = kernel.now + Inertial.calibrationTime
+        self.headingOffset = kernel.world.heading
+        self.rotationOffset = kernel.world.heading
+    def is_calibrating(self):
+        kernel.charge("device")
+        return self.calibratedAt != None and kernel.now < self.calibratedAt
+    def heading(self, units = DEGREES):
+        return (self._raw() - self.headingOffset) % 360
+    def rotation(self, units = DEGREES):
+        return self._raw() - self.rotationOffset
+    def set_heading(self, value, units = DEGREES):
+        self.headingOffset = self._raw() - value
+    def set_rotation(self, value, units = DEGREES):
+        self.rotationOffset = self._raw() - value
+    def reset_heading(self):
+        self.set_heading(0)
+    def reset_rotation(self):
+        self.set_rotation(0)
+    def orientation(self, axis, units = DEGREES):
+        kernel.charge("device")
+        if axis == YAW:
+            return ((kernel.world.heading - self.headingOffset + 180) % 360) - 180
+        return 0.0
+    def acceleration(self, axis):
+        kernel.charge("device")
+        return 0.0
+    def gyro_rate(self, axis, units = DPS):
+        kernel.charge("device")
+        return kernel.world.turnRate if axis == ZAXIS else 0.0
+    def installed(self):
+        return True
+
+class Sonar:
+    def __init__(self, port : TriportPort):
+        self.back = port.letter == "c"
+    def distance(self, units = MM):
+        kernel.charge("adi")
+        d = min(kernel.world.sonar(self.back), 3000)
+        if units == INCHES:
+            return d / 25.4
+        if units == DistanceUnits.CM:
+            return d / 10
+        return d
+    def found_object(self):
+        return self.distance() < 3000
+
+class Line:
+    def __init__(self, port : TriportPort):
+        self.left = port.letter == "f"
+    def value(self, units = PERCENT):
+        kernel.charge("adi")
+        v = kernel.world.line(self.left)
+        return v if units == PERCENT else int(v / 100 * 4095)
+    def reflectivity(self, units = PERCENT):
+        return 100 - self.value(units)
+
+class Signature:
+    def __init__(self, index, *args):
+        self.id = index
+
+class VisionObject:
+    def __init__(self, id = 0, centerX = 0, centerY = 0, width = 0, height = 0):
+        self.id = id
+        self.centerX = centerX
+        self.centerY = centerY
+        self.width = width
+        self.height = height
+        self.originX = centerX - width // 2
+        self.originY = centerY - height // 2
+        self.angle = 0
+        self.exists = width > 0 and height > 0
+    def __repr__(self):
+        return "VisionObject(" + str(self.id) + ", " + str(self.centerX) + ", " + str(self.centerY) + ", " + str(self.width) + ", " + str(self.height) + ")"
+
+class Vision:
+    def __init__(self, port, brightness = 50, *signatures):
+        self.port = port
+        self.signatures = signatures
+        self.objects : tuple = ()
+        self.object_count = 0
+    def take_snapshot(self, signature, count = 8):
+        kernel.charge("snapshot")
+        sig = signature.id - 1 if isinstance(signature, Signature) else int(signature) - 1
+        found = kernel.world.visionObjects(sig)[:count]
+        self.objects = tuple(VisionObject(sig + 1, *o) for o in found)
+        self.object_count = len(self.objects)
+        return self.objects if self.object_count > 0 else None
+    def largest_object(self):
+        kernel.charge("device")
+        if self.object_count == 0:
+            return VisionObject()
+        return self.objects[0]
+    def installed(self):
+        return True
+
+class Event:
+    def __init__(self, callback = None, args = ()):
+        self.callbacks = []
+        if callback != None:
+            self.callbacks.append((callback, args))
+    def __call__(self, callback, args = ()):
+        self.callbacks.append((callback, args))
+    def broadcast(self):
+        for callback, args in self.callbacks:
+            kernel.spawn("event", callback, tuple(args))
+
+class _Stdout:
+    """Serial port: charges the modeled cost of every character and forwards or drops the text"""
+    def __init__(self, sink = None):
+        self.sink = sink
+        self.chars = 0
+    def write(self, text):
+        self.chars += len(text)
+        kernel.now += len(text) * kernel.costs["serialChar"] # picked up by the next device call
+        if self.sink != None:
+            self.sink.write(text)
+        return len(text)
+    def flush(self):
+        if self.sink != None:
+            self.sink.flush()
+
+__all__ = [name for name in list(globals()) if not name.startswith("_") and name not in ("heapq", "os", "threading", "field", "COSTS", "Kernel", "kernel", "SimulationEnd")]
@@ -0,0 +1,123 @@
+"""Reads the flight recorder logs (flightN.bin + flightN.txt) that main-auto-tweaks.py writes to the SD card.
+
+    python tools/flightlog.py /media/sd/flight0          # summary: duration, dropped cycles, time per state
+    python tools/flightlog.py flight0 --fields heading sonarB cmdFL
+
+From Python, load() memory-maps the records as a NumPy structured array, so a whole match loads instantly:
+
+    log = flightlog.load("flight0")
+    turning = log.records["state"] == log.idOf("state", "Turning")
+    print(log.seconds[turning], log["gyroRate"][turning])
+"""
+import argparse
+import os
+import re
+
+import numpy as np
+
+TYPES = {"I": "u4", "i": "i4", "H": "u2", "h": "i2", "B": "u1", "b": "i1", "f": "f4", "d": "f8"}
+"""struct format characters to NumPy types"""
+
+def readDescription(path : str):
+    """Returns (struct format, field names, {"mode": {id: name}, "state": {id: name}}) from a flightN.txt file"""
+    format = None
+    fields = []
+    names = {"mode": {}, "state": {}}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.rstrip("\n").partition(" ")
+            if key == "format":
+                format = value
+            elif key == "fields":
+                fields = value.split()
+            elif key in names:
+                id, _, name = value.partition(" ")
+                names[key][int(id)] = name
+    if format == None:
+        raise ValueError(path + " has no format line")
+    return format, fields, names
+
+def dtypeOf(format : str, fields : list):
+    """NumPy record type matching a little endian struct format with one name per value"""
+    if not format.startswith("<"):
+        raise ValueError("only little endian (<) formats are supported: " + format)
+    types = []
+    for count, code in re.findall(r"(\d*)([a-zA-Z])", format[1:]):
+        types += ["<" + TYPES[code]] * (int(count) if count else 1)
+    if len(types) != len(fields):
+        raise ValueError("format " + format + " has " + str(len(types)) + " values but there are " + str(len(fields)) + " field names")
+    return np.dtype({"names": fields, "formats": types, "itemsize": sum(np.dtype(t).itemsize for t in types)})
+
+class FlightLog:
+    def __init__(self, path : str):
+        base = path[:-4] if path.endswith(".bin") or path.endswith(".txt") else path
+        self.format, self.fields, self.names = readDescription(base + ".txt")
+        self.dtype = dtypeOf(self.format, self.fields)
+        size = os.path.getsize(base + ".bin")
+        count = size // self.dtype.itemsize
+        self.records = np.memmap(base + ".bin", dtype=self.dtype, mode="r", shape=(count,)) if count > 0 else np.zeros(0, self.dtype)
+        """one record per control cycle"""
+        self.seconds = self.unwrapped("t") / 1000000
+        """time of each record in seconds, unwrapped"""
+        cycles = self.unwrapped("cycle", 65536)
+        self.dropped = np.concatenate(([0], np.diff(cycles) - 1)) if len(cycles) > 0 else cycles
+        """number of cycles missing before each record (the recorder fell behind)"""
+
+    def __getitem__(self, field : str):
+        return self.records[field]
+    def __len__(self):
+        return len(self.records)
+
+    def unwrapped(self, field : str, period : int = 2**32):
+        """Cumulative values of a counter field that wraps at period"""
+        values = self.records[field].astype(np.int64)
+        if len(values) == 0:
+            return values
+        steps = np.diff(values) % period
+        return values[0] + np.concatenate(([0], np.cumsum(steps)))
+
+    def idOf(self, field : str, name : str):
+        """Id of a mode or state name. field is "mode" or "state"."""
+        for id, n in self.names[field].items():
+            if n == name:
+                return id
+        raise KeyError(name)
+    def nameOf(self, field : str, id : int):
+        return self.names[field].get(int(id), str(id))
+
+    def timeIn(self, field : str):
+        """Seconds spent with each value of an id field (mode or state), as {name: seconds}"""
+        if len(self) < 2:
+            return {}
+        durations = np.diff(self.seconds)
+        ids = self.records[field][:-1]
+        return {self.nameOf(field, id): float(durations[ids == id].sum()) for id in np.unique(ids)}
+
+def load(path : str):
+    """Memory-maps a flight log. path may be the .bin or .txt file or their common name without extension."""
+    return FlightLog(path)
+
+def summary(log : FlightLog):
+    if len(log) == 0:
+        print("no records")
+        return
+    duration = log.seconds[-1] - log.seconds[0]
+    print("%d records over %.1f s (%.0f per second), %d cycles dropped" % (len(log), duration, len(log) / duration if duration > 0 else 0, log.dropped.sum()))
+    for label, field in (("mode", "mode"), ("state", "state")):
+        print("time per " + label + ":")
+        for name, seconds in sorted(log.timeIn(field).items(), key=lambda item: -item[1]):
+            print("  %8.2f s  %s" % (seconds, name))
+
+def main():
+    p = argparse.ArgumentParser(description="Summarize a flight recorder log.")
+    p.add_argument("log", help="flightN, flightN.bin or flightN.txt")
+    p.add_argument("--fields", nargs="*", default=[], help="also print min/mean/max of these fields")
+    args = p.parse_args()
+    log = load(args.log)
+    summary(log)
+    for field in args.fields:
+        values = log[field]
+        print("%s: min %.3f mean %.3f max %.3f" % (field, values.min(), values.mean(), values.max()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Compares the run summaries (runN.csv) that main-auto-tweaks.py saves to the SD card at the end of each run.
+
+    python tools/runstats.py /media/sd/run0.csv                 # one run: its cycles and the time per state
+    python tools/runstats.py before/run3.csv after/run0.csv     # several runs side by side
+
+Each line of a run file starts with its kind (run, cycle, mode or state); a line starting with # names the columns of that kind.
+"""
+import argparse
+import os
+
+PHASES = ["search", "approach", "grasp", "stow", "return"]
+
+class RunFile:
+    def __init__(self, path : str):
+        self.path = path
+        self.name = os.path.basename(os.path.dirname(os.path.abspath(path))) + "/" + os.path.basename(path)
+        self.rows : dict[str, list[dict]] = {}
+        """rows of each kind, as {column: value}"""
+        columns = {}
+        with open(path) as f:
+            for line in f:
+                values = line.rstrip("\n").split(",")
+                if values[0].startswith("#"):
+                    columns[values[0][1:]] = values[1:]
+                elif values[0] in columns:
+                    self.rows.setdefault(values[0], []).append(dict(zip(columns[values[0]], values[1:])))
+        run = self.rows.get("run", [{}])[0]
+        self.seconds = float(run.get("seconds", 0))
+        self.fruits = int(run.get("fruits", 0))
+        self.cycles = self.rows.get("cycle", [])
+
+    def phaseTotal(self, phase : str):
+        return sum(float(c[phase]) for c in self.cycles)
+
+    def perFruit(self, phase : str):
+        """Seconds per collected fruit spent in a phase, None without fruit"""
+        return self.phaseTotal(phase) / self.fruits if self.fruits > 0 else None
+
+    def stateTimes(self):
+        """{(mode, state): seconds}"""
+        return {(r["mode"], r["name"]): float(r["seconds"]) for r in self.rows.get("state", [])}
+
+def cell(value):
+    return "%10s" % "-" if value == None else "%10.2f" % value
+
+def single(run : RunFile):
+    print("%s: %.1f s, %d cycles, %d fruits" % (run.name, run.seconds, len(run.cycles), run.fruits))
+    print("  cycle fruit " + "".join("%10s" % p for p in PHASES) + "     total")
+    for c in run.cycles:
+        print("  %5s %5s " % (c["number"], "yes" if c["fruit"] == "1" else "no") + "".join(cell(float(c[p])) for p in PHASES) + cell(float(c["total"])))
+    print("time per state:")
+    for (mode, state), seconds in sorted(run.stateTimes().items(), key=lambda item: -item[1]):
+        print("  %8.2f s  %s / %s" % (seconds, mode, state))
+
+def compare(runs : list):
+    print("%-24s" % "" + "".join("%20s" % run.name[-20:] for run in runs))
+    print("%-24s" % "run seconds" + "".join("%20.2f" % run.seconds for run in runs))
+    print("%-24s" % "fruits" + "".join("%20d" % run.fruits for run in runs))
+    print("%-24s" % "seconds per fruit" + "".join("%20s" % ("-" if run.fruits == 0 else "%.2f" % (run.seconds / run.fruits)) for run in runs))
+    for phase in PHASES:
+        print("%-24s" % (phase + " per fruit") + "".join("%20s" % ("-" if run.perFruit(phase) == None else "%.2f" % run.perFruit(phase)) for run in runs))
+    print("time per state:")
+    keys = set()
+    for run in runs:
+        keys |= set(run.stateTimes())
+    for key in sorted(keys, key=lambda k: -max(run.stateTimes().get(k, 0) for run in runs)):
+        print("  %-22s" % key[1][:22] + "".join("%20.2f" % run.stateTimes().get(key, 0) for run in runs))
+
+def main():
+    p = argparse.ArgumentParser(description="Summarize or compare run summaries.")
+    p.add_argument("runs", nargs="+", help="runN.csv files")
+    args = p.parse_args()
+    runs = [RunFile(path) for path in args.runs]
+    if len(runs) == 1:
+        single(runs[0])
+    else:
+        compare(runs)
+
+if __name__ == "__main__":
+    main()